@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""Splitting of outbound messages into E1381 frames
+
+Compares the previous byte-wise `make_chunks` with the slice based chunker
+on messages from 1 KB to 1 MB split into frames of `MAX_FRAME_SIZE`, and the
+frame by frame encoding of order records with the previous `iter_encode` and
+the current one.
+"""
+
+from common import report
+from common import timeit
+from senaite.astm import codec
+from senaite.astm.compat import unicode
+from senaite.astm.constants import COMPONENT_SEP
+from senaite.astm.constants import CR
+from senaite.astm.constants import CRLF
+from senaite.astm.constants import ENCODING
+from senaite.astm.constants import ETB
+from senaite.astm.constants import ETX
+from senaite.astm.constants import FIELD_SEP
+from senaite.astm.constants import MAX_FRAME_SIZE
+from senaite.astm.constants import RECORD_SEP
+from senaite.astm.constants import REPEAT_SEP
+from senaite.astm.constants import STX
+from senaite.astm.utils import split
+
+try:
+    from itertools import izip_longest
+except ImportError:  # Python 3
+    from itertools import zip_longest as izip_longest
+
+try:
+    from collections import Iterable
+except ImportError:  # Python 3
+    from collections.abc import Iterable
+
+SIZES = (1024, 10 * 1024, 100 * 1024, 1024 * 1024)
+
+
+def make_checksum(message):
+    return hex(sum(message) & 0xFF)[2:].upper().zfill(2).encode()
+
+
+def make_chunks_bytewise(s, n):
+    iter_bytes = (s[i:i + 1] for i in range(len(s)))
+    return [b''.join(item)
+            for item in izip_longest(*[iter_bytes] * n, fillvalue=b'')]
+
+
+def split_bytewise(msg, size):
+    frame, msg = int(msg[1:2]), msg[2:-6]
+    chunks = make_chunks_bytewise(msg, size - 7)
+    chunks, last = chunks[:-1], chunks[-1]
+    idx = 0
+    for idx, chunk in enumerate(chunks):
+        item = b"".join([str((idx + frame) % 8).encode(), chunk, ETB])
+        yield b"".join([STX, item, make_checksum(item)])
+    item = b"".join([str((idx + frame + 1) % 8).encode(), last, CR, ETX])
+    yield b"".join([STX, item, make_checksum(item)])
+
+
+def encode_record(record):
+    fields = []
+    for field in record:
+        if isinstance(field, bytes):
+            fields.append(field)
+        elif isinstance(field, unicode):
+            fields.append(field.encode(ENCODING))
+        elif isinstance(field, Iterable):
+            fields.append(encode_component(field))
+        elif field is None:
+            fields.append(b"")
+        else:
+            fields.append(unicode(field).encode(ENCODING))
+    return FIELD_SEP.join(fields)
+
+
+def encode_component(component):
+    items = []
+    for item in component:
+        if isinstance(item, bytes):
+            items.append(item)
+        elif isinstance(item, unicode):
+            items.append(item.encode(ENCODING))
+        elif isinstance(item, Iterable):
+            return REPEAT_SEP.join(encode_component(i) for i in component)
+        elif item is None:
+            items.append(b"")
+        else:
+            items.append(unicode(item).encode(ENCODING))
+    return COMPONENT_SEP.join(items).rstrip(COMPONENT_SEP)
+
+
+def iter_encode_baseline(records, size):
+    """The previous `iter_encode`, which split a message per record
+    """
+    seq = 1
+    for record in records:
+        data = b"".join((str(seq % 8).encode(), encode_record(record),
+                         RECORD_SEP, ETX))
+        msg = b"".join([STX, data, make_checksum(data), CRLF])
+        if len(msg) > size:
+            for chunk in split_bytewise(msg, size):
+                seq += 1
+                yield chunk
+        else:
+            seq += 1
+            yield msg
+
+
+def get_records(size):
+    """Returns order records with the given encoded size in total
+    """
+    records = []
+    total = 0
+    seq = 0
+    while total < size:
+        seq += 1
+        record = ["O", str(seq), "SPECIMEN-%06d" % seq, None,
+                  [["", "", "", code] for code in ("NA", "K", "CL", "GLU")],
+                  "R", "20250514121638"]
+        records.append(record)
+        total += len(codec.encode_record(record)) + 1
+    return records
+
+
+def main():
+    for size in SIZES:
+        records = get_records(size)
+        msg = codec.encode_message(1, records)
+        kb = len(msg) / 1024.
+        repeat = 3 if size > 100 * 1024 else 5
+
+        elapsed = timeit(lambda: list(split_bytewise(msg, MAX_FRAME_SIZE)),
+                         repeat=repeat)
+        report("{:,.0f} KB: byte-wise split".format(kb), kb / elapsed,
+               "KB/s")
+        elapsed = timeit(lambda: list(split(msg, MAX_FRAME_SIZE)),
+                         repeat=repeat)
+        report("{:,.0f} KB: slice split".format(kb), kb / elapsed, "KB/s")
+        elapsed = timeit(
+            lambda: list(iter_encode_baseline(records, MAX_FRAME_SIZE)),
+            repeat=repeat)
+        report("{:,.0f} KB: previous iter_encode".format(kb), kb / elapsed,
+               "KB/s")
+        elapsed = timeit(
+            lambda: list(codec.iter_encode(records, size=MAX_FRAME_SIZE)),
+            repeat=repeat)
+        report("{:,.0f} KB: iter_encode".format(kb), kb / elapsed, "KB/s")
+
+
+if __name__ == "__main__":
+    main()
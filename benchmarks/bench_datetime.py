@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""Validation of the date and time strings of the records
+
+Compares the strptime/strftime round trip of the date and time fields with
+the fixed width digit validation, with and without the memo of validated
+values, on the timestamps of the test corpus.
+"""
+
+import datetime
+
+from bench_records import get_records
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm import fields
+
+NUMBER = 20
+
+
+def get_timestamps(corpus):
+    """Returns the (field, value) tuples of all date and time fields
+    """
+    values = []
+    types = (fields.DateField, fields.TimeField, fields.DateTimeField)
+    for cls, record in get_records(corpus):
+        for (name, field), value in zip(cls._fields, record):
+            if type(field) in types and isinstance(value, str) and value:
+                values.append((field, value))
+    return values
+
+
+def main():
+    timestamps = get_timestamps(get_corpus())
+    count = NUMBER * len(timestamps)
+
+    def round_trip():
+        for field, value in timestamps:
+            datetime.datetime.strptime(value, field.format).strftime(
+                field.format)
+
+    def digits():
+        for memo in (fields.DateField.memo, fields.TimeField.memo,
+                     fields.DateTimeField.memo):
+            memo.clear()
+        for field, value in timestamps:
+            field._set_value(value)
+
+    def memo():
+        for field, value in timestamps:
+            field._set_value(value)
+
+    report("timestamps in corpus", len(timestamps), "values")
+    for name, func in (("strptime round trip", round_trip),
+                       ("fixed width digits, cold memo", digits),
+                       ("fixed width digits, warm memo", memo)):
+        elapsed = timeit(func, number=NUMBER)
+        report(name, count / elapsed, "values/s")
+
+
+if __name__ == "__main__":
+    main()
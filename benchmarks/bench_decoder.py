@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Decoding of large archives of ASTM frames
+
+Compares the decoding of an archive with all transfers of the test corpus
+repeated, where the chunked messages are first joined and decoded as a whole,
+with the record by record decoding of `codec.decode_stream`, and reports the
+throughput and the peak memory of both.
+"""
+
+import io
+import tracemalloc
+
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm import codec
+from senaite.astm.constants import CRLF
+from senaite.astm.utils import is_chunked_message
+from senaite.astm.utils import join
+
+REPEAT = 50
+
+
+def decode_joined(data):
+    records = []
+    chunks = []
+    for frame in filter(None, data.split(CRLF)):
+        chunks.append(frame)
+        if not is_chunked_message(frame):
+            records.extend(codec.decode(join(chunks)))
+            chunks = []
+    return records
+
+
+def decode_stream(data):
+    return list(codec.decode_stream(io.BytesIO(data)))
+
+
+def count_stream(data):
+    count = 0
+    for record in codec.decode_stream(io.BytesIO(data)):
+        count += 1
+    return count
+
+
+def peak(func, data):
+    """Returns the peak of the allocated bytes during the call
+    """
+    tracemalloc.start()
+    func(data)
+    size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size
+
+
+def main():
+    frames = [frame for frames in get_corpus().values() for frame in frames]
+    data = CRLF.join(frames * REPEAT) + CRLF
+    count = len(decode_joined(data))
+    assert decode_stream(data) == decode_joined(data)
+    report("archive size", len(data) / 1024., "KiB")
+
+    for name, func in (("join + decode", decode_joined),
+                       ("decode_stream", decode_stream),
+                       ("decode_stream, records discarded", count_stream)):
+        elapsed = timeit(lambda: func(data), repeat=3)
+        report("{}: decode".format(name), count / elapsed, "records/s")
+        report("{}: peak memory".format(name), peak(func, data) / 1024.,
+               "KiB")
+
+
+if __name__ == "__main__":
+    main()
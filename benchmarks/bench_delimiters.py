@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""Record decoding with the split plan of the header delimiters
+
+Compares the previous record decoding, which checks every field for repeat
+and component separators, with the `Delimiters` split plan, which checks
+the separators once per record, on the records of all instrument corpora.
+"""
+
+from bench_incremental import collect_messages
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm import codec
+from senaite.astm.constants import COMPONENT_SEP
+from senaite.astm.constants import ENCODING
+from senaite.astm.constants import FIELD_SEP
+from senaite.astm.constants import RECORD_SEP
+from senaite.astm.constants import REPEAT_SEP
+from senaite.astm.utils import split_message
+
+NUMBER = 20
+
+
+def decode_component(field, encoding=ENCODING):
+    return [[None, item.decode(encoding)][bool(item)]
+            for item in field.split(COMPONENT_SEP)]
+
+
+def decode_record(record, encoding=ENCODING):
+    fields = []
+    for item in record.split(FIELD_SEP):
+        if REPEAT_SEP in item:
+            item = [decode_component(item, encoding)
+                    for item in item.split(REPEAT_SEP)]
+        elif COMPONENT_SEP in item:
+            item = decode_component(item, encoding)
+        else:
+            item = item.decode(encoding)
+        fields.append([None, item][bool(item)])
+    return fields
+
+
+def get_records(corpus):
+    """Returns the raw records of all messages with their delimiters
+    """
+    records = []
+    for frames in corpus.values():
+        messages = collect_messages(frames)
+        delimiters = codec.get_delimiters(messages[0])
+        for message in messages:
+            seq, data, cs = split_message(message)
+            for record in data.split(RECORD_SEP):
+                if record:
+                    records.append((delimiters, record))
+    return records
+
+
+def main():
+    records = get_records(get_corpus())
+    count = NUMBER * len(records)
+
+    def per_field():
+        for delimiters, record in records:
+            decode_record(record)
+
+    def split_plan():
+        for delimiters, record in records:
+            delimiters.decode_record(record)
+
+    elapsed = timeit(per_field, number=NUMBER)
+    report("separators checked per field", count / elapsed, "records/s")
+    elapsed = timeit(split_plan, number=NUMBER)
+    report("split plan of the header", count / elapsed, "records/s")
+
+
+if __name__ == "__main__":
+    main()
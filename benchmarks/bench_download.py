@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""Download of worklists to a simulated instrument
+
+Sends worklists of order records from the sending role of the protocol to
+the receiving instrument simulator over a local TCP connection and reports
+the frame throughput and the mean round trip per frame, i.e. the time from
+an ACK of the instrument to the next frame of the server.
+"""
+
+import asyncio
+import time
+
+from common import report
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
+from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.simulator import receive_message
+
+HOST = "127.0.0.1"
+PORT = 7981
+ORDERS = (100, 1000, 5000)
+
+
+def get_worklist(orders):
+    records = [["H", [[None], [None, "&"]], None, None, "LIS"]]
+    for i in range(1, orders + 1):
+        records.append(["P", str(i)])
+        records.append(["O", str(i), "SAMPLE-%06d" % i, None,
+                        [[None, None, None, code]
+                         for code in ("NA", "K", "CL", "GLU", "UREA")],
+                        "R", "20250514121638"])
+    records.append(["L", "1", "N"])
+    return records
+
+
+async def download(orders):
+    protocols = []
+
+    def create_protocol():
+        protocol = ASTMProtocol()
+        protocols.append(protocol)
+        return protocol
+
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(create_protocol, HOST, PORT)
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    writer.write(ENQ + EOT)
+    await reader.read(100)
+    protocol = protocols[0]
+
+    records = get_worklist(orders)
+    start = time.perf_counter()
+    receiver = asyncio.ensure_future(receive_message(reader, writer))
+    sent = await protocol.send_records(records)
+    await receiver
+    elapsed = time.perf_counter() - start
+
+    writer.close()
+    protocol.close_connection()
+    server.close()
+    await server.wait_closed()
+    return sent, elapsed
+
+
+def main():
+    for orders in ORDERS:
+        sent, elapsed = asyncio.run(download(orders))
+        report("{} orders: throughput".format(orders), sent / elapsed,
+               "frames/s")
+        report("{} orders: round trip".format(orders),
+               elapsed / sent * 1e6, "us/frame")
+
+
+if __name__ == "__main__":
+    main()
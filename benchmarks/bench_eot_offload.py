@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Worst-case ACK latency while large messages are converted
+
+A few clients keep sending large Yumizen H500 sessions while other clients
+measure the ACK round trip time of every frame they send. The server either
+converts the messages in the event loop or hands them to a worker pool.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+from common import get_corpus
+from common import report
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
+from senaite.astm.protocol import ASTMProtocol
+
+HOST = "127.0.0.1"
+PORT = 4011
+DURATION = 3
+LARGE_CLIENTS = 4
+PROBE_CLIENTS = 4
+
+
+async def send_session(reader, writer, frames, latencies=None):
+    for data in [ENQ] + frames:
+        start = time.perf_counter()
+        writer.write(data)
+        await writer.drain()
+        await reader.read(1)
+        if latencies is not None:
+            latencies.append(time.perf_counter() - start)
+    writer.write(EOT)
+    await writer.drain()
+
+
+async def client(frames, deadline, latencies=None):
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    while time.perf_counter() < deadline:
+        await send_session(reader, writer, frames, latencies)
+    writer.close()
+
+
+async def run(executor, large, small):
+    queue = asyncio.Queue()
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(
+        lambda: ASTMProtocol(queue=queue, executor=executor),
+        host=HOST, port=PORT)
+    deadline = time.perf_counter() + DURATION
+    latencies = []
+    tasks = [client(large, deadline) for i in range(LARGE_CLIENTS)]
+    tasks += [client(small, deadline, latencies)
+              for i in range(PROBE_CLIENTS)]
+    await asyncio.gather(*tasks)
+    server.close()
+    await server.wait_closed()
+    return sorted(latencies), queue.qsize()
+
+
+def main():
+    corpus = get_corpus()
+    # a large session with 10 times the results of the Yumizen H500
+    large = corpus["yumizen_h500.txt"] * 10
+    small = corpus["dca_vantage.txt"]
+
+    executors = [
+        ("event loop", lambda: None),
+        ("thread pool (4)", lambda: ThreadPoolExecutor(4)),
+        ("process pool (4)", lambda: ProcessPoolExecutor(4)),
+    ]
+    for name, factory in executors:
+        executor = factory()
+        latencies, converted = asyncio.run(run(executor, large, small))
+        if executor is not None:
+            executor.shutdown()
+        p99 = latencies[int(len(latencies) * 0.99)]
+        report("{}: max ACK latency".format(name), latencies[-1] * 1000, "ms")
+        report("{}: p99 ACK latency".format(name), p99 * 1000, "ms")
+        report("{}: converted messages".format(name), converted, "")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""Decoding of the FLOATLE histograms of the Horiba Yumizen H5xx
+
+Compares a naive `struct` based decoding with the `array` and (if installed)
+numpy paths of the `FloatArrayField` on the M records of the test corpus, and
+the JSON conversion of the messages with and without decoded histograms.
+"""
+
+import base64
+import struct
+import zlib
+
+from bench_incremental import collect_messages
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm import codec
+from senaite.astm import fields
+from senaite.astm.instruments import horiba_yumizen_h5xx
+from senaite.astm.protocol import convert_messages
+
+NUMBER = 20
+
+
+def decode_struct(data):
+    raw = zlib.decompress(base64.b64decode(data), -zlib.MAX_WBITS)
+    return list(struct.unpack("<%df" % (len(raw) // 4), raw))
+
+
+def get_payloads(sessions):
+    """Returns the encoded float streams of all M records
+    """
+    payloads = []
+    for messages in sessions:
+        for message in messages:
+            for record in codec.decode(message):
+                if record[0] != "M":
+                    continue
+                for value in record:
+                    if isinstance(value, list) and \
+                            value[:1] == [fields.FLOATLE_DEFLATE_BASE64]:
+                        payloads.append(value[1])
+    return payloads
+
+
+def main():
+    corpus = get_corpus()
+    sessions = [collect_messages(frames) for name, frames in corpus.items()
+                if name.startswith("yumizen")]
+    payloads = get_payloads(sessions)
+    count = sum(len(decode_struct(data)) for data in payloads) * NUMBER
+
+    def naive():
+        for data in payloads:
+            decode_struct(data)
+
+    def field():
+        for data in payloads:
+            fields.decode_floats(data).tolist()
+
+    elapsed = timeit(naive, number=NUMBER)
+    report("struct.unpack", count / elapsed, "floats/s")
+
+    numpy = fields.numpy
+    fields.numpy = None
+    try:
+        elapsed = timeit(field, number=NUMBER)
+        report("array('f')", count / elapsed, "floats/s")
+    finally:
+        fields.numpy = numpy
+
+    if numpy is not None:
+        elapsed = timeit(field, number=NUMBER)
+        report("numpy.frombuffer", count / elapsed, "floats/s")
+    else:
+        print("numpy.frombuffer: numpy is not installed")
+
+    def convert():
+        for messages in sessions:
+            convert_messages(messages, "json")
+
+    messages = NUMBER * len(sessions)
+    elapsed = timeit(convert, number=NUMBER)
+    report("JSON conversion", messages / elapsed, "messages/s")
+    horiba_yumizen_h5xx.DECODE_HISTOGRAMS = True
+    elapsed = timeit(convert, number=NUMBER)
+    report("JSON conversion with histograms", messages / elapsed,
+           "messages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""Frames/sec of the stream framer under random segmentation
+"""
+
+import random
+
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm.constants import CRLF
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
+from senaite.astm.utils import FrameBuffer
+
+SESSIONS = 50
+
+
+def segment(stream, rand, max_size):
+    """Split the stream into randomly sized segments
+    """
+    segments = []
+    pos = 0
+    while pos < len(stream):
+        size = rand.randint(1, max_size)
+        segments.append(stream[pos:pos + size])
+        pos += size
+    return segments
+
+
+def main():
+    corpus = get_corpus()
+    sessions = [ENQ + CRLF.join(frames) + CRLF + EOT
+                for frames in corpus.values()]
+    stream = b"".join(sessions * SESSIONS)
+    frames = sum(map(len, corpus.values())) * SESSIONS
+    rand = random.Random(0)
+
+    for max_size in (1, 16, 256, 4096, len(stream)):
+        segments = segment(stream, rand, max_size)
+
+        def run():
+            buf = FrameBuffer()
+            for data in segments:
+                for token in buf.feed(data):
+                    pass
+
+        elapsed = timeit(run, repeat=3)
+        report("framer, segments <= {} bytes".format(max_size),
+               frames / elapsed, "frames/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""Work left at EOT with and without incremental decoding
+
+Compares the conversion of the collected messages at EOT with the
+serialization of an incrementally decoded message, where the records were
+already decoded and mapped while the frames were received.
+"""
+
+from unittest.mock import MagicMock
+
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm.constants import CRLF
+from senaite.astm.constants import ENQ
+from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.protocol import convert_messages
+from senaite.astm.protocol import serialize
+from senaite.astm.wrapper import IncrementalWrapper
+
+NUMBER = 20
+
+
+def collect_messages(frames):
+    """Returns the messages as collected by the protocol until the EOT
+    """
+    transport = MagicMock()
+    transport.get_extra_info.return_value = ("127.0.0.1", 4010)
+    protocol = ASTMProtocol()
+    protocol.connection_made(transport)
+    protocol.data_received(ENQ + CRLF.join(frames) + CRLF)
+    protocol.cancel_timer()
+    return protocol.messages
+
+
+def main():
+    sessions = [collect_messages(frames) for frames in get_corpus().values()]
+    count = NUMBER * len(sessions)
+
+    def at_eot():
+        for messages in sessions:
+            convert_messages(messages, "json")
+
+    def during_transfer():
+        for messages in sessions:
+            IncrementalWrapper(messages)
+
+    wrappers = [IncrementalWrapper(messages) for messages in sessions]
+
+    def incremental_eot():
+        for wrapper in wrappers:
+            serialize(wrapper, "json")
+
+    elapsed = timeit(at_eot, number=NUMBER)
+    report("decode + serialize at EOT", count / elapsed, "messages/s")
+    elapsed = timeit(incremental_eot, number=NUMBER)
+    report("incremental: serialize at EOT", count / elapsed, "messages/s")
+    elapsed = timeit(during_transfer, number=NUMBER)
+    report("incremental: decode during transfer", count / elapsed,
+           "messages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""Round trip latency of the frames over a loopback connection
+
+Sends the messages of the corpus with the instrument simulator to servers
+with different TCP options and reports the mean and the 99th percentile of
+the time from sending a frame until its ACK was received.
+"""
+
+import asyncio
+
+from common import get_corpus
+from common import report
+from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.simulator import send_message
+from senaite.astm.sockets import SocketOptions
+
+HOST = "127.0.0.1"
+PORT = 7983
+ROUNDS = 20
+
+OPTIONS = (
+    ("Nagle", SocketOptions(nodelay=False)),
+    ("nodelay", SocketOptions()),
+    ("nodelay + quickack", SocketOptions(quickack=True)),
+    ("tuned", SocketOptions(quickack=True, rcvbuf=65536, sndbuf=65536,
+                            keepalive=60)),
+)
+
+
+async def measure(options, corpus):
+    def create_protocol():
+        return ASTMProtocol(queue=asyncio.Queue(), socket_options=options)
+
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(create_protocol, HOST, PORT)
+    for sock in server.sockets:
+        options.apply(sock)
+
+    round_trips = []
+    for i in range(ROUNDS):
+        for frames in corpus.values():
+            round_trips.extend(await send_message(frames, HOST, PORT))
+
+    server.close()
+    await server.wait_closed()
+    return round_trips
+
+
+def main():
+    corpus = get_corpus()
+    for name, options in OPTIONS:
+        round_trips = sorted(asyncio.run(measure(options, corpus)))
+        mean = sum(round_trips) / len(round_trips)
+        p99 = round_trips[int(len(round_trips) * 0.99)]
+        report("{}: mean".format(name), mean * 1e6, "us/frame")
+        report("{}: p99".format(name), p99 * 1e6, "us/frame")
+
+
+if __name__ == "__main__":
+    main()
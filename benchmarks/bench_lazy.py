@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""Eager decoding compared with lazy record views
+
+Decodes the messages of all instrument corpora with `codec.decode` and with
+the record views of `codec.decode_lazy`, and reports the throughput and the
+allocated bytes per message when only the record types are read, when all
+fields are read and when the records are wrapped by their mapping.
+"""
+
+import tracemalloc
+
+from bench_incremental import collect_messages
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm import codec
+from senaite.astm.wrapper import Wrapper
+
+NUMBER = 20
+
+
+def get_messages(corpus):
+    """Returns a list of (delimiters, mapping, message) tuples
+    """
+    messages = []
+    for frames in corpus.values():
+        collected = collect_messages(frames)
+        wrapper = Wrapper(collected)
+        for message in collected:
+            messages.append((wrapper.delimiters, wrapper.mapping, message))
+    return messages
+
+
+def record_types(decode, messages):
+    for delimiters, mapping, message in messages:
+        for record in decode(message, delimiters=delimiters):
+            record[0]
+
+
+def all_fields(decode, messages):
+    for delimiters, mapping, message in messages:
+        for record in decode(message, delimiters=delimiters):
+            list(record)
+
+
+def wrapped(decode, messages):
+    for delimiters, mapping, message in messages:
+        for record in decode(message, delimiters=delimiters):
+            if record[0] in mapping:
+                mapping[record[0]](*record)
+
+
+def measure(func, decode, messages):
+    """Returns the allocated bytes per message of the kept results
+    """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    decoded = [decode(message, delimiters=delimiters)
+               for delimiters, mapping, message in messages]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del decoded
+    return size / len(messages)
+
+
+def main():
+    messages = get_messages(get_corpus())
+    count = NUMBER * len(messages)
+
+    for name, decode in (("decode", codec.decode),
+                         ("decode_lazy", codec.decode_lazy)):
+        for label, func in (("record types", record_types),
+                            ("all fields", all_fields),
+                            ("wrapped", wrapped)):
+            elapsed = timeit(lambda: func(decode, messages), number=NUMBER)
+            report("{}: {}".format(name, label), count / elapsed,
+                   "messages/s")
+        report("{}: memory".format(name),
+               measure(func, decode, messages), "bytes/message")
+
+
+if __name__ == "__main__":
+    main()
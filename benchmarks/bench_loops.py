@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Event loop implementations
+
+Runs the server protocol in every available event loop implementation and
+reports the rate of accepted connections and the frames per second of the
+corpus sent by the instrument simulator over a local TCP connection.
+Implementations that are not installed fall back to asyncio and are
+reported as such.
+"""
+
+import asyncio
+import time
+
+from common import get_corpus
+from common import report
+from senaite.astm.loops import LOOPS
+from senaite.astm.loops import install_event_loop_policy
+from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.simulator import send_message
+
+HOST = "127.0.0.1"
+PORT = 7984
+CONNECTIONS = 2000
+ROUNDS = 20
+
+
+async def start_server():
+    queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(
+        lambda: ASTMProtocol(queue=queue), HOST, PORT)
+
+
+async def accept():
+    server = await start_server()
+    start = time.perf_counter()
+    for i in range(CONNECTIONS):
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+        writer.close()
+        await writer.wait_closed()
+    elapsed = time.perf_counter() - start
+    server.close()
+    await server.wait_closed()
+    return CONNECTIONS / elapsed
+
+
+async def transfer(corpus):
+    server = await start_server()
+    frames = 0
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        for lines in corpus.values():
+            frames += len(await send_message(lines, HOST, PORT))
+    elapsed = time.perf_counter() - start
+    server.close()
+    await server.wait_closed()
+    return frames / elapsed
+
+
+def main():
+    corpus = get_corpus()
+    for name in LOOPS:
+        used = install_event_loop_policy(name)
+        if used != name:
+            name = "{} (fallback to {})".format(name, used)
+        report("{}: accept".format(name), asyncio.run(accept()),
+               "connections/s")
+        report("{}: transfer".format(name), asyncio.run(transfer(corpus)),
+               "frames/s")
+
+
+if __name__ == "__main__":
+    main()
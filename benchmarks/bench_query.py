@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""Answers to the host queries of an instrument
+
+Measures the lookup of the queried samples in order caches of different
+sizes, the round trip of a query over a local TCP connection, i.e. the time
+from the EOT of the instrument until the answer was received, and the bulk
+refresh of the cache in memory and in a SQLite database.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from common import report
+from common import timeit
+from senaite.astm import codec
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
+from senaite.astm.orders import OrderCache
+from senaite.astm.orders import QueryResponder
+from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.simulator import receive_message
+
+HOST = "127.0.0.1"
+PORT = 7982
+SIZES = (1000, 10000, 100000)
+QUERIES = 200
+
+
+def get_orders(size):
+    return {"WB-%06d" % i: ["NA", "K", "CL", "GLU", "UREA"]
+            for i in range(size)}
+
+
+def get_query(sample_id):
+    return codec.encode_message(1, [
+        ["H", [[None], [None, "&"]], None, None, "c311"],
+        ["Q", "1", [None, None, sample_id], None, "ALL"],
+        ["L", "1"],
+    ])
+
+
+async def send_query(reader, writer, message):
+    writer.write(ENQ)
+    await reader.readexactly(1)
+    writer.write(message)
+    await reader.readexactly(1)
+    writer.write(EOT)
+
+
+async def query(responder, size):
+    def create_protocol():
+        return ASTMProtocol(queue=asyncio.Queue(), responder=responder)
+
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(create_protocol, HOST, PORT)
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+
+    messages = [get_query("WB-%06d" % (i * size // QUERIES))
+                for i in range(QUERIES)]
+    elapsed = 0
+    for message in messages:
+        await send_query(reader, writer, message)
+        start = time.perf_counter()
+        frames = await receive_message(reader, writer)
+        elapsed += time.perf_counter() - start
+        assert len(frames) == 4
+
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return elapsed / QUERIES
+
+
+def main():
+    tempdir = tempfile.mkdtemp()
+    try:
+        for size in SIZES:
+            orders = get_orders(size)
+            cache = OrderCache()
+            cache.update(orders)
+            responder = QueryResponder(cache)
+            queries = [codec.decode_record(
+                b"Q|1|^^WB-%06d||ALL" % (i * size // QUERIES))
+                for i in range(QUERIES)]
+
+            elapsed = timeit(lambda: [responder.respond([q])
+                                      for q in queries])
+            report("{:,} orders: lookup".format(size),
+                   elapsed / QUERIES * 1e6, "us/query")
+            elapsed = asyncio.run(query(responder, size))
+            report("{:,} orders: round trip".format(size),
+                   elapsed * 1e3, "ms/query")
+
+            elapsed = timeit(lambda: cache.update(orders), repeat=3)
+            report("{:,} orders: refresh in memory".format(size),
+                   elapsed * 1e3, "ms")
+            path = os.path.join(tempdir, "orders-%d.db" % size)
+            cache = OrderCache(path)
+            elapsed = timeit(lambda: cache.update(orders), repeat=3)
+            cache.close()
+            report("{:,} orders: refresh in SQLite".format(size),
+                   elapsed * 1e3, "ms")
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == "__main__":
+    main()
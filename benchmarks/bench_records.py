@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""Construction of compiled and generic record mappings
+
+Wraps the decoded records of the test corpus with the compiled record
+classes of the instruments and with generic copies of them, which have the
+same fields but neither slots nor a generated constructor.
+"""
+
+import tracemalloc
+
+from bench_incremental import collect_messages
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm import codec
+from senaite.astm.mapping import Record
+from senaite.astm.wrapper import Wrapper
+
+NUMBER = 20
+
+
+def get_records(corpus):
+    """Returns a list of (record class, decoded record) tuples
+    """
+    records = []
+    for frames in corpus.values():
+        messages = collect_messages(frames)
+        mapping = Wrapper(messages).mapping
+        for message in messages:
+            for record in codec.decode(message):
+                if record[0] in mapping:
+                    records.append((mapping[record[0]], record))
+    return records
+
+
+def get_generic(cls):
+    return Record.build(*[field for name, field in cls._fields])
+
+
+def measure(records):
+    """Returns the allocated bytes per record
+    """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    wrapped = [cls(*record) for cls, record in records]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del wrapped
+    return size / len(records)
+
+
+def main():
+    compiled = get_records(get_corpus())
+    classes = {}
+    for cls, record in compiled:
+        if cls not in classes:
+            classes[cls] = get_generic(cls)
+    generic = [(classes[cls], record) for cls, record in compiled]
+    count = NUMBER * len(compiled)
+
+    for name, records in (("generic", generic), ("compiled", compiled)):
+        def construct():
+            for cls, record in records:
+                cls(*record)
+
+        elapsed = timeit(construct, number=NUMBER)
+        report("{}: construct".format(name), count / elapsed, "records/s")
+        report("{}: memory".format(name), measure(records), "bytes/record")
+
+
+if __name__ == "__main__":
+    main()
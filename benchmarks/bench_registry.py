@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""Instrument detection of the message header
+
+Compares walking and matching all instrument modules per message with the
+precompiled instrument registry (cold and cached).
+"""
+
+import pkgutil
+import re
+
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm import instruments
+from senaite.astm.wrapper import InstrumentRegistry
+
+NUMBER = 1000
+
+
+def walk_instruments(header):
+    for importer, modname, ispkg in pkgutil.iter_modules(
+            instruments.__path__, instruments.__name__ + "."):
+        module = __import__(modname, fromlist="dummy")
+        regex = getattr(module, "HEADER_RX", None)
+        if regex and re.match(regex, header.decode()):
+            return module
+    return None
+
+
+def main():
+    headers = [frames[0] for frames in get_corpus().values()]
+    registry = InstrumentRegistry(instruments)
+    registry.load()
+
+    def walk():
+        for header in headers:
+            walk_instruments(header)
+
+    def detect():
+        for header in headers:
+            registry.detect(header)
+
+    def cached():
+        for header in headers:
+            registry.get_module(header)
+
+    for name, func in (("module walk", walk),
+                       ("combined regex", detect),
+                       ("combined regex + sender cache", cached)):
+        elapsed = timeit(func, number=NUMBER)
+        report(name, NUMBER * len(headers) / elapsed, "headers/s")
+
+
+if __name__ == "__main__":
+    main()
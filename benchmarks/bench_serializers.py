@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""Serialization of the record mappings
+
+Compares the generated `to_dict`/`to_astm` serializers of the record classes
+with the generic field loop they replaced on the records of all instrument
+corpora, and measures `Wrapper.to_dict` on the whole messages.
+"""
+
+from bench_incremental import collect_messages
+from bench_records import get_records
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm.mapping import Mapping
+from senaite.astm.wrapper import Wrapper
+
+NUMBER = 20
+
+
+def generic_to_dict(obj):
+    out = {}
+    for key, field in obj._fields:
+        value = getattr(obj, field.slot)
+        if isinstance(value, Mapping):
+            out[key] = generic_to_dict(value)
+        elif isinstance(value, list):
+            out[key] = [generic_to_dict(val) if isinstance(val, Mapping)
+                        else val for val in value]
+        elif value is None and field.required:
+            raise ValueError("Field %r value should not be None" % key)
+        else:
+            out[key] = value
+    return out
+
+
+def generic_to_astm(obj):
+    out = []
+    for key, field in obj._fields:
+        value = getattr(obj, field.slot)
+        if isinstance(value, Mapping):
+            out.append(generic_to_astm(value))
+        elif isinstance(value, list):
+            out.append([generic_to_astm(val) if isinstance(val, Mapping)
+                        else val for val in value])
+        elif value is None and field.required:
+            raise ValueError("Field %r value should not be None" % key)
+        else:
+            out.append(value)
+    return out
+
+
+def main():
+    corpus = get_corpus()
+    records = [cls(*record) for cls, record in get_records(corpus)]
+    count = NUMBER * len(records)
+
+    benchmarks = (
+        ("generic to_dict", generic_to_dict),
+        ("compiled to_dict", Mapping.to_dict),
+        ("generic to_astm", generic_to_astm),
+        ("compiled to_astm", Mapping.to_astm),
+    )
+    for name, serialize in benchmarks:
+        def run():
+            for record in records:
+                serialize(record)
+
+        elapsed = timeit(run, number=NUMBER)
+        report(name, count / elapsed, "records/s")
+
+    wrappers = [Wrapper(collect_messages(frames))
+                for frames in corpus.values()]
+
+    def to_dict():
+        for wrapper in wrappers:
+            wrapper.to_dict()
+
+    elapsed = timeit(to_dict, number=NUMBER)
+    report("Wrapper.to_dict", NUMBER * len(wrappers) / elapsed, "messages/s")
+
+
+if __name__ == "__main__":
+    main()
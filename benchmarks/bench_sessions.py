@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""Sessions with many messages between ENQ and EOT
+
+Builds a batch upload of 200 messages per instrument of the corpus and
+compares the conversion of the whole session as one message with the
+conversion of every message H...L on its own, serially and in a process
+pool with one worker per CPU. Also reports the time until the first
+message is ready to be pushed.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm.protocol import convert_messages
+from senaite.astm.utils import split_messages
+
+MESSAGES = 200
+INSTRUMENTS = ("sysmex_xn550.txt", "cobas_c311.txt", "genexpert.txt")
+
+
+def main():
+    corpus = get_corpus()
+    workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for name in INSTRUMENTS:
+            frames = corpus[name] * MESSAGES
+            groups = split_messages(frames)
+            assert len(groups) == MESSAGES
+
+            elapsed = timeit(lambda: convert_messages(frames), repeat=3)
+            report("{}: one message".format(name), elapsed * 1e3, "ms")
+            elapsed = timeit(
+                lambda: [convert_messages(group) for group in groups],
+                repeat=3)
+            report("{}: split, serial".format(name), elapsed * 1e3, "ms")
+            elapsed = timeit(
+                lambda: list(pool.map(convert_messages, groups,
+                                      chunksize=8)),
+                repeat=3)
+            report("{}: split, {} process(es)".format(name, workers),
+                   elapsed * 1e3, "ms")
+            elapsed = timeit(lambda: convert_messages(groups[0]))
+            report("{}: split, first message".format(name),
+                   elapsed * 1e3, "ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Timeout handling of many simultaneous connections
+
+Feeds the frames of the corpus round robin to 1,000 protocol instances in
+one event loop and compares the previous cancel and reschedule of the
+timeout timer on every received chunk with the lazy deadline, which only
+moves the deadline of a single timer. Reports the received chunks per
+second and the peak size of the scheduled heap of the loop, which includes
+the cancelled timers that were not yet removed. The conversion of the
+messages after the EOT is not measured.
+"""
+
+import asyncio
+import time
+
+from common import get_corpus
+from common import report
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
+from senaite.astm.protocol import ASTMProtocol
+
+CONNECTIONS = 1000
+
+
+class Transport(object):
+
+    def __init__(self, peername):
+        self.peername = peername
+
+    def get_extra_info(self, name):
+        return self.peername
+
+    def write(self, data):
+        pass
+
+    def is_closing(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class RestartingProtocol(ASTMProtocol):
+    """Protocol with the previous timeout timer
+    """
+
+    def start_timer(self):
+        self.timer = self.loop.call_later(self.timeout, self.on_timeout)
+
+    def cancel_timer(self):
+        if self.timer is None:
+            return
+        self.timer.cancel()
+
+    def restart_timer(self):
+        self.cancel_timer()
+        self.start_timer()
+
+
+def get_chunks():
+    """Returns the chunks of one session per instrument of the corpus
+    """
+    sessions = []
+    for frames in get_corpus().values():
+        sessions.append([ENQ] + frames)
+    return sessions
+
+
+async def run(factory, sessions):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    protocols = []
+    for i in range(CONNECTIONS):
+        protocol = factory(queue=queue)
+        protocol.connection_made(Transport(("127.0.0.1", i)))
+        protocols.append(protocol)
+
+    chunks = 0
+    elapsed = 0
+    scheduled = 0
+    for session in sessions:
+        start = time.perf_counter()
+        for chunk in session:
+            for protocol in protocols:
+                protocol.data_received(chunk)
+                chunks += 1
+        elapsed += time.perf_counter() - start
+        scheduled = max(scheduled, len(loop._scheduled))
+        # the conversion of the messages at the end is not measured
+        for protocol in protocols:
+            protocol.data_received(EOT)
+    for protocol in protocols:
+        protocol.cancel_timer()
+    return chunks, elapsed, scheduled
+
+
+def main():
+    sessions = get_chunks()
+    for name, factory in (("cancel/restart", RestartingProtocol),
+                          ("lazy deadline", ASTMProtocol)):
+        chunks, elapsed, scheduled = asyncio.run(run(factory, sessions))
+        report("{}: throughput".format(name), chunks / elapsed, "chunks/s")
+        report("{}: scheduled timers".format(name), scheduled, "handles")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""Strict and trusted mapping of the records
+
+Compares the wrapping of the GeneXpert and Sysmex XN messages with the
+strict record classes, which validate set fields and warn about values of
+not used fields, and their trusted variants.
+"""
+
+import warnings
+
+from bench_incremental import collect_messages
+from common import get_corpus
+from common import report
+from common import timeit
+from senaite.astm.wrapper import Wrapper
+from senaite.astm.wrapper import registry
+
+NUMBER = 50
+CORPORA = ("genexpert.txt", "sysmex_xn550.txt")
+TRUSTED = ("genexpert", "sysmex_xn")
+
+
+def main():
+    corpus = get_corpus()
+    registry.load()
+    # the warnings are not ignored, as in production
+    warnings.resetwarnings()
+    warnings.simplefilter("default")
+
+    for name in CORPORA:
+        messages = collect_messages(corpus[name])
+        for mode, trusted in (("strict", ()), ("trusted", TRUSTED)):
+            registry.trusted = set(trusted)
+
+            def wrap():
+                Wrapper(messages).get_records()
+
+            elapsed = timeit(wrap, number=NUMBER)
+            report("{} {}".format(name, mode), NUMBER / elapsed,
+                   "messages/s")
+    registry.trusted = set()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""Shared helpers for the benchmark scripts
+
+The benchmarks use the instrument messages of the test suite as corpus and
+are meant to be run from the repository root, e.g.:
+
+    $ python benchmarks/bench_framer.py
+"""
+
+import logging
+import os
+import time
+import warnings
+from glob import glob
+
+from senaite.astm import logger
+from senaite.astm.constants import CRLF
+from senaite.astm.tests.base import IGNORE_INSTRUMENT_FILES
+
+DATA_DIR = os.path.join(
+    os.path.dirname(__file__), os.pardir,
+    "src", "senaite", "astm", "tests", "data")
+
+# keep the output of the benchmarks readable
+logger.setLevel(logging.ERROR)
+warnings.simplefilter("ignore")
+
+
+def get_corpus():
+    """Returns a mapping of instrument file name -> list of frames
+    """
+    corpus = {}
+    for path in sorted(glob(os.path.join(DATA_DIR, "*.txt"))):
+        name = os.path.basename(path)
+        if name in IGNORE_INSTRUMENT_FILES:
+            continue
+        with open(path, "rb") as f:
+            frames = [line.strip(CRLF) for line in f.readlines()]
+        corpus[name] = list(filter(None, frames))
+    return corpus
+
+
+def timeit(func, repeat=5, number=1):
+    """Returns the best time in seconds of `repeat` runs of `number` calls
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for n in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, value, unit):
+    print("{:<48s} {:>14,.1f} {}".format(name, value, unit))
@@ -42,7 +42,10 @@ setup(
         "dev": [
             "pytest",
             "coverage",
-        ]
+        ],
+        "uvloop": [
+            "uvloop",
+        ],
     },
     entry_points={
         "console_scripts": [
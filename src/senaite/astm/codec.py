@@ -8,6 +8,8 @@ from senaite.astm.constants import COMPONENT_SEP
 from senaite.astm.constants import CR
 from senaite.astm.constants import CRLF
 from senaite.astm.constants import ENCODING
+from senaite.astm.constants import EOT
+from senaite.astm.constants import ESCAPE_SEP
 from senaite.astm.constants import ETB
 from senaite.astm.constants import ETX
 from senaite.astm.constants import FIELD_SEP
@@ -15,20 +17,126 @@ from senaite.astm.constants import LF
 from senaite.astm.constants import RECORD_SEP
 from senaite.astm.constants import REPEAT_SEP
 from senaite.astm.constants import STX
+from senaite.astm.utils import FrameBuffer
+from senaite.astm.utils import iter_frames
 from senaite.astm.utils import make_checksum
-from senaite.astm.utils import split
 
 try:
     from collections import Iterable
 except ImportError:  # Python 3
     from collections.abc import Iterable
 
+# Separators of the record text, see `field_text`
+FIELD_SEP_TEXT = FIELD_SEP.decode(ENCODING)
+REPEAT_SEP_TEXT = REPEAT_SEP.decode(ENCODING)
+COMPONENT_SEP_TEXT = COMPONENT_SEP.decode(ENCODING)
+# Error handler that keeps the bytes of pre-encoded values
+ESCAPE_ERRORS = "surrogateescape"
+
 
 # #############################################################################
 # ASTM DECODE
 # #############################################################################
 
-def decode(data, encoding=ENCODING):
+class Delimiters(object):
+    """Split plan for the records of a message
+
+    The delimiters are declared by the header record (``H|\\^&``), e.g. the
+    GeneXpert uses ``@`` as repeat and ``\\`` as escape delimiter. The plan
+    checks once per record which of the separators occur, so that the fields
+    of a record without components or repeats are only decoded.
+
+    Escape sequences are kept as they are.
+    """
+    __slots__ = ("field", "repeat", "component", "escape")
+
+    def __init__(self, field=FIELD_SEP, repeat=REPEAT_SEP,
+                 component=COMPONENT_SEP, escape=ESCAPE_SEP):
+        self.field = field
+        self.repeat = repeat
+        self.component = component
+        self.escape = escape
+
+    def __eq__(self, other):
+        if not isinstance(other, Delimiters):
+            return NotImplemented
+        return self.to_bytes() == other.to_bytes()
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return hash(self.to_bytes())
+
+    def __repr__(self):
+        return "Delimiters(%r)" % self.to_bytes()
+
+    def to_bytes(self):
+        return self.field + self.repeat + self.component + self.escape
+
+    def decode_record(self, record, encoding=ENCODING):
+        """Decodes ASTM record message
+        """
+        items = record.split(self.field)
+        repeat = self.repeat in record
+        if not repeat and self.component not in record:
+            # default `None` if item evalualtes to `False`
+            return [item.decode(encoding) or None for item in items]
+        fields = []
+        for item in items:
+            if repeat and self.repeat in item:
+                item = self.decode_repeated_component(item, encoding)
+            elif self.component in item:
+                item = self.decode_component(item, encoding)
+            else:
+                item = item.decode(encoding)
+            fields.append(item or None)
+        return fields
+
+    def decode_component(self, field, encoding=ENCODING):
+        """Decodes ASTM field component
+        """
+        return [item.decode(encoding) or None
+                for item in field.split(self.component)]
+
+    def decode_repeated_component(self, component, encoding=ENCODING):
+        """Decodes ASTM field repeated component
+        """
+        return [self.decode_component(item, encoding)
+                for item in component.split(self.repeat)]
+
+
+#: Delimiters of the ASTM standard: |\^&
+DEFAULT_DELIMITERS = Delimiters()
+
+
+def get_delimiters(header):
+    """Returns the delimiters declared by the header record
+
+    The standard delimiters are returned if the data is no header record or
+    does not declare four distinct delimiters.
+
+    :param header: Header record, frame or message
+    :type header: bytes
+    :returns: :class:`Delimiters`
+    """
+    if header[:1] == STX:
+        header = header[1:]
+    if header[:1].isdigit():
+        header = header[1:]
+    if header[:1] != b"H":
+        return DEFAULT_DELIMITERS
+    seps = header[1:5]
+    if seps == DEFAULT_DELIMITERS.to_bytes():
+        return DEFAULT_DELIMITERS
+    # four distinct printable characters other than letters or digits
+    if len(set(seps)) != 4 or any(
+            not 32 < c < 127 or chr(c).isalnum() for c in seps):
+        return DEFAULT_DELIMITERS
+    return Delimiters(*[seps[i:i + 1] for i in range(4)])
+
+
+def decode(data, encoding=ENCODING, delimiters=None):
     """Common ASTM decoding function that tries to guess which kind of data it
     handles.
 
@@ -50,22 +158,26 @@ def decode(data, encoding=ENCODING):
     :param encoding: Data encoding.
     :type encoding: str
 
+    :param delimiters: Delimiters of the message. They are taken from the
+                       header record if omitted.
+    :type delimiters: :class:`Delimiters`
+
     :return: List of ASTM records with unicode data.
     :rtype: list
     """
     if not isinstance(data, bytes):
         raise TypeError("bytes expected, got %r" % data)
     if data.startswith(STX):  # may be decode message \x02...\x03CS\r\n
-        seq, records, cs = decode_message(data, encoding)
+        seq, records, cs = decode_message(data, encoding, delimiters)
         return records
     byte = data[:1].decode()
     if byte.isdigit():
-        seq, records = decode_frame(data, encoding)
+        seq, records = decode_frame(data, encoding, delimiters)
         return records
-    return [decode_record(data, encoding)]
+    return [decode_record(data, encoding, delimiters)]
 
 
-def decode_message(message, encoding=ENCODING):
+def decode_message(message, encoding=ENCODING, delimiters=None):
     """Decodes complete ASTM message that is sent or received due
     communication routines.
 
@@ -75,6 +187,9 @@ def decode_message(message, encoding=ENCODING):
     :param encoding: Data encoding.
     :type encoding: str
 
+    :param delimiters: Delimiters of the message.
+    :type delimiters: :class:`Delimiters`
+
     :returns: Tuple of three elements:
 
         * :class:`int` frame sequence number.
@@ -96,11 +211,11 @@ def decode_message(message, encoding=ENCODING):
     # validate the checksum
     ccs = make_checksum(frame)
     assert cs.upper() == ccs, "Checksum wrong: expected %r, got %r" % (cs, ccs)
-    seq, records = decode_frame(frame, encoding)
+    seq, records = decode_frame(frame, encoding, delimiters)
     return seq, records, cs.decode()
 
 
-def decode_frame(frame, encoding=ENCODING):
+def decode_frame(frame, encoding=ENCODING, delimiters=None):
     """Decodes ASTM frame: list of records followed by sequence number.
     """
     if not isinstance(frame, bytes):
@@ -116,39 +231,278 @@ def decode_frame(frame, encoding=ENCODING):
     if not seq.isdigit():
         raise ValueError("Malformed ASTM frame. Expected leading seq number %r"
                          "" % frame)
-    seq, records = int(seq), frame[1:]
-    return seq, [decode_record(record, encoding)
-                 for record in records.split(RECORD_SEP)]
+    seq, records = int(seq), frame[1:].split(RECORD_SEP)
+    if delimiters is None:
+        delimiters = get_delimiters(records[0])
+    return seq, [delimiters.decode_record(record, encoding)
+                 for record in records]
 
 
-def decode_record(record, encoding=ENCODING):
+def decode_record(record, encoding=ENCODING, delimiters=None):
     """Decodes ASTM record message
     """
-    fields = []
-    for item in record.split(FIELD_SEP):
-        if REPEAT_SEP in item:
-            item = decode_repeated_component(item, encoding)
-        elif COMPONENT_SEP in item:
-            item = decode_component(item, encoding)
-        else:
-            item = item.decode(encoding)
-        # default `None` if item evalualtes to `False`
-        fields.append([None, item][bool(item)])
-    return fields
+    if delimiters is None:
+        delimiters = get_delimiters(record)
+    return delimiters.decode_record(record, encoding)
 
 
 def decode_component(field, encoding=ENCODING):
     """Decodes ASTM field component
     """
-    return [[None, item.decode(encoding)][bool(item)]
-            for item in field.split(COMPONENT_SEP)]
+    return DEFAULT_DELIMITERS.decode_component(field, encoding)
 
 
 def decode_repeated_component(component, encoding=ENCODING):
     """Decodes ASTM field repeated component
     """
-    return [decode_component(item, encoding)
-            for item in component.split(REPEAT_SEP)]
+    return DEFAULT_DELIMITERS.decode_repeated_component(component, encoding)
+
+
+class IncrementalDecoder(object):
+    """Decodes a stream of ASTM frames record by record
+
+    The decoder accepts arbitrary chunks of the stream, e.g. as received from
+    the transport or read from an archive, and yields every record as soon
+    as it is complete. Records that continue in the next frame of a chunked
+    transfer (ETB) are kept until the frame that completes them arrived, so
+    that only the pending frame and record are held in memory.
+
+    The delimiters declared by the header record are used for all records
+    of the transfer. Control characters between the frames are skipped, an
+    EOT discards an incomplete record of the transfer.
+
+    >>> decoder = IncrementalDecoder()
+    >>> for record in decoder.feed(data):
+    ...     print(record)
+    """
+
+    def __init__(self, encoding=ENCODING):
+        self.encoding = encoding
+        self.buffer = FrameBuffer()
+        self.pending = b""
+        self.delimiters = DEFAULT_DELIMITERS
+
+    def reset(self):
+        """Discard all pending data
+        """
+        self.buffer.clear()
+        self.pending = b""
+        self.delimiters = DEFAULT_DELIMITERS
+
+    def feed(self, data):
+        """Append the data to the stream and return the complete records
+
+        A malformed frame or a wrong checksum raises a :exc:`ValueError`
+        when the records are iterated. The frame is dropped and the decoding
+        continues with the records of the next call.
+
+        :param data: Chunk of the stream
+        :type data: bytes
+        :returns: generator of records with unicode data
+        """
+        self.buffer.feed(data)
+        return self.records()
+
+    def records(self):
+        """Yield the records of all complete frames in the buffer
+        """
+        for token in self.buffer.tokens():
+            if token.startswith(STX):
+                for record in self.decode_frame(token):
+                    yield record
+            elif token.startswith(EOT):
+                self.pending = b""
+                self.delimiters = DEFAULT_DELIMITERS
+
+    def decode_frame(self, frame):
+        """Returns the records completed by the frame
+        """
+        tail, cs = frame[-3:-2], frame[-2:]
+        if tail not in (ETX, ETB) or not frame[1:2].isdigit():
+            self.pending = b""
+            raise ValueError("Malformed ASTM frame %r" % frame)
+        ccs = make_checksum(frame[1:-2])
+        if cs.upper() != ccs:
+            self.pending = b""
+            raise ValueError("Checksum wrong: expected %r, got %r" % (cs, ccs))
+        records = (self.pending + frame[2:-3]).split(RECORD_SEP)
+        if tail == ETB:
+            # the last record continues in the next frame
+            self.pending = records.pop()
+        else:
+            self.pending = b""
+            # the last record is terminated by CR before the ETX
+            if not records[-1]:
+                records.pop()
+        out = []
+        for record in records:
+            if record[:1] == b"H":
+                self.delimiters = get_delimiters(record)
+            out.append(self.delimiters.decode_record(record, self.encoding))
+        return out
+
+
+def decode_stream(stream, encoding=ENCODING, size=65536):
+    """Decodes the ASTM frames of a file-like object record by record
+
+    :param stream: binary file-like object, e.g. an archived message
+    :param size: number of bytes to read at once
+    :yields: records with unicode data
+    """
+    decoder = IncrementalDecoder(encoding)
+    while True:
+        data = stream.read(size)
+        if not data:
+            break
+        for record in decoder.feed(data):
+            yield record
+
+
+class RecordView(object):
+    """Lazy view of a record in a decoded message
+
+    The view indexes the field offsets of the record within the data of the
+    message when a field is accessed by its position and decodes only that
+    field, empty fields are `None` without any decoding. The fields are
+    sliced from a shared :class:`memoryview` of the data, so that the
+    message is not copied. Iterating the view decodes the whole record at
+    once.
+
+    The decoded values are not cached, each access returns new lists for
+    fields with components. The view compares equal to the list of the
+    eagerly decoded record.
+    """
+    __slots__ = ("data", "view", "start", "end", "offsets", "encoding",
+                 "delimiters")
+
+    def __init__(self, data, start=0, end=None, encoding=ENCODING,
+                 delimiters=DEFAULT_DELIMITERS, view=None):
+        self.data = data
+        self.view = memoryview(data) if view is None else view
+        self.start = start
+        self.end = len(data) if end is None else end
+        self.offsets = None
+        self.encoding = encoding
+        self.delimiters = delimiters
+
+    def __len__(self):
+        return self.data.count(self.delimiters.field, self.start, self.end) + 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.tolist()[index]
+        if index == 0:
+            # the record type is read for every record
+            end = self.data.find(self.delimiters.field, self.start, self.end)
+            return self.decode(self.start, self.end if end < 0 else end)
+        offsets = self.get_offsets()
+        if index < 0:
+            index += len(offsets) - 1
+        if not 0 <= index < len(offsets) - 1:
+            raise IndexError("record field index out of range")
+        return self.decode(offsets[index], offsets[index + 1] - 1)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, (list, RecordView)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "RecordView(%r)" % self.tolist()
+
+    def get_offsets(self):
+        """Returns the start offsets of the fields and the end of the record
+        + 1
+        """
+        if self.offsets is None:
+            data, sep, end = self.data, self.delimiters.field, self.end
+            offsets = [self.start]
+            pos = data.find(sep, self.start, end)
+            while pos >= 0:
+                offsets.append(pos + 1)
+                pos = data.find(sep, pos + 1, end)
+            offsets.append(end + 1)
+            self.offsets = offsets
+        return self.offsets
+
+    def decode(self, start, end):
+        """Decodes the field between the offsets
+        """
+        if start == end:
+            return None
+        data = self.data
+        delimiters = self.delimiters
+        if data.find(delimiters.repeat, start, end) >= 0:
+            return delimiters.decode_repeated_component(
+                data[start:end], self.encoding)
+        if data.find(delimiters.component, start, end) >= 0:
+            return delimiters.decode_component(data[start:end], self.encoding)
+        return str(self.view[start:end], self.encoding)
+
+    def tolist(self):
+        """Returns the eagerly decoded record
+        """
+        return self.delimiters.decode_record(
+            self.data[self.start:self.end], self.encoding)
+
+
+def decode_lazy(data, encoding=ENCODING, delimiters=None):
+    """Decodes ASTM data to lazy record views
+
+    Accepts the same data as :func:`decode`, i.e. a complete message, a frame
+    or a record, and returns the records as :class:`RecordView` objects over
+    the data, which compare equal to the records returned by :func:`decode`.
+
+    :param data: ASTM data object.
+    :type data: bytes
+    :return: List of :class:`RecordView`
+    """
+    if not isinstance(data, bytes):
+        raise TypeError("bytes expected, got %r" % data)
+    view = memoryview(data)
+    start, end = 0, len(data)
+    if data.startswith(STX):
+        while end and data[end - 1] in CRLF:
+            end -= 1
+        # remove STX and the checksum
+        start, end = 1, end - 2
+        cs, ccs = data[end:end + 2], make_checksum(view[start:end])
+        assert cs.upper() == ccs, \
+            "Checksum wrong: expected %r, got %r" % (cs, ccs)
+    if data[start:start + 1].isdigit():
+        if data.endswith(CR + ETX, start, end):
+            end -= 2
+        elif data.endswith(ETB, start, end):
+            end -= 1
+        else:
+            raise ValueError("Incomplete frame data %r. Expected trailing "
+                             "<CR><ETX> or <ETB> chars" % data[start:end])
+        start += 1
+    elif start:
+        raise ValueError("Malformed ASTM frame. Expected leading seq number "
+                         "%r" % data[start:end])
+    if delimiters is None:
+        delimiters = get_delimiters(data[start:start + 5])
+    records = []
+    pos = data.find(RECORD_SEP, start, end)
+    while pos >= 0:
+        records.append(RecordView(
+            data, start, pos, encoding, delimiters, view))
+        start = pos + 1
+        pos = data.find(RECORD_SEP, start, end)
+    records.append(RecordView(data, start, end, encoding, delimiters, view))
+    return records
 
 
 # #############################################################################
@@ -179,10 +533,9 @@ def encode(records, encoding=ENCODING, size=None, seq=1):
     :return: List of ASTM message chunks.
     :rtype: list
     """
-    msg = encode_message(seq, records, encoding)
-    if size is not None and len(msg) > size:
-        return list(split(msg, size))
-    return [msg]
+    text = b"".join([encode_record(record, encoding) + RECORD_SEP
+                     for record in records])
+    return list(iter_frames(text, seq, size))
 
 
 def iter_encode(records, encoding=ENCODING, size=None, seq=1):
@@ -191,18 +544,18 @@ def iter_encode(records, encoding=ENCODING, size=None, seq=1):
     If the result message is too large (greater than specified `size` if it's
     not :const:`None`), than it will be split by chunks.
 
+    The records are encoded one by one, so that an iterable of records is
+    sent frame by frame without encoding all of them first, e.g. with the
+    E1381 frame size of :const:`MAX_FRAME_SIZE`.
+
     :yields: ASTM message chunks.
     :rtype: str
     """
     for record in records:
-        msg = encode_message(seq, [record], encoding)
-        if size is not None and len(msg) > size:
-            for chunk in split(msg, size):
-                seq += 1
-                yield chunk
-        else:
+        text = encode_record(record, encoding) + RECORD_SEP
+        for chunk in iter_frames(text, seq, size):
             seq += 1
-            yield msg
+            yield chunk
 
 
 def encode_message(seq, records, encoding=ENCODING):
@@ -240,44 +593,58 @@ def encode_record(record, encoding=ENCODING):
     :returns: Encoded ASTM record.
     :rtype: str
     """
-    fields = []
-    _append = fields.append
-    for field in record:
-        if isinstance(field, bytes):
-            _append(field)
-        elif isinstance(field, unicode):
-            _append(field.encode(encoding))
-        elif isinstance(field, Iterable):
-            _append(encode_component(field, encoding))
-        elif field is None:
-            _append(b"")
-        else:
-            _append(unicode(field).encode(encoding))
-    return FIELD_SEP.join(fields)
+    text = FIELD_SEP_TEXT.join([
+        field_text(field, encoding) for field in record])
+    return text.encode(encoding, ESCAPE_ERRORS)
 
 
 def encode_component(component, encoding=ENCODING):
     """Encodes ASTM record field components.
     """
-    items = []
-    _append = items.append
-    for item in component:
-        if isinstance(item, bytes):
-            _append(item)
-        elif isinstance(item, unicode):
-            _append(item.encode(encoding))
-        elif isinstance(item, Iterable):
-            return encode_repeated_component(component, encoding)
-        elif item is None:
-            _append(b"")
-        else:
-            _append(unicode(item).encode(encoding))
-
-    return COMPONENT_SEP.join(items).rstrip(COMPONENT_SEP)
+    return component_text(component, encoding).encode(encoding, ESCAPE_ERRORS)
 
 
 def encode_repeated_component(components, encoding=ENCODING):
     """Encodes repeated components.
     """
-    return REPEAT_SEP.join(
-        encode_component(item, encoding) for item in components)
+    return REPEAT_SEP_TEXT.join([
+        component_text(item, encoding) for item in components
+    ]).encode(encoding, ESCAPE_ERRORS)
+
+
+def field_text(field, encoding=ENCODING):
+    """Returns the text of a record field
+
+    The records are joined as text and encoded once, which is faster than
+    encoding every value on its own. Pre-encoded values are decoded with
+    surrogate escapes, so that their bytes are encoded as they were.
+    """
+    if field is None:
+        return u""
+    elif isinstance(field, unicode):
+        return field
+    elif isinstance(field, bytes):
+        return field.decode(encoding, ESCAPE_ERRORS)
+    elif isinstance(field, (list, tuple)) or isinstance(field, Iterable):
+        return component_text(field, encoding)
+    return unicode(field)
+
+
+def component_text(component, encoding=ENCODING):
+    """Returns the text of the (repeated) components of a record field
+    """
+    items = []
+    _append = items.append
+    for item in component:
+        if item is None:
+            _append(u"")
+        elif isinstance(item, unicode):
+            _append(item)
+        elif isinstance(item, bytes):
+            _append(item.decode(encoding, ESCAPE_ERRORS))
+        elif isinstance(item, (list, tuple)) or isinstance(item, Iterable):
+            return REPEAT_SEP_TEXT.join([
+                component_text(value, encoding) for value in component])
+        else:
+            _append(unicode(item))
+    return COMPONENT_SEP_TEXT.join(items).rstrip(COMPONENT_SEP_TEXT)
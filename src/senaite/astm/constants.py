@@ -22,6 +22,9 @@ CR = b"\x0D"
 #: CR + LF shortcut.
 CRLF = CR + LF
 
+#: Maximum frame size of E1381: 240 characters text and 7 control characters.
+MAX_FRAME_SIZE = 247
+
 #: Message records delimiter.
 RECORD_SEP = b"\x0D"  # \r #
 #: Record fields delimiter.
@@ -3,12 +3,17 @@
 # Credits to Alexander Shorin:
 # https://github.com/kxepal/python-astm
 
+import base64
 import datetime
 import decimal
 import inspect
 import json
+import math
+import sys
 import time
 import warnings
+import zlib
+from array import array
 from itertools import islice
 
 from senaite.astm.compat import basestring
@@ -16,6 +21,23 @@ from senaite.astm.compat import long
 from senaite.astm.compat import make_string
 from senaite.astm.compat import unicode
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Maximum number of validated date and time strings remembered per field type
+MEMO_SIZE = 1024
+
+# Encoding of binary float arrays, e.g. the histograms of Horiba Yumizen H5xx
+FLOATLE_DEFLATE_BASE64 = "FLOATLE-stream/deflate:base64"
+
+# Significant digits of single precision floats
+FLOAT32_DIGITS = 7
+
+# Prefix of the (slot) attributes that store the values of the fields
+SLOT_PREFIX = "_f_"
+
 
 class Field(object):
     """Base mapping field class.
@@ -26,10 +48,19 @@ class Field(object):
         self.required = required
         self.length = length
 
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self.slot = None if name is None else SLOT_PREFIX + name
+
     def __get__(self, instance, owner):
         if instance is None:
             return self
-        value = instance._data.get(self.name)
+        value = getattr(instance, self.slot, None)
         if value is not None:
             value = self._get_value(value)
         elif self.default is not None:
@@ -42,7 +73,7 @@ class Field(object):
     def __set__(self, instance, value):
         if value is not None:
             value = self._set_value(value)
-        instance._data[self.name] = value
+        setattr(instance, self.slot, value)
 
     def _get_value(self, value):
         return value
@@ -127,15 +158,138 @@ class JSONListField(Field):
             return default
 
 
+class NestedListField(Field):
+    """Keeps the decoded repeats and components as (nested) lists of strings
+    """
+    def _set_value(self, value):
+        if isinstance(value, (list, tuple)):
+            return [None if item is None else self._set_value(item)
+                    for item in value]
+        return super(NestedListField, self)._set_value(value)
+
+
+def decode_floats(data):
+    """Decode a base64 encoded and raw deflated stream of little-endian floats
+
+    The inflated buffer is reinterpreted without copying if numpy is
+    installed, otherwise it is read into an `array` of C floats.
+
+    :param data: base64 encoded data
+    :returns: numpy array or `array.array` of floats
+    """
+    try:
+        raw = zlib.decompress(base64.b64decode(data), -zlib.MAX_WBITS)
+    except (TypeError, ValueError, zlib.error) as exc:
+        raise ValueError("Invalid float stream: %s" % exc)
+    if len(raw) % 4:
+        raise ValueError("Float stream size %d is not a multiple of 4"
+                         "" % len(raw))
+    if numpy is not None:
+        return numpy.frombuffer(raw, dtype="<f4")
+    values = array("f")
+    values.frombytes(raw)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def downsample(values, size):
+    """Reduce the values to `size` averages of (almost) equal sized bins
+    """
+    count = len(values)
+    if size <= 0 or count <= size:
+        return values
+    bounds = [index * count // size for index in range(size + 1)]
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        sums = numpy.add.reduceat(values, bounds[:-1], dtype="f8")
+        return sums / numpy.diff(bounds)
+    return array("d", [
+        sum(values[start:end]) / (end - start)
+        for start, end in zip(bounds, bounds[1:])])
+
+
+def to_floats(values, digits=FLOAT32_DIGITS):
+    """Returns the values as list of floats with the given significant digits
+
+    The single precision values do not carry more digits, without rounding
+    they are serialized with the noise of their double precision repr.
+    NaN and infinity are no valid JSON and returned as None.
+    """
+    fmt = "%%.%dg" % digits
+    return [float(fmt % value) if math.isfinite(value) else None
+            for value in values]
+
+
+class FloatArrayField(Field):
+    """Mapping field for binary encoded float arrays
+
+    Decodes components like `FLOATLE-stream/deflate:base64^<data>` into a list
+    of floats. Arrays longer than `size` are downsampled to `size` averages.
+    Values in other encodings are kept as they are.
+    """
+    def __init__(self, name=None, default=None, required=False, size=0):
+        super(FloatArrayField, self).__init__(name, default, required)
+        self.size = size
+
+    def _set_value(self, value):
+        if not isinstance(value, list) or len(value) != 2:
+            return value
+        encoding, data = value
+        if encoding != FLOATLE_DEFLATE_BASE64:
+            return value
+        if not data:
+            return []
+        values = decode_floats(data)
+        return to_floats(downsample(values, self.size).tolist())
+
+
+def validate_digits(value, memo, factory, *widths):
+    """Fast path to validate date and time strings of fixed width digits
+
+    The value is split into the integers of the given widths, which must be
+    accepted by `factory`, e.g. `datetime.date`. Validated values are
+    remembered in `memo`, because the records of a message usually share
+    their timestamps.
+
+    :returns: the value if it is valid or None if it must be parsed
+    """
+    if value in memo:
+        return value
+    if len(value) != sum(widths) or not value.isascii() \
+            or not value.isdigit():
+        return None
+    # strftime does not pad years before 1000 to 4 digits
+    if widths[0] == 4 and value[0] == "0":
+        return None
+    parts = []
+    start = 0
+    for width in widths:
+        parts.append(int(value[start:start + width]))
+        start += width
+    try:
+        factory(*parts)
+    except ValueError:
+        return None
+    if len(memo) >= MEMO_SIZE:
+        memo.clear()
+    memo.add(value)
+    return value
+
+
 class DateField(Field):
     """Mapping field for storing date/time values.
     """
     format = "%Y%m%d"
+    memo = set()
 
     def _get_value(self, value):
         return datetime.datetime.strptime(value, self.format)
 
     def _set_value(self, value):
+        if isinstance(value, unicode) and self.format == DateField.format:
+            valid = validate_digits(value, self.memo, datetime.date, 4, 2, 2)
+            if valid is not None:
+                return valid
         if isinstance(value, basestring):
             value = self._get_value(value)
         if not isinstance(value, (datetime.datetime, datetime.date)):
@@ -147,6 +301,7 @@ class TimeField(Field):
     """Mapping field for storing times.
     """
     format = "%H%M%S"
+    memo = set()
 
     def _get_value(self, value):
         if isinstance(value, basestring):
@@ -159,6 +314,11 @@ class TimeField(Field):
         return value
 
     def _set_value(self, value):
+        if isinstance(value, unicode) and self.format == TimeField.format:
+            valid = validate_digits(
+                value.split(".", 1)[0], self.memo, datetime.time, 2, 2, 2)
+            if valid is not None:
+                return valid
         if isinstance(value, basestring):
             value = self._get_value(value)
         if not isinstance(value, (datetime.datetime, datetime.time)):
@@ -172,11 +332,17 @@ class DateTimeField(Field):
     """Mapping field for storing date/time values.
     """
     format = "%Y%m%d%H%M%S"
+    memo = set()
 
     def _get_value(self, value):
         return datetime.datetime.strptime(value, self.format)
 
     def _set_value(self, value):
+        if isinstance(value, unicode) and self.format == DateTimeField.format:
+            valid = validate_digits(
+                value, self.memo, datetime.datetime, 4, 2, 2, 2, 2, 2)
+            if valid is not None:
+                return valid
         if isinstance(value, basestring):
             value = self._get_value(value)
         if not isinstance(value, (datetime.datetime, datetime.date)):
@@ -114,11 +114,13 @@ class HeaderRecord(records.HeaderRecord):
     # - Component delimiter – caret (ASCII 94)( ^ ) Latin-1 (94)
     # - Escape delimiter – backslash (ASCII 92)( \ ) Latin-1 (92)
     # E.g. H|@^\|12X||GeneXpert PC^Xpert^6.1|||||LIS||P|1394-97|20190521100245
+    # The record is decoded with the declared delimiters, so that the field
+    # is split at the repeat delimiter like the standard `\^&`
     delimeter = RepeatedComponentField(
         Component.build(
             TextField(name="_", default=""),
             TextField(name="__")
-        ), default=[[], ["@", ""]]
+        ), default=[[], ["", "\\"]]
     )
 
     # Message ID: Uniquely identifies the message
@@ -2,16 +2,28 @@
 
 from senaite.astm import records
 from senaite.astm.fields import ComponentField
+from senaite.astm.fields import ConstantField
 from senaite.astm.fields import DateTimeField
+from senaite.astm.fields import FloatArrayField
+from senaite.astm.fields import IntegerField
+from senaite.astm.fields import NestedListField
 from senaite.astm.fields import NotUsedField
 from senaite.astm.fields import SetField
 from senaite.astm.fields import TextField
 from senaite.astm.mapping import Component
+from senaite.astm.mapping import Record
 
 VERSION = "1.0.0"
 # Supports H500 and H550
 HEADER_RX = r".*H5[0,5]0\^"
 
+# Decode the binary histograms and matrices of the M records into arrays of
+# floats instead of dropping them
+DECODE_HISTOGRAMS = False
+
+# Number of averaged values the decoded histograms and matrices are reduced to
+HISTOGRAM_SIZE = 256
+
 
 def get_metadata(wrapper):
     """Additional metadata
@@ -35,11 +47,19 @@ def get_mapping():
         "R": ResultRecord,
         "C": CommentRecord,
         "Q": RequestInformationRecord,
-        "M": ManufacturerInfoRecord,
+        "M": get_manufacturer_record(),
         "L": TerminatorRecord,
     }
 
 
+def get_manufacturer_record():
+    """Returns the wrapper for manufacturer records (M)
+    """
+    if not DECODE_HISTOGRAMS:
+        return ManufacturerInfoRecord
+    return HistogramRecord
+
+
 class HeaderRecord(records.HeaderRecord):
     """Message Header Record (H)
     """
@@ -145,6 +165,20 @@ class ManufacturerInfoRecord(records.ManufacturerInfoRecord):
     """
 
 
+# Manufacturer Specific Records (M) with decoded arrays
+HistogramRecord = Record.build(
+    ConstantField(name="type", default="M"),
+    IntegerField(name="seq", default=1, required=True),
+    # HISTOGRAM, MATRIX or REAGENT
+    TextField(name="kind"),
+    # the reagent names and lots of REAGENT records are repeated components
+    NestedListField(name="group"),
+    NestedListField(name="name"),
+    FloatArrayField(name="parameters"),
+    FloatArrayField(name="data", size=HISTOGRAM_SIZE),
+)
+
+
 class TerminatorRecord(records.TerminatorRecord):
     """Message Termination Record (L)
     """
@@ -1,17 +1,65 @@
 # -*- coding: utf-8 -*-
 
+import threading
+import time
 from time import sleep
+from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from senaite.astm import logger
 
 # SENAITE.JSONAPI route
 API_BASE_URL = "@@API/senaite/v1"
 
+# Number of pooled connections to SENAITE
+POOL_SIZE = 10
+
+# Seconds until a successful authentication is checked again
+AUTH_TTL = 300
+
+# HTTP status codes that invalidate the authentication
+AUTH_ERRORS = (401, 403)
+
+# Seconds to wait for a response of SENAITE
+TIMEOUT = 60
+
+# Number of analyses fetched per request when the open orders are fetched
+ORDERS_PAGE_SIZE = 1000
+
+
+def push_to_senaite(messages, session, consumer="senaite.lis2a.import"):
+    """Push ASTM messages to SENAITE in a single attempt
+
+    :returns: True if SENAITE accepted the messages, otherwise False
+    """
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+
+    # Open a session with SENAITE and authenticate
+    if not session.auth():
+        return False
+
+    # Send the messages
+    payload = {
+        'consumer': consumer,
+        'messages': messages,
+    }
+    response = session.post('push', payload)
+    if not response.get('success'):
+        return False
+
+    session.pushed += len(messages)
+    logger.debug('Pushed {} message(s), {:.2f} requests per message'
+                 .format(len(messages), session.requests_per_message))
+    return True
+
 
 def post_to_senaite(messages, session, **kwargs):
     """POST ASTM messages to SENAITE
+
+    :returns: True if SENAITE accepted the messages, otherwise False
     """
     attempt = 1
     retries = kwargs.get('retries', 3)
@@ -20,19 +68,9 @@ def post_to_senaite(messages, session, **kwargs):
     success = False
 
     while True:
-        # Open a session with SENAITE and authenticate
-        authenticated = session.auth()
-        # Build the POST payload
-        payload = {
-            'consumer': consumer,
-            'messages': messages,
-        }
-        if authenticated:
-            # Send the message
-            response = session.post('push', payload)
-            success = response.get('success')
-            if success:
-                break
+        success = push_to_senaite(messages, session, consumer=consumer)
+        if success:
+            break
 
         # the break here ensures that at least one time is tried
         if attempt >= retries:
@@ -49,10 +87,55 @@ def post_to_senaite(messages, session, **kwargs):
 
     if not success:
         logger.error('Could not push the message')
+    return success
+
+
+def fetch_orders(session, limit=ORDERS_PAGE_SIZE):
+    """Fetch the open orders from SENAITE
+
+    The analyses that are not yet submitted are fetched page by page and
+    grouped by the ID of their sample.
+
+    :returns: mapping of sample ID -> list of test keywords or None on failure
+    """
+    if not session.auth():
+        return None
+
+    orders = {}
+    start = 0
+    while True:
+        endpoint = "search?{}".format(urlencode([
+            ("portal_type", "Analysis"),
+            ("review_state", "unassigned"),
+            ("review_state", "assigned"),
+            ("limit", limit),
+            ("b_start", start),
+        ], doseq=True))
+        response = session.get(endpoint)
+        if not response or "items" not in response:
+            return None
+        items = response.get("items") or []
+        for item in items:
+            sample_id = item.get("getRequestID")
+            keyword = item.get("getKeyword")
+            if not sample_id or not keyword:
+                continue
+            tests = orders.setdefault(sample_id, [])
+            if keyword not in tests:
+                tests.append(keyword)
+        start += len(items)
+        if not items or start >= response.get("count", 0):
+            break
+    return orders
 
 
 class Session(object):
     """SENAITE Request Session
+
+    The underlying HTTP session is kept open and pools its connections, so
+    that subsequent requests reuse them. A successful authentication is
+    remembered for `auth_ttl` seconds or until SENAITE responds with 401 or
+    403.
     """
 
     def __init__(self, url, **kw):
@@ -60,15 +143,66 @@ class Session(object):
         self.username = auth[0]
         self.password = auth[1]
         self.url = requests.utils.urldefragauth(url)
+        self.pool_size = kw.get("pool_size", POOL_SIZE)
+        self.auth_ttl = kw.get("auth_ttl", AUTH_TTL)
+        self.authenticated_at = None
+        self.lock = threading.Lock()
+        self._session = None
+        # statistics
+        self.requests = 0
+        self.pushed = 0
 
     @property
     def session(self):
+        with self.lock:
+            if self._session is None:
+                self._session = self.create_session()
+            return self._session
+
+    def create_session(self):
+        """Create a new HTTP session with a connection pool
+        """
         session = requests.Session()
         session.auth = (self.username, self.password)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
         return session
 
-    def auth(self):
+    def close(self):
+        """Close all pooled connections
+        """
+        with self.lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    @property
+    def requests_per_message(self):
+        """Number of HTTP requests sent per pushed message
+        """
+        if not self.pushed:
+            return float(self.requests)
+        return float(self.requests) / self.pushed
+
+    def is_authenticated(self):
+        """Checks if the last successful authentication is still valid
+        """
+        if self.authenticated_at is None:
+            return False
+        return time.monotonic() - self.authenticated_at < self.auth_ttl
+
+    def invalidate(self):
+        """Forget the authentication state
+        """
+        self.authenticated_at = None
+
+    def auth(self, force=False):
+        if not force and self.is_authenticated():
+            return True
+
         logger.info("Starting session with SENAITE ...")
+        self.invalidate()
 
         # try to get the version of the remote JSON API
         version = self.get("version")
@@ -85,26 +219,36 @@ class Session(object):
 
         logger.info("Session established ('{}') with '{}'"
                     .format(self.username, self.url))
+        self.authenticated_at = time.monotonic()
         return True
 
-    def post(self, endpoint, payload):
+    def post(self, endpoint, payload, timeout=TIMEOUT):
         """Sends a POST request to SENAITE
         """
         url = self.get_url(endpoint)
+        self.requests += 1
         try:
-            response = self.session.post(url, data=payload)
+            response = self.session.post(url, data=payload, timeout=timeout)
         except Exception as e:
             message = "Could not send POST to {}".format(url)
             logger.error(message)
             logger.error(e)
             return {}
 
-        return response.json()
+        status = response.status_code
+        if status in AUTH_ERRORS:
+            message = "POST for {} returned {}".format(endpoint, status)
+            logger.error(message)
+            self.invalidate()
+            return {}
+
+        return self.get_json(response, endpoint)
 
-    def get(self, endpoint, timeout=60):
+    def get(self, endpoint, timeout=TIMEOUT):
         """Fetch the given url or endpoint and return a parsed JSON object
         """
         url = self.get_url(endpoint)
+        self.requests += 1
         try:
             response = self.session.get(url, timeout=timeout)
         except Exception as e:
@@ -117,9 +261,23 @@ class Session(object):
         if status != 200:
             message = "GET for {} returned {}".format(endpoint, status)
             logger.error(message)
+            if status in AUTH_ERRORS:
+                self.invalidate()
             return {}
 
-        return response.json()
+        return self.get_json(response, endpoint)
+
+    def get_json(self, response, endpoint):
+        """Returns the parsed JSON of the response or {} if it is no JSON
+
+        E.g. a proxy in front of SENAITE answers with an HTML error page.
+        """
+        try:
+            return response.json()
+        except ValueError:
+            logger.error("Response for {} is not JSON (status {})"
+                         .format(endpoint, response.status_code))
+            return {}
 
     def get_url(self, endpoint):
         """Create an API URL from an endpoint or absolute url
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from senaite.astm import logger
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Event loop implementations to choose from
+LOOPS = ("asyncio", "uvloop")
+
+DEFAULT_LOOP = "asyncio"
+
+
+def get_event_loop_policy(name=DEFAULT_LOOP):
+    """Returns the event loop policy of the given loop implementation
+
+    Falls back to the default asyncio policy if the implementation is not
+    installed.
+
+    :param name: One of `LOOPS`
+    :returns: Tuple of the name of the used implementation and its policy
+    """
+    if name not in LOOPS:
+        raise ValueError("Unknown event loop {!r}".format(name))
+    if name == "uvloop":
+        if uvloop is not None:
+            return name, uvloop.EventLoopPolicy()
+        logger.warning("uvloop is not installed, using the asyncio event "
+                       "loop. Install it with `pip install uvloop`")
+    return DEFAULT_LOOP, asyncio.DefaultEventLoopPolicy()
+
+
+def install_event_loop_policy(name=DEFAULT_LOOP):
+    """Install the event loop policy for all new event loops
+
+    :param name: One of `LOOPS`
+    :returns: Name of the installed implementation
+    """
+    name, policy = get_event_loop_policy(name)
+    asyncio.set_event_loop_policy(policy)
+    logger.debug("Using the {} event loop".format(name))
+    return name
@@ -5,16 +5,50 @@
 
 from operator import itemgetter
 
+from senaite.astm.compat import basestring
+from senaite.astm.fields import ComponentField
+from senaite.astm.fields import ConstantField
+from senaite.astm.fields import DateField
+from senaite.astm.fields import DateTimeField
+from senaite.astm.fields import DecimalField
 from senaite.astm.fields import Field
+from senaite.astm.fields import IntegerField
+from senaite.astm.fields import JSONListField
+from senaite.astm.fields import NotUsedField
+from senaite.astm.fields import RepeatedComponentField
+from senaite.astm.fields import SetField
+from senaite.astm.fields import TextField
+from senaite.astm.fields import TimeField
 
 try:
     from itertools import izip_longest
 except ImportError:  # Python 3
     from itertools import zip_longest as izip_longest
 
+# Fields that always store a string or None
+SCALAR_FIELDS = (
+    ConstantField,
+    DateField,
+    DateTimeField,
+    DecimalField,
+    Field,
+    IntegerField,
+    JSONListField,
+    NotUsedField,
+    TextField,
+    TimeField,
+)
+
 
 class MetaMapping(type):
     """Metaclass for record mappings
+
+    Mappings with a true `_compiled` attribute, and all their subclasses,
+    store the values of their fields in slots instead of an instance
+    dictionary and get a constructor that is generated for their fields. The
+    constructor of
+    mappings with a true `_trusted` attribute skips the validation of the
+    fields, see `get_trusted`.
     """
     def __new__(mcs, name, bases, d):
         fields = []
@@ -40,19 +74,150 @@ class MetaMapping(type):
         else:
             merge_fields(d['_fields'])
             d['_fields'] = fields
-        return super(MetaMapping, mcs).__new__(mcs, name, bases, d)
+        compiled = d.get('_compiled', any(
+            getattr(base, '_compiled', False) for base in bases))
+        if compiled and '__slots__' not in d:
+            d['__slots__'] = tuple(
+                field.slot for name, field in fields
+                if not any(hasattr(base, field.slot) for base in bases))
+        cls = super(MetaMapping, mcs).__new__(mcs, name, bases, d)
+        if compiled and '__init__' not in d:
+            cls.__init__ = compile_init(cls)
+        return cls
+
+
+def compile_init(cls):
+    """Generate a constructor that sets the fields of the mapping in order
+
+    The generated constructor behaves like `Mapping.__init__`, but assigns
+    the positional and keyword arguments to the fields without building an
+    intermediate dictionary and calling `setattr` for every field.
+    """
+    trusted = getattr(cls, '_trusted', False)
+    namespace = {"cls": cls, "set_component": set_component}
+    params = ["self"]
+    body = ["    if kwargs:"]
+    for index, (attrname, field) in enumerate(cls._fields):
+        params.append("v%d=None" % index)
+        body.append("        v%d = kwargs.pop(%r, v%d)"
+                    "" % (index, attrname, index))
+    if not cls._fields:
+        body.append("        pass")
+    for index, (attrname, field) in enumerate(cls._fields):
+        namespace["f%d" % index] = field
+        plain = type(field).__get__ is Field.__get__ and \
+            type(field).__set__ is Field.__set__
+        if trusted and type(field) is NotUsedField:
+            # drop the value without a warning
+            body.append("    self.%s = None" % field.slot)
+        elif trusted and is_trusted_set(field) and field.default is None:
+            # store strings without checking the set
+            body.extend([
+                "    if v%d is not None and v%d.__class__ is not str:"
+                "" % (index, index),
+                "        v%d = f%d._set_value(v%d)" % (index, index, index),
+                "    self.%s = v%d" % (field.slot, index),
+            ])
+        elif trusted and type(field) is ComponentField:
+            namespace["m%d" % index] = get_trusted(field.mapping)
+            body.extend([
+                "    if v%d is None:" % index,
+                "        f%d.__set__(self, f%d.__get__(self, cls))"
+                "" % (index, index),
+                "    else:",
+                "        self.%s = set_component(f%d, m%d, v%d)"
+                "" % (field.slot, index, index, index),
+            ])
+        elif trusted and type(field) is RepeatedComponentField and \
+                type(field.field) is ComponentField:
+            namespace["c%d" % index] = field.field
+            namespace["m%d" % index] = get_trusted(field.field.mapping)
+            body.extend([
+                "    if v%d is None:" % index,
+                "        f%d.__set__(self, f%d.__get__(self, cls))"
+                "" % (index, index),
+                "    else:",
+                "        self.%s = [set_component(c%d, m%d, item) "
+                "for item in v%d]" % (field.slot, index, index, index),
+            ])
+        elif plain and field.default is None:
+            # inlined `Field.__set__`
+            body.extend([
+                "    if v%d is not None:" % index,
+                "        v%d = f%d._set_value(v%d)" % (index, index, index),
+                "    self.%s = v%d" % (field.slot, index),
+            ])
+        else:
+            body.extend([
+                "    if v%d is None:" % index,
+                "        v%d = f%d.__get__(self, cls)" % (index, index),
+                "    f%d.__set__(self, v%d)" % (index, index),
+            ])
+    body.extend([
+        "    if args:",
+        "        kwargs[None] = args[-1]",
+        "    if kwargs:",
+        "        raise ValueError('Unexpected kwargs found: %r' % kwargs)",
+    ])
+    params.extend(["*args", "**kwargs"])
+    source = "def __init__(%s):\n%s\n" % (", ".join(params), "\n".join(body))
+    exec(compile(source, "<%s.__init__>" % cls.__name__, "exec"), namespace)
+    return namespace["__init__"]
+
+
+def is_trusted_set(field):
+    """Checks if the set field stores valid strings as they are
+    """
+    if type(field) is not SetField:
+        return False
+    return type(field.field) in (Field, TextField) and \
+        field.field.length is None
 
 
-_MappingProxy = MetaMapping('_MappingProxy', (object,), {})  # Python 3
+def set_component(field, mapping, value):
+    """Set the value of the component field with the trusted mapping
+    """
+    if isinstance(value, dict):
+        return mapping(**value)
+    elif isinstance(value, field.mapping):
+        return value
+    if isinstance(value, basestring):
+        value = [value]
+    return mapping(*value)
+
+
+def get_trusted(cls):
+    """Returns the trusted variant of the mapping class
+
+    The constructor of the trusted variant drops the values of not used
+    fields without a warning and stores strings of set fields without
+    checking them against the set, also in the components. It is meant for
+    instruments whose messages are known to be valid.
+    """
+    if getattr(cls, '_trusted', False):
+        return cls
+    trusted = cls.__dict__.get('_trusted_variant')
+    if trusted is None:
+        trusted = MetaMapping(cls.__name__, (cls,), {
+            '_compiled': True,
+            '_trusted': True,
+            '__module__': cls.__module__,
+        })
+        cls._trusted_variant = trusted
+    return trusted
+
+
+_MappingProxy = MetaMapping('_MappingProxy', (object,), {
+    '__slots__': ()})  # Python 3
 
 
 class Mapping(_MappingProxy):
+    __slots__ = ()
 
     def __init__(self, *args, **kwargs):
         fieldnames = map(itemgetter(0), self._fields)
         values = dict(izip_longest(fieldnames, args))
         values.update(kwargs)
-        self._data = {}
         for attrname, field in self._fields:
             attrval = values.pop(attrname, None)
             if attrval is None:
@@ -63,16 +228,24 @@ class Mapping(_MappingProxy):
             raise ValueError('Unexpected kwargs found: %r' % values)
 
     @classmethod
-    def build(cls, *a):
+    def build(cls, *a, compiled=False):
+        """Build a mapping class with the given ordered fields
+
+        :param compiled: store the values in slots and generate the
+                         constructor of the class
+        """
         fields = []
-        newcls = type('Generic' + cls.__name__, (cls,), {})
+        d = {'_compiled': True} if compiled else {}
         for field in a:
             if field.name is None:
                 raise ValueError('Name is required for ordered fields.')
             # set the definied fields as class attributes
-            setattr(newcls, field.name, field)
+            d[field.name] = field
             fields.append((field.name, field))
+        newcls = type('Generic' + cls.__name__, (cls,), d)
         newcls._fields = fields
+        if getattr(newcls, '_compiled', False):
+            newcls.__init__ = compile_init(newcls)
         return newcls
 
     def __getitem__(self, key):
@@ -82,7 +255,7 @@ class Mapping(_MappingProxy):
         setattr(self, self._fields[key][0], value)
 
     def __delitem__(self, key):
-        self._data[self._fields[key][0]] = None
+        setattr(self, self._fields[key][1].slot, None)
 
     def __iter__(self):
         return iter(self.values())
@@ -91,7 +264,7 @@ class Mapping(_MappingProxy):
         return item in self.values()
 
     def __len__(self):
-        return len(self._data)
+        return len(self._fields)
 
     def __eq__(self, other):
         if len(self) != len(other):
@@ -121,50 +294,98 @@ class Mapping(_MappingProxy):
     def to_astm(self):
         """Convert to ASTM records
         """
-        def values(obj):
-            for key, field in obj._fields:
-                value = obj._data[key]
-                if isinstance(value, Mapping):
-                    yield list(values(value))
-                elif isinstance(value, list):
-                    stack = []
-                    for item in value:
-                        if isinstance(item, Mapping):
-                            stack.append(list(values(item)))
-                        else:
-                            stack.append(item)
-                    yield stack
-                elif value is None and field.required:
-                    raise ValueError('Field %r value should not be None' % key)
-                else:
-                    yield value
-        return list(values(self))
+        return get_serializer(type(self), "to_astm")(self)
 
     def to_dict(self, obj=None):
         """Convert to ASTM dictionary
         """
-        out = {}
         obj = obj if obj else self
+        return get_serializer(type(obj), "to_dict")(obj)
+
+
+def is_scalar(field):
+    """Checks if the field always stores a string or None
+    """
+    if type(field) is SetField:
+        return is_scalar(field.field)
+    return type(field) in SCALAR_FIELDS
 
-        for key, field in obj._fields:
-            value = obj._data[key]
-            if isinstance(value, Mapping):
-                out[key] = self.to_dict(value)
-            elif isinstance(value, list):
-                out[key] = [self.to_dict(val) for val in value]
-            elif value is None and field.required:
-                raise ValueError("Field %r value should not be None" % key)
-            else:
-                out[key] = value
 
-        return out
+def get_serializer(cls, method):
+    """Returns the (cached) `to_dict` or `to_astm` serializer of the class
+    """
+    name = "_" + method
+    serializer = cls.__dict__.get(name)
+    if serializer is None:
+        serializer = compile_serializer(cls, method)
+        setattr(cls, name, serializer)
+    return serializer
+
+
+def compile_serializer(cls, method):
+    """Generate the `to_dict` or `to_astm` serializer for the fields of the
+    mapping
+
+    The loop over the fields is unrolled and the type checks of the values
+    are only generated for fields that do not always store strings or
+    components.
+    """
+    body = []
+    for index, (key, field) in enumerate(cls._fields):
+        value = "v%d" % index
+        body.append("    %s = obj.%s" % (value, field.slot))
+        check = "if %s is None:" % value
+        if type(field) is ComponentField:
+            body.extend([
+                "    if %s is not None:" % value,
+                "        %s = %s.%s()" % (value, value, method),
+            ])
+            check = "else:"
+        elif type(field) is RepeatedComponentField:
+            body.extend([
+                "    if %s is not None:" % value,
+                "        %s = [item.%s() for item in %s]"
+                "" % (value, method, value),
+            ])
+            check = "else:"
+        elif not is_scalar(field):
+            body.extend([
+                "    if isinstance(%s, Mapping):" % value,
+                "        %s = %s.%s()" % (value, value, method),
+                "    elif isinstance(%s, list):" % value,
+                "        %s = [item.%s() if isinstance(item, Mapping) "
+                "else item for item in %s]" % (value, method, value),
+                "    elif %s is None:" % value,
+            ])
+            check = None
+        if field.required:
+            if check is not None:
+                body.append("    " + check)
+            body.append("        raise ValueError('Field %%r value should "
+                        "not be None' %% %r)" % key)
+        elif check is None:
+            body.append("        pass")
+    values = ["v%d" % index for index in range(len(cls._fields))]
+    if method == "to_dict":
+        result = ", ".join("%r: %s" % (key, value) for (key, field), value
+                           in zip(cls._fields, values))
+        body.append("    return {%s}" % result)
+    else:
+        body.append("    return [%s]" % ", ".join(values))
+    source = "def %s(obj):\n%s\n" % (method, "\n".join(body))
+    namespace = {"Mapping": Mapping}
+    exec(compile(source, "<%s.%s>" % (cls.__name__, method), "exec"),
+         namespace)
+    return namespace[method]
 
 
 class Record(Mapping):
     """ASTM record mapping class.
     """
+    __slots__ = ()
 
 
 class Component(Mapping):
     """ASTM component mapping class.
     """
+    __slots__ = ()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import sqlite3
+import threading
+import time
+
+from senaite.astm import logger
+from senaite.astm.constants import RECORD_SEP
+
+# Seconds between two refreshes of the order cache from SENAITE
+REFRESH_INTERVAL = 60
+
+# Seconds between checks for orders refreshed by another process
+RELOAD_INTERVAL = 1
+
+# Default path of the order cache shared by the worker processes
+ORDER_CACHE_FILE = "senaite-astm-orders.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    sample_id TEXT PRIMARY KEY,
+    tests TEXT NOT NULL
+)
+"""
+
+# Separator of the test keywords in the database
+TESTS_SEP = "\n"
+
+
+class OrderCache(object):
+    """Local cache of the open orders indexed by sample ID
+
+    The orders are looked up in memory, so that a host query of an
+    instrument is answered within its timeout, and are refreshed in bulk
+    from SENAITE in the background. If a path is given, the orders are also
+    stored in a SQLite database to answer queries right after a restart, or
+    by other processes that only reload them, see `reload`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.updated = None
+        self.connection = None
+        # version of the database when the orders were loaded
+        self.version = None
+        if path:
+            self.connection = sqlite3.connect(
+                path, isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(SCHEMA)
+            self.reload()
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, sample_id):
+        return sample_id in self.orders
+
+    def get(self, sample_id):
+        """Returns the test keywords of the sample or None if not known
+        """
+        return self.orders.get(sample_id)
+
+    def load(self):
+        """Returns the orders of the database
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT sample_id, tests FROM orders")
+            return {sample_id: tests.split(TESTS_SEP)
+                    for sample_id, tests in cursor.fetchall()}
+
+    def reload(self):
+        """Load the orders again if another connection changed the database
+
+        :returns: True if the orders were reloaded
+        """
+        with self.lock:
+            cursor = self.connection.execute("PRAGMA data_version")
+            version = cursor.fetchone()[0]
+        if version == self.version:
+            return False
+        self.orders = self.load()
+        self.version = version
+        self.updated = time.time()
+        return True
+
+    def update(self, orders):
+        """Replace all orders
+
+        :param orders: mapping of sample ID -> list of test keywords
+        """
+        orders = {sample_id: list(tests)
+                  for sample_id, tests in orders.items() if tests}
+        if self.connection is not None:
+            with self.lock:
+                self.connection.execute("BEGIN")
+                self.connection.execute("DELETE FROM orders")
+                self.connection.executemany(
+                    "INSERT INTO orders (sample_id, tests) VALUES (?, ?)",
+                    [(sample_id, TESTS_SEP.join(tests))
+                     for sample_id, tests in orders.items()])
+                self.connection.execute("COMMIT")
+        # readers see either the old or the new orders
+        self.orders = orders
+        self.updated = time.time()
+
+    def refresh(self, fetch):
+        """Replace the orders with the fetched ones
+
+        The current orders are kept if the fetch fails.
+
+        :param fetch: callable that returns the orders or None on failure
+        :returns: True if the orders were refreshed
+        """
+        orders = fetch()
+        if orders is None:
+            logger.warning("Could not refresh the order cache, keeping {} "
+                           "order(s)".format(len(self)))
+            return False
+        self.update(orders)
+        logger.debug("Refreshed the order cache: {} order(s)"
+                     .format(len(self)))
+        return True
+
+    def close(self):
+        if self.connection is not None:
+            with self.lock:
+                self.connection.close()
+                self.connection = None
+
+
+async def refresh_orders(cache, fetch, interval=REFRESH_INTERVAL):
+    """Refresh the order cache periodically outside of the event loop
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, cache.refresh, fetch)
+        except Exception as exc:
+            logger.error("Could not refresh the order cache: {!r}"
+                         .format(exc))
+        await asyncio.sleep(interval)
+
+
+async def reload_orders(cache, interval=RELOAD_INTERVAL):
+    """Reload the orders that another process refreshed in the database
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            if await loop.run_in_executor(None, cache.reload):
+                logger.debug("Reloaded the order cache: {} order(s)"
+                             .format(len(cache)))
+        except Exception as exc:
+            logger.error("Could not reload the order cache: {!r}"
+                         .format(exc))
+        await asyncio.sleep(interval)
+
+
+def get_sample_ids(record):
+    """Returns the sample IDs of the starting range of a Q record
+
+    The starting range ID is the specimen ID (``^SAMPLE``) in LIS2-A2, the
+    cobas and Sysmex analyzers send it as the third component after their
+    own IDs (``^^SAMPLE^...``, ``rack^tube^SAMPLE^B``). Several samples are
+    separated by the repeat delimiter. The special value ``ALL`` is ignored.
+    """
+    value = record[2] if len(record) > 2 else None
+    if not value:
+        return []
+    if not isinstance(value, list):
+        value = [[value]]
+    elif not isinstance(value[0], list):
+        value = [value]
+    sample_ids = []
+    for components in value:
+        for index in (2, 1, 0):
+            sample_id = components[index] if len(components) > index else None
+            if sample_id and sample_id.strip():
+                sample_id = sample_id.strip()
+                if sample_id.upper() != "ALL":
+                    sample_ids.append(sample_id)
+                break
+    return sample_ids
+
+
+class QueryResponder(object):
+    """Answers the host queries (Q records) of the instruments with orders
+
+    The answer to a query is a message with a patient and an order record
+    for every known sample. The termination code ``I`` tells the instrument
+    that no information is available if none of the samples is known.
+    """
+
+    def __init__(self, cache, sender="SENAITE", priority="R"):
+        self.cache = cache
+        self.sender = sender
+        self.priority = priority
+
+    def is_query(self, message):
+        """Checks if the message contains a Q record
+        """
+        return message[2:3] == b"Q" or (RECORD_SEP + b"Q") in message
+
+    def respond(self, queries):
+        """Returns the records to answer the queries
+
+        :param queries: decoded Q records
+        :returns: list of records H...L
+        """
+        records = [["H", [[None], [None, "&"]], None, None, self.sender,
+                    None, None, None, None, None, None, "P", "1"]]
+        seq = 0
+        for query in queries:
+            for sample_id in get_sample_ids(query):
+                tests = self.cache.get(sample_id)
+                if not tests:
+                    logger.info("No order for sample {!r}".format(sample_id))
+                    continue
+                seq += 1
+                records.append(["P", str(seq)])
+                records.append(self.get_order(seq, sample_id, tests))
+        records.append(["L", "1", "N" if seq else "I"])
+        return records
+
+    def get_order(self, seq, sample_id, tests):
+        """Returns the order record for the sample
+        """
+        order = [None] * 26
+        order[:6] = ["O", "1", sample_id, None,
+                     [[None, None, None, test] for test in tests],
+                     self.priority]
+        # action code: new order, report type: order
+        order[11] = "N"
+        order[25] = "O"
+        return order
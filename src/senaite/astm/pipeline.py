@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from senaite.astm import logger
+
+# Maximum number of converted messages waiting to be dispatched
+QUEUE_SIZE = 100
+
+# Maximum number of conversion and dispatch tasks in flight
+MAX_TASKS = 100
+
+# Maximum seconds to delay the ACK of a frame, must be lower than the 15s
+# receiver timeout of the instruments
+ACK_DELAY = 10
+
+
+class PipelineQueue(asyncio.Queue):
+    """Queue that calls `on_get` whenever a message was taken out
+    """
+
+    def __init__(self, maxsize=0, on_get=None):
+        super(PipelineQueue, self).__init__(maxsize)
+        self.on_get = on_get
+
+    def _get(self):
+        item = super(PipelineQueue, self)._get()
+        if self.on_get is not None:
+            self.on_get()
+        return item
+
+
+class Pipeline(object):
+    """Bounded pipeline from the protocols to the message consumer
+
+    Holds the queue of converted messages and counts the conversion and
+    dispatch tasks in flight. The protocols check `is_saturated` before they
+    acknowledge a frame and delay the ACK until there is capacity again, so
+    that the instruments are throttled instead of buffering the messages in
+    memory.
+
+    The waiting protocols are woken up when the consumer took a message out
+    of the queue or a task in flight is done.
+    """
+
+    def __init__(self, queue=None, queue_size=0, max_tasks=0):
+        if queue is None:
+            queue = PipelineQueue(maxsize=queue_size, on_get=self.notify)
+        self.queue = queue
+        self.max_tasks = max_tasks
+        self.tasks = 0
+        self.delayed = 0
+        self.delays = 0
+        self.capacity = asyncio.Event()
+
+    def notify(self):
+        """Wake up the protocols waiting for capacity
+        """
+        self.capacity.set()
+
+    def is_saturated(self):
+        """Checks if the pipeline can not take more messages
+        """
+        if self.queue.full():
+            return True
+        return bool(self.max_tasks) and self.tasks >= self.max_tasks
+
+    def track(self, future):
+        """Count the future as task in flight until it is done
+        """
+        self.tasks += 1
+        future.add_done_callback(self.on_task_done)
+        return future
+
+    def on_task_done(self, future):
+        self.tasks -= 1
+        self.notify()
+
+    def put(self, message):
+        """Put the message into the queue
+
+        A full queue is not an error, because an instrument might end its
+        transfer while the pipeline is saturated. The message then waits in a
+        task for a free slot. The protocols reject new transfers while the
+        pipeline is saturated, so that these tasks do not pile up.
+        """
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.track(asyncio.ensure_future(self.queue.put(message)))
+
+    async def wait(self, timeout):
+        """Wait until the pipeline has capacity or the timeout expired
+
+        :returns: True if the pipeline has capacity, otherwise False
+        """
+        self.delayed += 1
+        self.delays += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while self.is_saturated():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                self.capacity.clear()
+                try:
+                    await asyncio.wait_for(self.capacity.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return not self.is_saturated()
+            return True
+        finally:
+            self.delayed -= 1
+
+    @property
+    def gauges(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "tasks": self.tasks,
+            "delayed_acks": self.delayed,
+            "total_delayed_acks": self.delays,
+        }
+
+    def __str__(self):
+        return ", ".join("{}={}".format(*item) for item in self.gauges.items())
+
+
+async def report(pipeline, interval=60):
+    """Log the gauges of the pipeline periodically
+    """
+    while True:
+        await asyncio.sleep(interval)
+        logger.debug("Pipeline: {}".format(pipeline))
@@ -2,27 +2,90 @@
 
 import asyncio
 import os
+from collections import deque
 
 from senaite.astm import adapter_registry
+from senaite.astm import codec
 from senaite.astm import logger
 from senaite.astm.constants import ACK
+from senaite.astm.constants import CRLF
+from senaite.astm.constants import ENCODING
 from senaite.astm.constants import ENQ
 from senaite.astm.constants import EOT
+from senaite.astm.constants import MAX_FRAME_SIZE
 from senaite.astm.constants import NAK
 from senaite.astm.constants import STX
 from senaite.astm.exceptions import InvalidState
 from senaite.astm.exceptions import NotAccepted
 from senaite.astm.interfaces import IDataHandler
+from senaite.astm.pipeline import ACK_DELAY
+from senaite.astm.pipeline import Pipeline
+from senaite.astm.spool import RAW
+from senaite.astm.spool import pack_frames
+from senaite.astm.utils import FrameBuffer
 from senaite.astm.utils import is_chunked_message
+from senaite.astm.utils import is_header
 from senaite.astm.utils import join
+from senaite.astm.utils import split_messages
 from senaite.astm.utils import validate_checksum
 from senaite.astm.utils import write_message
+from senaite.astm.wrapper import IncrementalWrapper
 from senaite.astm.wrapper import Wrapper
 
 TIMEOUT = 15
 QUEUE = asyncio.Queue()
 DEFAULT_FORMAT = "json"
 
+# Number of NAKs for the same frame until the transfer is aborted (E1381)
+MAX_RETRIES = 6
+# Seconds to wait before the next ENQ after a NAK or a lost contention
+ENQ_DELAY = 10
+
+# States of the sending role
+IDLE = "idle"
+ESTABLISHING = "establishing"
+TRANSFER = "transfer"
+
+
+class Transfer(object):
+    """Pre-encoded frames of one outgoing transfer
+    """
+    __slots__ = ("frames", "future", "index", "retries")
+
+    def __init__(self, frames, future):
+        self.frames = frames
+        self.future = future
+        # index of the frame waiting for the ACK
+        self.index = 0
+        # NAKs of the current frame
+        self.retries = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def convert_messages(messages, message_format=DEFAULT_FORMAT):
+    """Wrap the collected messages and serialize them to the given format
+
+    NOTE: This function is executed in worker threads or processes and must
+          therefore not access any protocol state.
+
+    :param messages: List of raw ASTM frames of one transfer
+    :param message_format: One of "astm", "json" or "lis2a"
+    :returns: Serialized message
+    """
+    return serialize(Wrapper(messages), message_format)
+
+
+def serialize(wrapper, message_format=DEFAULT_FORMAT):
+    """Serialize the wrapped message to the given format
+    """
+    if message_format == "astm":
+        return wrapper.to_astm()
+    elif message_format == "json":
+        return wrapper.to_json()
+    return wrapper.to_lis2a()
+
 
 class ASTMProtocol(asyncio.Protocol):
     """ASTM Protocol
@@ -35,16 +98,45 @@ class ASTMProtocol(asyncio.Protocol):
         logger.debug("ASTMProtocol:constructor")
         self.loop = asyncio.get_event_loop()
         self.queue = kwargs.get("queue", QUEUE)
+        # bounded pipeline to the message consumer
+        self.pipeline = kwargs.get("pipeline") or Pipeline(queue=self.queue)
+        self.queue = self.pipeline.queue
+        # maximum seconds to delay an ACK while the pipeline is saturated
+        self.ack_delay = kwargs.get("ack_delay", ACK_DELAY)
         self.timeout = kwargs.get("timeout", TIMEOUT)
         self.message_format = kwargs.get("message_format", DEFAULT_FORMAT)
+        # optional executor to convert the messages outside of the event loop
+        self.executor = kwargs.get("executor", None)
+        # decode the messages while they are received
+        self.incremental = kwargs.get("incremental", False)
+        # optional responder to answer the host queries of the instrument
+        self.responder = kwargs.get("responder", None)
+        # optional TCP options of the connection
+        self.socket_options = kwargs.get("socket_options", None)
+        # optional spool to persist the received messages at EOT
+        self.spool = kwargs.get("spool", None)
 
         self.transport = None
+        self.socket = None
         self.client = None
         self.timer = None
+        self.deadline = None
+        self.buffer = FrameBuffer()
         self.chunks = []
         self.messages = []
+        self.wrapper = None
+        self.wrappers = []
+        self.backpressure = None
         self.in_transfer_state = False
 
+        # sending role
+        self.max_retries = kwargs.get("max_retries", MAX_RETRIES)
+        self.enq_delay = kwargs.get("enq_delay", ENQ_DELAY)
+        self.outbox = deque()
+        self.transfer = None
+        self.send_state = IDLE
+        self.enq_timer = None
+
     def connection_made(self, transport):
         """Called when a connection is made.
         """
@@ -52,26 +144,47 @@ class ASTMProtocol(asyncio.Protocol):
         # Remember the connected client
         self.client = self.get_client_key(transport)
         logger.debug("Connection from {!s}".format(self.client))
+        if self.socket_options is not None:
+            self.socket = transport.get_extra_info("socket")
+            self.socket_options.apply(self.socket)
 
     def start_timer(self):
         """Start the timeout timer
         """
-        # Closes the connection if no data was received after the given timeout
-        self.timer = self.loop.call_later(self.timeout, self.on_timeout)
+        # Closes the connection if no data was received after the given
+        # timeout. The timer is not rescheduled on every received chunk, only
+        # the deadline is moved and checked when the timer fires.
+        self.deadline = self.loop.time() + self.timeout
+        if self.timer is None:
+            self.timer = self.loop.call_at(self.deadline, self.on_deadline)
 
     def cancel_timer(self):
         """Cancel the timeout timer
         """
+        self.deadline = None
         if self.timer is None:
             return
         self.timer.cancel()
+        self.timer = None
 
     def restart_timer(self):
         """Restart the timeout timer
         """
-        self.cancel_timer()
         self.start_timer()
 
+    def on_deadline(self):
+        """Callback when the timer fired
+        """
+        self.timer = None
+        if self.deadline is None:
+            return
+        if self.loop.time() < self.deadline:
+            # data was received in the meantime, wait for the new deadline
+            self.timer = self.loop.call_at(self.deadline, self.on_deadline)
+            return
+        self.deadline = None
+        self.on_timeout()
+
     def get_client_key(self, transport):
         """Return the client key for the given transport
         """
@@ -81,7 +194,13 @@ class ASTMProtocol(asyncio.Protocol):
     def close_connection(self):
         """Cleanup and close connection
         """
+        self.cancel_timer()
         self.discard_env()
+        self.buffer.clear()
+        if self.backpressure is not None:
+            self.backpressure.cancel()
+            self.backpressure = None
+        self.discard_outbox(ConnectionError("Connection closed"))
         self.transport.close()
 
     def discard_chunked_messages(self):
@@ -94,6 +213,8 @@ class ASTMProtocol(asyncio.Protocol):
         """
         self.chunks = []
         self.messages = []
+        self.wrapper = None
+        self.wrappers = []
         self.in_transfer_state = False
 
     def data_received(self, data):
@@ -106,21 +227,97 @@ class ASTMProtocol(asyncio.Protocol):
         # -> this ensures the next data is received within the timeout
         self.restart_timer()
 
-        # handle the data
-        response = self.handle_data(data)
-        if response is not None:
-            logger.debug("<- Sending response: {!r}".format(response))
-            self.transport.write(response)
+        if self.socket_options is not None:
+            self.socket_options.rearm(self.socket)
 
-    def handle_data(self, data):
-        """Process incoming data
-        """
         # lookup custom multi-adapter to handle the data
+        adapter = self.get_data_handler(data)
+        if adapter is not None:
+            self.send_response(adapter.handle_data())
+            return
+
+        tokens = self.buffer.feed(data)
+
+        # the data is processed when the delayed ACK was sent
+        if self.backpressure is not None:
+            return
+
+        self.process(tokens)
+
+    def process(self, tokens):
+        """Handle each complete frame or control character of the stream
+        """
+        for item in tokens:
+            response = self.handle_data(item)
+            if response == ACK and self.pipeline.is_saturated():
+                self.delay_ack(response, item)
+                return
+            self.send_response(response)
+
+    def delay_ack(self, response, data=None):
+        """Throttle the instrument by delaying the ACK
+
+        The instrument does not send the next frame before it received the
+        ACK, therefore the reading is paused until the pipeline has capacity
+        again.
+        """
+        logger.warning("Pipeline saturated, delaying ACK to {!s}"
+                       .format(self.client))
+        self.cancel_timer()
+        self.transport.pause_reading()
+        self.backpressure = self.loop.create_task(
+            self.send_delayed_ack(response, data))
+
+    async def send_delayed_ack(self, response, data=None):
+        """Send the ACK when the pipeline has capacity again
+
+        A new transfer is rejected if the pipeline is still saturated, so
+        that the instrument retries it later. The frames of a running
+        transfer are acknowledged, because the instrument would only repeat
+        them.
+        """
+        reject = False
+        if not await self.pipeline.wait(self.ack_delay):
+            reject = data == ENQ
+            logger.warning("Pipeline still saturated after {}s, sending {} "
+                           "to {!s}".format(self.ack_delay,
+                                            reject and "NAK" or "ACK",
+                                            self.client))
+        self.backpressure = None
+        if self.transport.is_closing():
+            return
+        self.transport.resume_reading()
+        if reject:
+            self.discard_env()
+            self.send_response(NAK)
+            if self.outbox:
+                self.schedule_enq(0)
+        else:
+            self.send_response(response)
+            self.restart_timer()
+        # continue with the data received in the meantime
+        self.process(self.buffer.tokens())
+
+    def send_response(self, response):
+        """Write the response back to the instrument
+        """
+        if response is None:
+            return
+        logger.debug("<- Sending response: {!r}".format(response))
+        self.transport.write(response)
+
+    def get_data_handler(self, data):
+        """Returns the custom data handler adapter for the received data
+        """
         adapters = adapter_registry.getAdapters((self, data), IDataHandler)
         for name, adapter in adapters:
             if adapter and adapter.can_handle():
-                return adapter.handle_data()
+                return adapter
+        return None
 
+    def handle_data(self, data):
+        """Process a single frame or control character
+        """
         response = None
         if data.startswith(ENQ):
             response = self.on_enq(data)
@@ -146,6 +343,15 @@ class ASTMProtocol(asyncio.Protocol):
         """Callback when <ENQ> was received
         """
         logger.debug("on_enq: %r", data)
+        if self.send_state == ESTABLISHING:
+            # contention: the instrument has priority, the transfer is sent
+            # after its EOT
+            logger.info("Line contention with {!s}, receiving first"
+                        .format(self.client))
+            self.requeue_transfer()
+        elif self.send_state == TRANSFER:
+            logger.error("ENQ is not expected")
+            return NAK
         if not self.in_transfer_state:
             self.in_transfer_state = True
             return ACK
@@ -156,17 +362,41 @@ class ASTMProtocol(asyncio.Protocol):
     def on_ack(self, data):
         """Calls on <ACK> message receiving."""
         logger.debug("on_ack: %r", data)
+        if self.send_state == ESTABLISHING:
+            # the instrument is ready to receive
+            self.send_state = TRANSFER
+            return self.transfer.frames[0]
+        if self.send_state == TRANSFER:
+            return self.next_frame()
         raise NotAccepted("Server should not be ACKed.")
 
     def on_nak(self, data):
         """Calls on <NAK> message receiving."""
         logger.debug("on_nak: %r", data)
+        if self.send_state == ESTABLISHING:
+            # the instrument is busy, try again later
+            self.requeue_transfer()
+            self.schedule_enq(self.enq_delay)
+            return None
+        if self.send_state == TRANSFER:
+            transfer = self.transfer
+            transfer.retries += 1
+            if transfer.retries >= self.max_retries:
+                return self.abort_transfer(NotAccepted(
+                    "Frame %d was not accepted after %d attempts"
+                    % (transfer.index + 1, transfer.retries)))
+            # retransmit the frame with the same frame number
+            return transfer.frames[transfer.index]
         raise NotAccepted("Server should not be NAKed.")
 
     def on_eot(self, data):
         """Calls on <EOT> message receiving."""
         logger.debug("on_eot: %r", data)
 
+        if self.send_state == TRANSFER:
+            # receiver interrupt request, which is handled like an ACK
+            return self.next_frame()
+
         if not self.in_transfer_state:
             self.close_connection()
             raise InvalidState("Server is not ready to accept EOT message.")
@@ -174,27 +404,112 @@ class ASTMProtocol(asyncio.Protocol):
         # stop any running timer
         self.cancel_timer()
 
+        # the line is free again for queued transfers
+        if self.outbox:
+            self.schedule_enq(0)
+
         # XXX: Seen from Yumizen H550: EOT right after ENQ.
         #      Maybe this is some kind of keepalive?
         if not self.messages:
             self.discard_env()
             return
 
-        # Wrap the message
-        wrapper = Wrapper(self.messages)
+        messages = self.messages
+        wrappers = self.wrappers
+        if self.wrapper is not None:
+            wrappers.append(self.wrapper)
 
-        if self.message_format == "astm":
-            self.queue.put_nowait(wrapper.to_astm())
-        elif self.message_format == "json":
-            self.queue.put_nowait(wrapper.to_json())
-        else:
-            self.queue.put_nowait(wrapper.to_lis2a())
+        # Drop session
+        self.discard_env()
 
         # Store the raw message for debugging and development purposes
-        self.log_message(wrapper.to_astm())
+        self.log_message(b"\n".join(messages))
 
-        # Drop session
-        self.discard_env()
+        # Answer the host queries before the message is processed further
+        if self.responder is not None:
+            self.answer_queries(messages)
+
+        # Every message H...L of the session is converted on its own, so
+        # that the messages of a batch upload are processed concurrently
+        if wrappers:
+            groups = [wrapper.messages for wrapper in wrappers]
+        else:
+            groups = split_messages(messages)
+        if len(groups) > 1:
+            logger.info("Received {} messages from {!s}"
+                        .format(len(groups), self.client))
+
+        # Persist the acknowledged messages before they are converted
+        if self.spool is not None:
+            self.pipeline.track(asyncio.ensure_future(
+                self.spool_messages(groups, wrappers)))
+            return
+
+        # The incrementally decoded messages are only serialized
+        if wrappers:
+            jobs = [(serialize, wrapper) for wrapper in wrappers]
+        else:
+            jobs = [(convert_messages, group) for group in groups]
+
+        if self.executor is None:
+            for func, data in jobs:
+                try:
+                    message = func(data, self.message_format)
+                except Exception as exc:
+                    logger.error("Could not convert message of {!s}: {!r}"
+                                 .format(self.client, exc))
+                    continue
+                self.pipeline.put(message)
+            return
+
+        # Convert the message in the executor to not block other connections
+        for func, data in jobs:
+            future = self.loop.run_in_executor(
+                self.executor, func, data, self.message_format)
+            future.add_done_callback(self.on_messages_converted)
+            self.pipeline.track(future)
+
+    async def spool_messages(self, groups, wrappers=None):
+        """Persist the raw messages, then convert them
+        """
+        packed = [pack_frames(group) for group in groups]
+        ids = await asyncio.to_thread(self.spool.put_many, packed, RAW)
+        wrappers = wrappers or [None] * len(groups)
+        await asyncio.gather(*map(self.convert_spooled, ids, groups, wrappers))
+
+    async def convert_spooled(self, entry_id, group, wrapper=None):
+        """Convert a spooled message and pass it to the pipeline
+
+        A message that can not be converted is parked in the spool.
+        """
+        func, data = convert_messages, group
+        if wrapper is not None:
+            func, data = serialize, wrapper
+        try:
+            if self.executor is None:
+                message = func(data, self.message_format)
+            else:
+                message = await self.loop.run_in_executor(
+                    self.executor, func, data, self.message_format)
+        except Exception as exc:
+            logger.error("Could not convert message of {!s}: {!r}"
+                         .format(self.client, exc))
+            await asyncio.to_thread(self.spool.park, entry_id)
+            return
+        await asyncio.to_thread(self.spool.convert, entry_id, message)
+        self.pipeline.put(message)
+
+    def on_messages_converted(self, future):
+        """Callback when the executor finished to convert the messages
+        """
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            logger.error("Could not convert message of {!s}: {!r}"
+                         .format(self.client, exc))
+            return
+        self.pipeline.put(future.result())
 
     def log_message(self, message, directory="astm_messages"):
         """Store the raw ASTM message if the folder exists in the CWD
@@ -206,7 +521,14 @@ class ASTMProtocol(asyncio.Protocol):
 
     def on_timeout(self):
         """Callback for timeout event
+
+        A transfer that the instrument does not answer is terminated with
+        EOT and the connection is kept for the next transfer.
         """
+        if self.send_state in (ESTABLISHING, TRANSFER):
+            self.send_response(self.abort_transfer(TimeoutError(
+                "No reply within {!r}s".format(self.timeout))))
+            return
         logger.warning("Connection for {!r} timed out after {!r}s: Closing..."
                        .format(self.client, self.timeout))
         self.close_connection()
@@ -243,7 +565,9 @@ class ASTMProtocol(asyncio.Protocol):
             full_message = join(self.chunks)
             self.discard_chunked_messages()
         else:
-            full_message = message
+            # the frame buffer strips the line ending, restore the frame
+            # terminator like `join` does for chunked messages
+            full_message = message + CRLF
 
         # message not yet complete
         if not full_message:
@@ -254,6 +578,164 @@ class ASTMProtocol(asyncio.Protocol):
 
         self.messages.append(full_message)
 
+        if self.incremental:
+            if (self.wrapper is not None and is_header(full_message)
+                    and is_header(self.wrapper.messages[0])):
+                # the next message of the session starts
+                self.wrappers.append(self.wrapper)
+                self.wrapper = None
+            if self.wrapper is None:
+                self.wrapper = IncrementalWrapper()
+            self.wrapper.feed(full_message)
+
+    def answer_queries(self, messages):
+        """Send the orders of the queried samples to the instrument
+
+        :param messages: List of raw ASTM frames of one transfer
+        :returns: Future of the transfer or None if there was no query
+        """
+        queries = []
+        delimiters = codec.get_delimiters(messages[0])
+        for message in messages:
+            if not self.responder.is_query(message):
+                continue
+            try:
+                records = codec.decode(message, delimiters=delimiters)
+            except Exception as exc:
+                logger.error("Could not decode query of {!s}: {!r}"
+                             .format(self.client, exc))
+                continue
+            queries.extend(record for record in records if record[0] == "Q")
+        if not queries:
+            return None
+        logger.info("Answering {} query record(s) of {!s}"
+                    .format(len(queries), self.client))
+        future = self.send_records(self.responder.respond(queries))
+        future.add_done_callback(self.on_queries_answered)
+        return future
+
+    def on_queries_answered(self, future):
+        """Callback when the answer to the host queries was sent
+        """
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            logger.error("Could not answer the queries of {!s}: {!r}"
+                         .format(self.client, exc))
+
+    def send_records(self, records, encoding=ENCODING, size=MAX_FRAME_SIZE):
+        """Send the records to the instrument
+
+        The records are encoded to numbered frames of at most `size` bytes
+        up front, so that every ACK of the instrument is answered with the
+        next frame without further work.
+
+        :param records: List of ASTM records of one message, i.e. H...L
+        :returns: Future that is resolved with the number of sent frames
+        """
+        frames = list(codec.iter_encode(records, encoding, size))
+        return self.send_frames(frames)
+
+    def send_frames(self, frames):
+        """Queue the pre-encoded frames as one transfer to the instrument
+
+        :param frames: List of complete frames (STX...CRLF)
+        :returns: Future that is resolved with the number of sent frames
+        """
+        future = self.loop.create_future()
+        if not frames:
+            future.set_result(0)
+            return future
+        self.outbox.append(Transfer(list(frames), future))
+        if self.send_state == IDLE and self.enq_timer is None:
+            self.start_transfer()
+        return future
+
+    def start_transfer(self):
+        """Establish the next queued transfer with an ENQ
+        """
+        self.enq_timer = None
+        if self.send_state != IDLE or self.in_transfer_state:
+            # the transfer is started after the EOT of the instrument
+            return
+        while self.outbox and self.outbox[0].future.done():
+            # cancelled by the caller
+            self.outbox.popleft()
+        if not self.outbox:
+            return
+        if self.transport is None or self.transport.is_closing():
+            self.discard_outbox(ConnectionError("Connection closed"))
+            return
+        self.transfer = self.outbox.popleft()
+        self.send_state = ESTABLISHING
+        self.restart_timer()
+        self.send_response(ENQ)
+
+    def requeue_transfer(self):
+        """Put the transfer that was not established back into the queue
+        """
+        self.outbox.appendleft(self.transfer)
+        self.transfer = None
+        self.send_state = IDLE
+
+    def schedule_enq(self, delay):
+        """Start the next queued transfer after the delay
+        """
+        if self.enq_timer is not None:
+            self.enq_timer.cancel()
+        self.enq_timer = self.loop.call_later(delay, self.start_transfer)
+
+    def next_frame(self):
+        """Returns the next frame of the transfer or EOT at its end
+        """
+        transfer = self.transfer
+        transfer.index += 1
+        transfer.retries = 0
+        if transfer.index < len(transfer):
+            return transfer.frames[transfer.index]
+        # transfer complete
+        self.cancel_timer()
+        self.transfer = None
+        self.send_state = IDLE
+        if not transfer.future.done():
+            transfer.future.set_result(len(transfer))
+        if self.outbox:
+            self.schedule_enq(0)
+        return EOT
+
+    def abort_transfer(self, exc):
+        """Abort the current transfer and release the line
+
+        :returns: EOT
+        """
+        transfer = self.transfer
+        self.cancel_timer()
+        self.transfer = None
+        self.send_state = IDLE
+        logger.error("Transfer to {!s} aborted: {!r}".format(self.client, exc))
+        if not transfer.future.done():
+            transfer.future.set_exception(exc)
+        if self.outbox:
+            self.schedule_enq(self.enq_delay)
+        return EOT
+
+    def discard_outbox(self, exc):
+        """Fail all pending transfers
+        """
+        if self.enq_timer is not None:
+            self.enq_timer.cancel()
+            self.enq_timer = None
+        transfers = list(self.outbox)
+        if self.transfer is not None:
+            transfers.insert(0, self.transfer)
+        self.outbox.clear()
+        self.transfer = None
+        self.send_state = IDLE
+        for transfer in transfers:
+            if not transfer.future.done():
+                transfer.future.set_exception(exc)
+
     def connection_lost(self, ex):
         """Called when the connection is lost or closed.
         """
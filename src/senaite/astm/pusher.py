@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from senaite.astm import logger
+from senaite.astm.spool import deliver_batch
+from senaite.astm.spool import iter_batches
+
+# Number of concurrent pushes to SENAITE
+CONCURRENCY = 1
+
+# Upper limit in seconds of the backoff between failed pushes
+MAX_DELAY = 300
+
+# Number of consecutive failed pushes that open the circuit
+FAILURE_THRESHOLD = 3
+
+
+def get_backoff(attempt, delay, max_delay=MAX_DELAY, rand=random.random):
+    """Exponential backoff with full jitter
+
+    :param attempt: number of consecutive failed attempts, starting at 1
+    :param delay: backoff of the first attempt in seconds
+    :param max_delay: upper limit of the backoff in seconds
+    """
+    backoff = min(max_delay, delay * 2 ** max(attempt - 1, 0))
+    return backoff * rand()
+
+
+class CircuitBreaker(object):
+    """Pauses all pushes while SENAITE is not reachable
+
+    The circuit opens after `threshold` consecutive failures and rejects all
+    pushes for `timeout` seconds. Afterwards a single probe is let through,
+    which closes the circuit on success and opens it again on failure.
+    """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, timeout=MAX_DELAY,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.timeout = timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def remaining(self):
+        """Seconds until the open circuit lets a probe through
+        """
+        if not self.is_open:
+            return 0
+        return max(0, self.opened_at + self.timeout - self.clock())
+
+    def allow(self):
+        """Checks if a push is allowed
+        """
+        if not self.is_open:
+            return True
+        if self.probing or self.remaining() > 0:
+            return False
+        self.probing = True
+        return True
+
+    def success(self):
+        if self.is_open:
+            logger.info("SENAITE is reachable again, closing the circuit")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.is_open or self.failures >= self.threshold:
+            if not self.is_open:
+                logger.error("Pausing pushes to SENAITE for {}s after {} "
+                             "failures".format(self.timeout, self.failures))
+            self.opened_at = self.clock()
+
+
+class Pusher(object):
+    """Pushes the spooled messages to SENAITE
+
+    The blocking pushes run in a dedicated executor of `concurrency`
+    threads, so that waiting for SENAITE never occupies the default executor
+    of the loop. Failed pushes are retried with an exponential backoff and
+    jitter, and the circuit breaker pauses all pushes while SENAITE is down.
+
+    Batches are delivered in order of arrival, unless `concurrency` is
+    greater than 1, where concurrently pushed batches may overtake each other.
+    """
+
+    def __init__(self, spool, push, **kw):
+        self.spool = spool
+        self.push = push
+        self.concurrency = max(1, kw.get("concurrency", CONCURRENCY))
+        self.delay = kw.get("delay", 5)
+        self.max_delay = kw.get("max_delay", MAX_DELAY)
+        self.batch_size = kw.get("batch_size", 1)
+        self.batch_bytes = kw.get("batch_bytes", 0)
+        self.batch_window = kw.get("batch_window", 0)
+        self.metrics = kw.get("metrics", None)
+        self.poll_interval = kw.get("poll_interval", None)
+        self.breaker = kw.get("breaker") or CircuitBreaker(
+            timeout=self.max_delay)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix="senaite-push")
+        self.event = asyncio.Event()
+        self.attempt = 0
+
+    def notify(self):
+        """Wake up the pusher for newly spooled messages
+        """
+        self.event.set()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def run(self):
+        """Pusher coroutine function
+        """
+        while True:
+            if self.breaker.is_open:
+                await asyncio.sleep(self.breaker.remaining())
+            self.event.clear()
+            if self.batch_window > 0 and self.batch_size > 1:
+                await self.wait_for_batch()
+                self.event.clear()
+            try:
+                delivered = await self.deliver()
+            except Exception as exc:
+                # never end the pusher, the messages are safe in the spool
+                logger.error("Could not deliver the spooled messages: {!r}"
+                             .format(exc))
+                delivered = -1
+            if delivered is None:
+                # rejected by the open circuit, wait for the next probe
+                continue
+            if delivered < 0:
+                self.attempt += 1
+                await asyncio.sleep(get_backoff(
+                    self.attempt, self.delay, self.max_delay))
+            elif delivered == 0:
+                await self.wait()
+            else:
+                self.attempt = 0
+
+    async def wait(self):
+        """Wait for newly spooled messages
+
+        Messages spooled by other processes can not notify the pusher, so
+        the spool is checked again every `poll_interval` seconds if set.
+        """
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.event.wait(), self.poll_interval)
+
+    async def wait_for_batch(self):
+        """Wait until a batch is filled or the batch window expired
+
+        The pending entries are counted in the executor, like they are
+        fetched, to keep the database off the event loop.
+        """
+        deadline = time.monotonic() + self.batch_window
+        while await self.run_in_executor(self.spool.count) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.event.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.event.wait(), remaining)
+
+    async def deliver(self):
+        """Push one round of pending batches concurrently
+
+        :returns: the number of delivered entries, -1 if a push failed or
+                  None if the open circuit rejected a batch
+        """
+        limit = self.batch_size * self.concurrency
+        entries = await self.run_in_executor(self.spool.pending, limit)
+        batches = iter_batches(entries, self.batch_size, self.batch_bytes)
+        results = await asyncio.gather(*map(self.deliver_batch, batches))
+        if False in results:
+            return -1
+        if None in results:
+            return None
+        return len(entries)
+
+    async def deliver_batch(self, batch):
+        """Push a single batch and acknowledge it on success
+
+        :returns: True if the batch was delivered, False if the push failed
+                  or None if the batch was not pushed because the circuit
+                  is open
+        """
+        if not self.breaker.allow():
+            return None
+        try:
+            ok = await self.run_in_executor(
+                deliver_batch, self.spool, batch, self.push, self.metrics)
+        except Exception as exc:
+            logger.error("Could not push spooled message(s) {}: {!r}"
+                         .format([entry[0] for entry in batch], exc))
+            ok = False
+        if ok:
+            self.breaker.success()
+        else:
+            self.breaker.failure()
+        return ok
@@ -78,6 +78,7 @@ HeaderRecord = Record.build(
     ConstantField(name="processing_id", default="P"),
     NotUsedField(name="version"),
     DateTimeField(name="timestamp", default=datetime.now, required=True),
+    compiled=True,
 )
 
 
@@ -173,6 +174,7 @@ PatientRecord = Record.build(
     NotUsedField(name="hospital_service"),
     NotUsedField(name="hospital_institution"),
     NotUsedField(name="dosage_category"),
+    compiled=True,
 )
 
 
@@ -263,7 +265,8 @@ OrderRecord = Record.build(
     NotUsedField(name="location_ward"),
     NotUsedField(name="infection_flag"),
     NotUsedField(name="specimen_service"),
-    NotUsedField(name="laboratory")
+    NotUsedField(name="laboratory"),
+    compiled=True,
 )
 
 #: +-----+--------------+--------------------------------+--------------------+
@@ -314,6 +317,7 @@ ResultRecord = Record.build(
     NotUsedField(name="started_at"),
     NotUsedField(name="completed_at"),
     NotUsedField(name="instrument"),
+    compiled=True,
 )
 
 #: +-----+--------------+---------------------------------+-------------------+
@@ -335,7 +339,8 @@ CommentRecord = Record.build(
     IntegerField(name="seq", default=1, required=True),
     NotUsedField(name="source"),
     NotUsedField(name="data"),
-    NotUsedField(name="ctype")
+    NotUsedField(name="ctype"),
+    compiled=True,
 )
 
 #: +-----+--------------+---------------------------------+-------------------+
@@ -360,6 +365,7 @@ RequestInformationRecord = Record.build(
     NotUsedField(name="user_field_1"),
     NotUsedField(name="user_field_2"),
     NotUsedField(name="status_code"),
+    compiled=True,
 )
 
 #: +-----+--------------+---------------------------------+-------------------+
@@ -375,7 +381,8 @@ RequestInformationRecord = Record.build(
 TerminatorRecord = Record.build(
     ConstantField(name="type", default="L"),
     ConstantField(name="seq", default=1, field=IntegerField()),
-    ConstantField(name="code", default="N")
+    ConstantField(name="code", default="N"),
+    compiled=True,
 )
 
 
@@ -401,4 +408,5 @@ ManufacturerInfoRecord = Record.build(
     NotUsedField(name="user_field_1"),
     NotUsedField(name="user_field_2"),
     NotUsedField(name="code"),
+    compiled=True,
 )
@@ -3,18 +3,58 @@
 import argparse
 import asyncio
 import contextlib
+import functools
 import logging
 import os
+import signal
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 
 from senaite.astm import lims
 from senaite.astm import logger
-from senaite.astm.lims import post_to_senaite
+from senaite.astm import pusher
+from senaite.astm.instruments import horiba_yumizen_h5xx
+from senaite.astm.lims import fetch_orders
+from senaite.astm.lims import push_to_senaite
+from senaite.astm.loops import DEFAULT_LOOP
+from senaite.astm.loops import LOOPS
+from senaite.astm.loops import install_event_loop_policy
+from senaite.astm.orders import ORDER_CACHE_FILE
+from senaite.astm.orders import REFRESH_INTERVAL
+from senaite.astm.orders import OrderCache
+from senaite.astm.orders import QueryResponder
+from senaite.astm.orders import refresh_orders
+from senaite.astm.orders import reload_orders
+from senaite.astm.pipeline import ACK_DELAY
+from senaite.astm.pipeline import MAX_TASKS
+from senaite.astm.pipeline import QUEUE_SIZE
+from senaite.astm.pipeline import Pipeline
+from senaite.astm.pipeline import report
 from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.protocol import convert_messages
+from senaite.astm.pusher import CircuitBreaker
+from senaite.astm.pusher import Pusher
+from senaite.astm.sockets import SocketOptions
+from senaite.astm.spool import SPOOL_FILE
+from senaite.astm.spool import Metrics
+from senaite.astm.spool import Spool
+from senaite.astm.spool import unpack_frames
+from senaite.astm.supervisor import Supervisor
+from senaite.astm.supervisor import supports_reuse_port
 from senaite.astm.utils import write_message
+from senaite.astm.wrapper import registry
 
 LOGFILE = "senaite-astm-server.log"
 
+# Seconds between checks for messages spooled by the worker processes
+SPOOL_POLL_INTERVAL = 1
+
+POOL_EXECUTORS = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor,
+}
+
 
 async def consume(queue, callback=None):
     """ASTM Message consumer coroutine function
@@ -54,6 +94,115 @@ def main():
         type=str,
         help='Output directory to write full messages')
 
+    astm_group.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of server processes sharing the listen port. '
+             'Requires SO_REUSEPORT support (Linux)')
+
+    astm_group.add_argument(
+        '--loop',
+        type=str,
+        default=DEFAULT_LOOP,
+        choices=LOOPS,
+        help='Event loop implementation. Falls back to asyncio if uvloop '
+             'is not installed')
+
+    astm_group.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Decode the messages frame by frame while they are received. '
+             'Only the serialization is left when the transfer ended, '
+             'therefore argument --pool-size has no effect')
+
+    astm_group.add_argument(
+        '--trusted',
+        nargs='+',
+        default=[],
+        metavar='INSTRUMENT',
+        help='Module names of the instruments whose messages are known to '
+             'be valid, e.g. genexpert. Their records are wrapped without '
+             'validating the values of set fields and without warnings for '
+             'not used fields')
+
+    astm_group.add_argument(
+        '--decode-histograms',
+        action='store_true',
+        help='Decode the binary histograms of Horiba Yumizen H5xx '
+             'instruments into arrays of floats')
+
+    astm_group.add_argument(
+        '--queue-size',
+        type=int,
+        default=QUEUE_SIZE,
+        help='Maximum number of received messages waiting to be '
+             'dispatched. Unlimited if set to 0')
+
+    astm_group.add_argument(
+        '--max-tasks',
+        type=int,
+        default=MAX_TASKS,
+        help='Maximum number of message conversions and output writes in '
+             'progress. Unlimited if set to 0')
+
+    astm_group.add_argument(
+        '--ack-delay',
+        type=float,
+        default=ACK_DELAY,
+        help='Maximum time in seconds to delay the acknowledgement of a '
+             'frame while the queue or the tasks are at their limit')
+
+    astm_group.add_argument(
+        '--pool-size',
+        type=int,
+        default=0,
+        help='Number of workers to convert the received messages. '
+             'Messages are converted in the event loop if set to 0')
+
+    astm_group.add_argument(
+        '--pool-type',
+        type=str,
+        default='process',
+        choices=list(POOL_EXECUTORS),
+        help='Type of the worker pool to convert the received messages. '
+             'Only has effect when argument --pool-size is set')
+
+    astm_group.add_argument(
+        '--no-tcp-nodelay',
+        dest='tcp_nodelay',
+        action='store_false',
+        help='Do not disable the Nagle algorithm on the instrument '
+             'connections, i.e. small responses like ACK might be delayed')
+
+    astm_group.add_argument(
+        '--tcp-quickack',
+        action='store_true',
+        help='Acknowledge the received TCP segments immediately instead of '
+             'delaying the acknowledgement (Linux only)')
+
+    astm_group.add_argument(
+        '--rcvbuf',
+        type=int,
+        default=0,
+        help='Receive buffer size in bytes of the instrument connections. '
+             'System default if set to 0')
+
+    astm_group.add_argument(
+        '--sndbuf',
+        type=int,
+        default=0,
+        help='Send buffer size in bytes of the instrument connections. '
+             'System default if set to 0')
+
+    astm_group.add_argument(
+        '--keepalive',
+        type=int,
+        default=0,
+        help='Time in seconds a connection is idle until TCP keepalive '
+             'probes are sent to detect dead instruments. Disabled if set '
+             'to 0')
+
     lims_group.add_argument(
         '-u',
         '--url',
@@ -76,12 +225,57 @@ def main():
         help='Message format to send to SENAITE. '
              'Allowed formats: "astm", "lis2a", "json".')
 
+    lims_group.add_argument(
+        '--http-pool-size',
+        type=int,
+        default=lims.POOL_SIZE,
+        help='Number of pooled HTTP connections to SENAITE. '
+             'Only has effect when argument --url is set')
+
+    lims_group.add_argument(
+        '--auth-ttl',
+        type=int,
+        default=lims.AUTH_TTL,
+        help='Time in seconds a successful authentication with SENAITE '
+             'is trusted before it is checked again. Only has effect when '
+             'argument --url is set')
+
+    lims_group.add_argument(
+        '--spool',
+        type=str,
+        default=SPOOL_FILE,
+        help='Path of the database to persist the messages until SENAITE '
+             'has accepted them. Only has effect when argument --url is set')
+
+    lims_group.add_argument(
+        '--batch-size',
+        type=int,
+        default=1,
+        help='Maximum number of messages to send to SENAITE in one request. '
+             'Only has effect when argument --url is set')
+
+    lims_group.add_argument(
+        '--batch-bytes',
+        type=int,
+        default=0,
+        help='Maximum size in bytes of the messages to send to SENAITE in '
+             'one request. Unlimited if set to 0. Only has effect when '
+             'argument --url is set')
+
+    lims_group.add_argument(
+        '--batch-window',
+        type=float,
+        default=0.25,
+        help='Time in seconds to wait for more messages to fill a batch. '
+             'Only has effect when argument --batch-size is greater than 1')
+
     lims_group.add_argument(
         '-r',
         '--retries',
         type=int,
         default=3,
-        help='Number of attempts of reconnection when SENAITE '
+        help='Number of consecutive failed pushes after which all pushes '
+             'are paused for --max-delay seconds because the SENAITE '
              'instance is not reachable. Only has effect when '
              'argument --url is set')
 
@@ -90,10 +284,50 @@ def main():
         '--delay',
         type=int,
         default=5,
-        help='Time delay in seconds between retries when '
+        help='Initial time delay in seconds between retries when '
+             'SENAITE instance is not reachable. The delay is doubled '
+             'with every failed retry. Only has '
+             'effect when argument --url is set')
+
+    lims_group.add_argument(
+        '--max-delay',
+        type=int,
+        default=pusher.MAX_DELAY,
+        help='Maximum time delay in seconds between retries when '
              'SENAITE instance is not reachable. Only has '
              'effect when argument --url is set')
 
+    lims_group.add_argument(
+        '--push-concurrency',
+        type=int,
+        default=pusher.CONCURRENCY,
+        help='Number of concurrent pushes to SENAITE. '
+             'Only has effect when argument --url is set')
+
+    lims_group.add_argument(
+        '--query-orders',
+        action='store_true',
+        help='Answer the host queries (Q records) of the instruments with '
+             'the open orders of the queried samples. The orders are looked '
+             'up in a local cache that is refreshed from SENAITE every '
+             '--order-refresh seconds. Requires argument --url')
+
+    lims_group.add_argument(
+        '--order-refresh',
+        type=int,
+        default=REFRESH_INTERVAL,
+        help='Time in seconds between two refreshes of the order cache. '
+             'Only has effect when argument --query-orders is set')
+
+    lims_group.add_argument(
+        '--order-cache',
+        type=str,
+        help='Path of the database to persist the order cache, so that '
+             'queries are answered right after a restart. The cache is only '
+             'kept in memory if not set. Multiple workers share the cache in '
+             '"{}" if not set. Only has effect when argument '
+             '--query-orders is set'.format(ORDER_CACHE_FILE))
+
     parser.add_argument(
         '-v',
         '--verbose',
@@ -108,6 +342,54 @@ def main():
     # Parse Arguments
     args = parser.parse_args()
 
+    setup_logging(args)
+
+    # Install the event loop before any loop is created
+    install_event_loop_policy(args.loop)
+
+    # Validate output path
+    output = args.output
+    if output and not os.path.isdir(args.output):
+        logger.error('Output path must be an existing directory')
+        return sys.exit(-1)
+
+    # Validate trusted instruments
+    unknown = set(args.trusted).difference(registry.get_names())
+    if unknown:
+        logger.error('Unknown instrument(s): {}'.format(
+            ', '.join(sorted(unknown))))
+        return sys.exit(-1)
+
+    # Validate host query settings
+    if args.query_orders and not args.url:
+        logger.error('Argument --query-orders requires argument --url')
+        return sys.exit(-1)
+
+    # Validate SENAITE URL
+    session = None
+    if args.url:
+        session = lims.Session(args.url,
+                               pool_size=args.http_pool_size,
+                               auth_ttl=args.auth_ttl)
+        logger.info('Checking connection to SENAITE ...')
+        if not session.auth():
+            return sys.exit(-1)
+
+    if args.workers > 1:
+        if not supports_reuse_port():
+            logger.error('Multiple workers require SO_REUSEPORT support')
+            return sys.exit(-1)
+        if args.query_orders and not args.order_cache:
+            # the workers read the orders refreshed by the supervisor
+            args.order_cache = ORDER_CACHE_FILE
+        return supervise(args, session)
+
+    serve(args, session)
+
+
+def setup_logging(args):
+    """Setup the logger from the parsed arguments
+    """
     if args.logfile:
         handler = logging.handlers.RotatingFileHandler(
             args.logfile, maxBytes=5, backupCount=0)
@@ -119,9 +401,6 @@ def main():
         # Attach the handler to the logger
         logger.addHandler(handler)
 
-    # Get the current event loop.
-    loop = asyncio.get_event_loop()
-
     # Set logging
     if args.verbose:
         logger.setLevel(logging.DEBUG)
@@ -129,19 +408,90 @@ def main():
         logger.setLevel(logging.INFO)
     logger.addHandler(logging.StreamHandler())
 
-    # Validate output path
-    output = args.output
-    if output and not os.path.isdir(args.output):
-        logger.error('Output path must be an existing directory')
-        return sys.exit(-1)
 
-    # Validate SENAITE URL
+def create_pusher(args, session, spool, **kw):
+    """Create a pusher for the spooled messages
+    """
+    push = functools.partial(
+        push_to_senaite, session=session, consumer=args.consumer)
+    return Pusher(
+        spool, push,
+        concurrency=args.push_concurrency,
+        delay=args.delay,
+        max_delay=args.max_delay,
+        breaker=CircuitBreaker(args.retries, timeout=args.max_delay),
+        batch_size=args.batch_size,
+        batch_bytes=args.batch_bytes,
+        batch_window=args.batch_window,
+        metrics=Metrics(),
+        **kw)
+
+
+def configure_instruments(args):
+    """Load the instrument modules and apply the instrument options
+
+    Also runs in every process of the worker pool, which does not inherit
+    the options when it is spawned.
+    """
+    # Import the instrument modules and compile their header patterns once
+    registry.load()
+    registry.trusted = set(args.trusted)
+    horiba_yumizen_h5xx.DECODE_HISTOGRAMS = args.decode_histograms
+
+
+def create_executor(args, **kw):
+    """Create the worker pool to convert the messages
+    """
+    if args.pool_type == "process":
+        kw.update(initializer=configure_instruments, initargs=(args, ))
+    return POOL_EXECUTORS[args.pool_type](max_workers=args.pool_size, **kw)
+
+
+def recover_spool(spool, message_format):
+    """Convert the messages received before the last shutdown
+
+    The raw messages are spooled at EOT, so that a crash during their
+    conversion does not lose them.
+    """
+    entries = spool.raw()
+    for entry_id, data in entries:
+        try:
+            message = convert_messages(unpack_frames(data), message_format)
+        except Exception as exc:
+            logger.error("Could not convert spooled message {}: {!r}"
+                         .format(entry_id, exc))
+            spool.park(entry_id)
+            continue
+        spool.convert(entry_id, message)
+    if entries:
+        logger.info('Converted {} spooled message(s)'.format(len(entries)))
+
+
+def serve(args, session=None, worker=False):
+    """Run the ASTM server
+
+    A worker binds the listen port with SO_REUSEPORT and only spools the
+    messages, which are pushed to SENAITE by the supervisor process. It
+    also only reads the order cache, which the supervisor refreshes.
+    """
     url = args.url
+    output = args.output
+
+    # Get a new event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    configure_instruments(args)
+
+    spool = spool_pusher = None
     if url:
-        session = lims.Session(url)
-        logger.info('Checking connection to SENAITE ...')
-        if not session.auth():
-            return sys.exit(-1)
+        spool = Spool(args.spool)
+        # the supervisor recovers the messages spooled by the workers
+        if not worker:
+            recover_spool(spool, args.message_format)
+        pending = len(spool)
+        if pending and not worker:
+            logger.info('Replaying {} spooled message(s)'.format(pending))
 
     def dispatch_astm_message(message):
         """Dispatch astm message
@@ -149,52 +499,185 @@ def main():
         logger.debug('Dispatching ASTM Message')
         if output:
             path = os.path.abspath(output)
-            loop.create_task(
-                asyncio.to_thread(
-                    write_message, message, path))
-        if url:
-            session = lims.Session(url)
-            session_args = {
-                'delay': args.delay,
-                'retries': args.retries,
-                'consumer': args.consumer,
-            }
-            loop.create_task(
+            pipeline.track(loop.create_task(
                 asyncio.to_thread(
-                    post_to_senaite, message, session, **session_args))
+                    write_message, message, path)))
+        # the protocol persisted the message before it was converted
+        if spool_pusher is not None:
+            spool_pusher.notify()
 
     # Create a ASTM message consumer task to be scheduled concurrently.
-    queue = asyncio.Queue()
-    loop.create_task(consume(queue, callback=dispatch_astm_message))
+    pipeline = Pipeline(queue_size=args.queue_size,
+                        max_tasks=args.max_tasks)
+    loop.create_task(
+        consume(pipeline.queue, callback=dispatch_astm_message))
+    loop.create_task(report(pipeline))
+
+    # Create a pusher task to push the spooled messages to SENAITE
+    if url and not worker:
+        spool_pusher = create_pusher(args, session, spool)
+        loop.create_task(spool_pusher.run())
+
+    # Answer the host queries from a local cache of the open orders
+    responder = order_cache = order_session = None
+    if url and args.query_orders:
+        order_cache = OrderCache(args.order_cache)
+        responder = QueryResponder(order_cache)
+        if worker:
+            # the supervisor refreshes the shared cache from SENAITE
+            loop.create_task(reload_orders(order_cache))
+        else:
+            order_session = session or lims.Session(
+                url, pool_size=args.http_pool_size, auth_ttl=args.auth_ttl)
+            fetch = functools.partial(fetch_orders, order_session)
+            loop.create_task(
+                refresh_orders(order_cache, fetch, args.order_refresh))
+
+    # Worker pool to convert the messages outside of the event loop
+    executor = None
+    if args.pool_size > 0:
+        executor = create_executor(args)
+        logger.info('Converting messages in a {} pool of {} workers'
+                    .format(args.pool_type, args.pool_size))
+
+    # TCP options of the listeners and the instrument connections
+    socket_options = SocketOptions(nodelay=args.tcp_nodelay,
+                                   quickack=args.tcp_quickack,
+                                   rcvbuf=args.rcvbuf,
+                                   sndbuf=args.sndbuf,
+                                   keepalive=args.keepalive)
 
     # Create a TCP server coroutine listening on port of the host address.
     # IMPORTANT: We create a new Protocol for every connection!
     server_coro = loop.create_server(
-        lambda: ASTMProtocol(queue=queue, message_format=args.message_format),
-        host=args.listen, port=args.port)
+        lambda: ASTMProtocol(pipeline=pipeline,
+                             ack_delay=args.ack_delay,
+                             message_format=args.message_format,
+                             executor=executor,
+                             incremental=args.incremental,
+                             responder=responder,
+                             socket_options=socket_options,
+                             spool=spool),
+        host=args.listen, port=args.port, reuse_port=worker or None)
 
     # Run until the future (an instance of Future) has completed.
     server = loop.run_until_complete(server_coro)
 
     for socket in server.sockets:
+        # the accepted connections inherit the buffer sizes of the listener
+        socket_options.apply(socket)
         ip, port = socket.getsockname()
         logger.info('Starting server on {}:{}'.format(ip, port))
         logger.info('ASTM server ready to handle connections ...')
 
+    if worker:
+        # stop gracefully when the supervisor terminates the worker
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         logger.info('Shutting down server...')
-        all_tasks = asyncio.gather(
-            *asyncio.all_tasks(loop), return_exceptions=True)
-        all_tasks.cancel()
-        with contextlib.suppress(asyncio.CancelledError):
-            loop.run_until_complete(all_tasks)
-        loop.run_until_complete(loop.shutdown_asyncgens())
     finally:
+        shutdown(loop)
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if spool_pusher is not None:
+            logger.info('Delivered {}'.format(spool_pusher.metrics))
+            spool_pusher.close()
+        if spool is not None:
+            spool.close()
+        if order_cache is not None:
+            order_cache.close()
+        if order_session is not None and order_session is not session:
+            order_session.close()
+        if session is not None:
+            session.close()
+        loop.close()
+        logger.info('Server is now down...')
+
+
+def supervise(args, session=None):
+    """Run the ASTM server in multiple worker processes
+
+    The workers share the listen port, so that the kernel balances the
+    instrument connections across them, and a shared spool, from which the
+    supervisor pushes the messages to SENAITE. The supervisor also refreshes
+    the order cache, which the workers read. Dead workers are restarted.
+    """
+    spool = spool_pusher = order_cache = None
+    if args.url:
+        spool = Spool(args.spool)
+        # convert the leftovers before the workers spool new messages
+        configure_instruments(args)
+        recover_spool(spool, args.message_format)
+
+    supervisor = Supervisor(work, args=(args, ), workers=args.workers)
+    supervisor.start()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def watch(interval=1):
+        while not supervisor.exhausted:
+            supervisor.check()
+            await asyncio.sleep(interval)
+        logger.error('All workers failed to start, shutting down')
+        loop.stop()
+
+    loop.create_task(watch())
+    # stop the workers as well when the supervisor is terminated
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
+    if args.url:
+        spool_pusher = create_pusher(
+            args, session, spool, poll_interval=SPOOL_POLL_INTERVAL)
+        loop.create_task(spool_pusher.run())
+
+    # Refresh the order cache of the workers once for all of them
+    if args.url and args.query_orders:
+        order_cache = OrderCache(args.order_cache)
+        fetch = functools.partial(fetch_orders, session)
+        loop.create_task(
+            refresh_orders(order_cache, fetch, args.order_refresh))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        logger.info('Shutting down workers...')
+    finally:
+        supervisor.stop()
+        shutdown(loop)
+        if spool_pusher is not None:
+            logger.info('Delivered {}'.format(spool_pusher.metrics))
+            spool_pusher.close()
+            spool.close()
+        if order_cache is not None:
+            order_cache.close()
+        if session is not None:
+            session.close()
         loop.close()
         logger.info('Server is now down...')
 
 
+def work(args):
+    """Entry point of a worker process
+    """
+    setup_logging(args)
+    install_event_loop_policy(args.loop)
+    serve(args, worker=True)
+
+
+def shutdown(loop):
+    """Cancel all pending tasks of the loop
+    """
+    all_tasks = asyncio.gather(
+        *asyncio.all_tasks(loop), return_exceptions=True)
+    all_tasks.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        loop.run_until_complete(all_tasks)
+    loop.run_until_complete(loop.shutdown_asyncgens())
+
+
 if __name__ == '__main__':
     main()
@@ -3,12 +3,20 @@
 import argparse
 import asyncio
 import logging
+import time
 
 from senaite.astm import logger
 from senaite.astm.constants import CRLF
 from senaite.astm.constants import ENQ
 from senaite.astm.constants import EOT
 from senaite.astm.constants import ACK
+from senaite.astm.constants import NAK
+from senaite.astm.constants import STX
+from senaite.astm.loops import DEFAULT_LOOP
+from senaite.astm.loops import LOOPS
+from senaite.astm.loops import install_event_loop_policy
+from senaite.astm.utils import FrameBuffer
+from senaite.astm.utils import validate_checksum
 
 
 def main():
@@ -47,6 +55,14 @@ def main():
         default=0.0,
         help='Delay in seconds between two frames.')
 
+    parser.add_argument(
+        '--loop',
+        type=str,
+        default=DEFAULT_LOOP,
+        choices=LOOPS,
+        help='Event loop implementation. Falls back to asyncio if uvloop '
+             'is not installed')
+
     parser.add_argument(
         '-v',
         '--verbose',
@@ -63,8 +79,10 @@ def main():
         logger.setLevel(logging.INFO)
     logger.addHandler(logging.StreamHandler())
 
-    # Get the current event loop.
-    loop = asyncio.get_event_loop()
+    # Get a new event loop of the selected implementation
+    install_event_loop_policy(args.loop)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
 
     for f in args.infile:
         lines = f.readlines()
@@ -98,6 +116,8 @@ async def send_message(lines, address, port, **kw):
     response = await reader.read(100)
     logger.info('<- Got response: {!r}'.format(response))
     success = True
+    # seconds from sending a frame until its response was received
+    round_trips = []
 
     for line in lines:
         # Remove trailing \r\n
@@ -107,9 +127,11 @@ async def send_message(lines, address, port, **kw):
             continue
         logger.info('-> Sending data: {!r}'.format(line))
         await asyncio.sleep(delay)
+        start = time.perf_counter()
         writer.write(line)
         await writer.drain()
         response = await reader.read(100)
+        round_trips.append(time.perf_counter() - start)
         logger.info('<- Got response: {!r}'.format(response))
         if response != ACK:
             logger.error('Expected ACK, got {!r}'.format(response))
@@ -120,6 +142,41 @@ async def send_message(lines, address, port, **kw):
         logger.info('-> Write EOT')
         writer.write(EOT)
 
+    if round_trips:
+        logger.info('Mean round trip per frame: {:.3f} ms'.format(
+            sum(round_trips) / len(round_trips) * 1000))
+    return round_trips
+
+
+async def receive_message(reader, writer, **kw):
+    """Receive a message from the ASTM server like an instrument
+
+    Acknowledges the ENQ and every frame with a valid checksum until the EOT
+    of the server.
+
+    :returns: List of the received frames
+    """
+    # the frames (by index) to reject once, e.g. to test retransmissions
+    nak = set(kw.get('nak', []))
+    buffer = FrameBuffer()
+    frames = []
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            raise ConnectionError('Connection closed by the server')
+        for token in buffer.feed(data):
+            if token.startswith(ENQ):
+                writer.write(ACK)
+            elif token.startswith(STX):
+                if len(frames) in nak or not validate_checksum(token):
+                    nak.discard(len(frames))
+                    writer.write(NAK)
+                    continue
+                frames.append(token)
+                writer.write(ACK)
+            elif token.startswith(EOT):
+                return frames
+
 
 if __name__ == '__main__':
     main()
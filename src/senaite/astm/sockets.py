@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import socket
+
+from senaite.astm import logger
+
+# Seconds between two keepalive probes
+KEEPALIVE_INTERVAL = 10
+
+# Number of unanswered keepalive probes until the connection is dropped
+KEEPALIVE_COUNT = 3
+
+
+class SocketOptions(object):
+    """TCP options of the instrument connections
+
+    Every frame is acknowledged before the instrument sends the next one,
+    therefore any delay of the small ACK/NAK responses adds up to the
+    duration of the whole transfer.
+
+    :param nodelay: Send small segments immediately (disable Nagle)
+    :param quickack: Acknowledge received segments immediately (Linux)
+    :param rcvbuf: Receive buffer size in bytes or 0 for the system default
+    :param sndbuf: Send buffer size in bytes or 0 for the system default
+    :param keepalive: Idle seconds until the connection is probed or 0
+    """
+
+    def __init__(self, nodelay=True, quickack=False, rcvbuf=0, sndbuf=0,
+                 keepalive=0):
+        self.nodelay = nodelay
+        self.quickack = quickack and hasattr(socket, "TCP_QUICKACK")
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.keepalive = keepalive
+
+    def get_options(self):
+        """Returns the (level, option, value) tuples to set
+        """
+        options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                    int(self.nodelay))]
+        if self.quickack:
+            options.append((socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1))
+        if self.rcvbuf:
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf))
+        if self.sndbuf:
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf))
+        if self.keepalive:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            for name, value in (("TCP_KEEPIDLE", self.keepalive),
+                                ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                                ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+                if hasattr(socket, name):
+                    options.append(
+                        (socket.IPPROTO_TCP, getattr(socket, name), value))
+        return options
+
+    def apply(self, sock):
+        """Set the options on the socket
+
+        Options that are not supported by the socket are skipped.
+        """
+        if sock is None:
+            return
+        for level, option, value in self.get_options():
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError as exc:
+                logger.debug("Could not set socket option {}: {!r}"
+                             .format(option, exc))
+
+    def rearm(self, sock):
+        """Set the options that the kernel resets while receiving
+
+        TCP_QUICKACK is not permanent and must be set again after the data
+        was read from the socket.
+        """
+        if not self.quickack or sock is None:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        except OSError:
+            pass
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sqlite3
+import threading
+import time
+
+from senaite.astm import logger
+
+# Default path of the spool database
+SPOOL_FILE = "senaite-astm-spool.db"
+
+# States of the spooled messages
+RAW = 0  # received frames that are not yet converted
+PENDING = 1  # converted message waiting to be pushed
+PARKED = 2  # raw frames that could not be converted
+
+# Number of failed deliveries after which a message is reported as suspect
+SUSPECT_ATTEMPTS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    state INTEGER NOT NULL DEFAULT 1,
+    message BLOB NOT NULL
+)
+"""
+
+# Entries are counted and fetched by their state
+INDEX = "CREATE INDEX IF NOT EXISTS messages_state ON messages (state)"
+
+
+def pack_frames(frames):
+    """Returns the received frames of a message as a storable string
+    """
+    return json.dumps([frame.decode("latin-1") for frame in frames])
+
+
+def unpack_frames(data):
+    """Returns the list of frames of a packed message
+    """
+    return [frame.encode("latin-1") for frame in json.loads(data)]
+
+
+class Spool(object):
+    """Durable outbound queue of converted messages
+
+    Messages are persisted in a SQLite database in WAL mode before they are
+    pushed to SENAITE and are only removed once they were acknowledged. All
+    entries that were not acknowledged, e.g. because the server was stopped
+    or SENAITE was not reachable, are delivered again (at-least-once).
+
+    The received frames are stored as RAW entries when the instrument ended
+    the transfer and replaced by the converted message later, so that an
+    acknowledged message survives a crash during its conversion.
+
+    The pending entries live on disk and are fetched in limited batches, so
+    that a long LIMS downtime does not grow the memory of the server.
+    """
+
+    def __init__(self, path=SPOOL_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # every committed message survives a power loss
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute(SCHEMA)
+        self.migrate()
+
+    def migrate(self):
+        """Add the columns and indexes missing in spools of older versions
+        """
+        cursor = self.connection.execute("PRAGMA table_info(messages)")
+        columns = [row[1] for row in cursor.fetchall()]
+        if "state" not in columns:
+            self.connection.execute(
+                "ALTER TABLE messages "
+                "ADD COLUMN state INTEGER NOT NULL DEFAULT 1")
+        self.connection.execute(INDEX)
+
+    def __len__(self):
+        """Number of messages waiting to be pushed
+        """
+        return self.count(PENDING)
+
+    def count(self, state=PENDING):
+        """Number of entries in the given state
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT COUNT(*) FROM messages WHERE state = ?", (state, ))
+            return cursor.fetchone()[0]
+
+    def put(self, message, state=PENDING):
+        """Persist the message and return the ID of the entry
+        """
+        return self.put_many([message], state)[0]
+
+    def put_many(self, messages, state=PENDING):
+        """Persist the messages in one transaction and return their IDs
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            ids = [self.connection.execute(
+                "INSERT INTO messages (created, state, message) "
+                "VALUES (?, ?, ?)", (now, state, message)).lastrowid
+                for message in messages]
+            self.connection.execute("COMMIT")
+            return ids
+
+    def convert(self, entry_id, message):
+        """Replace the raw frames of the entry with the converted message
+        """
+        with self.lock:
+            self.connection.execute(
+                "UPDATE messages SET message = ?, state = ? WHERE id = ?",
+                (message, PENDING, entry_id))
+
+    def park(self, *ids):
+        """Keep the entries that can not be converted, but never push them
+        """
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE messages SET state = ? WHERE id = ?",
+                [(PARKED, i) for i in ids])
+
+    def raw(self):
+        """Return a list of (id, packed frames) tuples of unconverted entries
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT id, message FROM messages WHERE state = ? "
+                "ORDER BY id", (RAW, ))
+            return cursor.fetchall()
+
+    def pending(self, limit=100):
+        """Return a list of (id, created, message, attempts) tuples in order
+        of arrival
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT id, created, message, attempts FROM messages "
+                "WHERE state = ? ORDER BY id LIMIT ?",
+                (PENDING, limit))
+            return cursor.fetchall()
+
+    def ack(self, *ids):
+        """Remove the delivered entries
+        """
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM messages WHERE id = ?", [(i, ) for i in ids])
+
+    def fail(self, *ids):
+        """Count a failed delivery of the entries
+        """
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE messages SET attempts = attempts + 1 WHERE id = ?",
+                [(i, ) for i in ids])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class Metrics(object):
+    """Size and latency statistics of the delivered batches
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.messages = 0
+        self.size = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, count, size, latency):
+        """Record a delivered batch
+
+        :param count: number of messages in the batch
+        :param size: number of bytes of the messages in the batch
+        :param latency: seconds since the oldest message was spooled
+        """
+        self.batches += 1
+        self.messages += count
+        self.size += size
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    @property
+    def messages_per_batch(self):
+        if not self.batches:
+            return 0.0
+        return float(self.messages) / self.batches
+
+    @property
+    def mean_latency(self):
+        if not self.batches:
+            return 0.0
+        return self.latency / self.batches
+
+    def __str__(self):
+        return ("{} message(s) in {} batch(es), {:.1f} messages per batch, "
+                "latency {:.3f}s mean / {:.3f}s max".format(
+                    self.messages, self.batches, self.messages_per_batch,
+                    self.mean_latency, self.max_latency))
+
+
+def get_size(message):
+    """Return the number of bytes (or characters) of the message
+    """
+    if isinstance(message, (bytes, str)):
+        return len(message)
+    return 0
+
+
+def iter_batches(entries, batch_size=1, batch_bytes=0):
+    """Group the spool entries into batches
+
+    A batch holds at most `batch_size` entries and, if `batch_bytes` is set,
+    no more than `batch_bytes` bytes unless it is a single larger entry.
+    """
+    batch = []
+    size = 0
+    for entry in entries:
+        entry_size = get_size(entry[2])
+        full = len(batch) >= batch_size
+        if batch_bytes and size + entry_size > batch_bytes:
+            full = True
+        if batch and full:
+            yield batch
+            batch = []
+            size = 0
+        batch.append(entry)
+        size += entry_size
+    if batch:
+        yield batch
+
+
+def deliver_batch(spool, batch, push, metrics=None):
+    """Push a batch of spool entries and acknowledge it on success
+
+    :returns: True if the batch was delivered, otherwise False
+    """
+    ids = [entry[0] for entry in batch]
+    messages = [entry[2] for entry in batch]
+    if not push(messages):
+        spool.fail(*ids)
+        attempts = max(entry[3] for entry in batch) + 1
+        logger.warning("Could not deliver spooled message(s) {} (attempt {})"
+                       ", {} left".format(ids, attempts, len(spool)))
+        if attempts == SUSPECT_ATTEMPTS:
+            logger.error("Spooled message(s) {} failed {} times, they might "
+                         "be rejected by SENAITE".format(ids, attempts))
+        return False
+    spool.ack(*ids)
+    if metrics is not None:
+        size = sum(map(get_size, messages))
+        latency = time.time() - batch[0][1]
+        metrics.add(len(batch), size, latency)
+        logger.debug("Delivered a batch of {} message(s) ({} bytes) "
+                     "after {:.3f}s".format(len(batch), size, latency))
+    return True
+
+
+def deliver(spool, push, batch_size=1, batch_bytes=0, limit=100,
+            metrics=None):
+    """Push the pending entries of the spool in the order of arrival
+
+    The entries are pushed in batches, see `iter_batches`, and every batch is
+    acknowledged as soon as `push` returns a true value for the list of its
+    messages. The delivery stops at the first failure to keep the order of
+    the messages.
+
+    :returns: the number of delivered entries or -1 if a push failed
+    """
+    delivered = 0
+    entries = spool.pending(limit=max(limit, batch_size))
+    for batch in iter_batches(entries, batch_size, batch_bytes):
+        if not deliver_batch(spool, batch, push, metrics=metrics):
+            return -1
+        delivered += len(batch)
+    return delivered
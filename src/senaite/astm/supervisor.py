@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import socket
+import sys
+import time
+
+from senaite.astm import logger
+
+# Seconds a worker must run to not count as failed start
+MIN_UPTIME = 10
+
+# Seconds to wait before the restart after the first failed start, doubled
+# with every further failed start up to RESTART_MAX_DELAY
+RESTART_DELAY = 1
+RESTART_MAX_DELAY = 60
+
+# Number of failed starts in a row until a worker is given up
+MAX_FAILURES = 5
+
+
+def supports_reuse_port():
+    """Checks if the platform can balance connections with SO_REUSEPORT
+
+    Only Linux distributes the connections across all sockets bound to the
+    port. Other platforms accept the option, but pass all connections to a
+    single socket.
+    """
+    return hasattr(socket, "SO_REUSEPORT") and sys.platform.startswith("linux")
+
+
+class Supervisor(object):
+    """Starts worker processes and restarts them when they died
+
+    Every worker calls `target(*args)` in a new process. The processes are
+    spawned instead of forked, so that they do not inherit the event loop,
+    sockets or threads of the supervisor.
+
+    A worker that dies within `min_uptime` seconds, e.g. because the port is
+    taken, is restarted with an exponential backoff and given up after
+    `max_failures` failed starts in a row.
+    """
+
+    def __init__(self, target, args=(), workers=2, **kw):
+        self.target = target
+        self.args = args
+        self.size = workers
+        self.min_uptime = kw.get("min_uptime", MIN_UPTIME)
+        self.delay = kw.get("delay", RESTART_DELAY)
+        self.max_delay = kw.get("max_delay", RESTART_MAX_DELAY)
+        self.max_failures = kw.get("max_failures", MAX_FAILURES)
+        self.clock = kw.get("clock", time.monotonic)
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = []
+        self.restarts = 0
+        # start time, failed starts in a row and restart time per worker
+        self.started = {}
+        self.failures = {}
+        self.restart_at = {}
+        self.given_up = set()
+
+    @property
+    def exhausted(self):
+        """Checks if all workers were given up
+        """
+        return len(self.given_up) == self.size
+
+    def spawn(self, number):
+        process = self.context.Process(
+            target=self.target, args=self.args,
+            name="senaite-astm-worker-{}".format(number))
+        process.start()
+        self.started[number] = self.clock()
+        logger.info("Started worker {} (pid {})".format(number, process.pid))
+        return process
+
+    def start(self):
+        self.workers = [self.spawn(number) for number in range(self.size)]
+
+    def check(self):
+        """Restart the dead workers when their backoff expired
+
+        :returns: the number of restarted workers
+        """
+        now = self.clock()
+        restarted = 0
+        for number, process in enumerate(self.workers):
+            if process is not None:
+                if process.is_alive():
+                    continue
+                self.on_death(number, process, now)
+                self.workers[number] = None
+            if number in self.given_up or now < self.restart_at[number]:
+                continue
+            self.workers[number] = self.spawn(number)
+            restarted += 1
+        self.restarts += restarted
+        return restarted
+
+    def on_death(self, number, process, now):
+        """Schedule the restart of the dead worker
+        """
+        logger.error("Worker {} (pid {}) died with exit code {}"
+                     .format(number, process.pid, process.exitcode))
+        process.close()
+        if now - self.started[number] >= self.min_uptime:
+            # restart a worker that ran for a while at once
+            self.failures[number] = 0
+            self.restart_at[number] = now
+            return
+        failures = self.failures.get(number, 0) + 1
+        self.failures[number] = failures
+        if failures >= self.max_failures:
+            logger.error("Worker {} failed to start {} times in a row, "
+                         "giving up".format(number, failures))
+            self.given_up.add(number)
+            return
+        delay = min(self.delay * 2 ** (failures - 1), self.max_delay)
+        logger.info("Restarting worker {} in {}s".format(number, delay))
+        self.restart_at[number] = now + delay
+
+    def stop(self, timeout=5):
+        """Terminate all workers
+        """
+        workers = [process for process in self.workers if process is not None]
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.workers = []
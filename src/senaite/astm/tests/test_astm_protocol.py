@@ -1,15 +1,31 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock
 from unittest.mock import Mock
 
+from senaite.astm import codec
 from senaite.astm.constants import ACK
 from senaite.astm.constants import CRLF
+from senaite.astm.constants import ENCODING
 from senaite.astm.constants import ENQ
 from senaite.astm.constants import EOT
 from senaite.astm.constants import NAK
+from senaite.astm.exceptions import NotAccepted
 from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.protocol import convert_messages
+from senaite.astm.spool import PARKED
+from senaite.astm.spool import Spool
+from senaite.astm.spool import unpack_frames
 from senaite.astm.tests.base import ASTMTestBase
+from senaite.astm.utils import FrameBuffer
 
 
 class ASTMProtocolTest(ASTMTestBase):
@@ -85,3 +101,447 @@ class ASTMProtocolTest(ASTMTestBase):
 
         # Protocol should be no longer in transfer state
         self.assertFalse(self.protocol.in_transfer_state)
+
+    def get_session_stream(self, filename, eol=CRLF):
+        """Returns a full instrument session as a single byte stream
+        """
+        path = self.get_instrument_file_path(filename)
+        lines = self.read_file_lines(path)
+        frames = [line.strip(CRLF) for line in lines]
+        return ENQ + b"".join(f + eol for f in frames) + EOT, frames
+
+    def test_coalesced_stream(self):
+        queue = asyncio.Queue()
+        protocol = ASTMProtocol(queue=queue)
+        transport = self.get_mock_transport()
+        protocol.connection_made(transport)
+
+        stream, frames = self.get_session_stream("sysmex_xn550.txt")
+
+        # the whole session is received within a single read
+        protocol.data_received(stream)
+
+        # every frame and the ENQ is acknowledged
+        responses = [c.args[0] for c in transport.write.call_args_list]
+        self.assertEqual(responses, [ACK] * (len(frames) + 1))
+
+        # the message was completed with the EOT
+        self.assertEqual(queue.qsize(), 1)
+        self.assertFalse(protocol.in_transfer_state)
+        self.assertEqual(len(protocol.buffer), 0)
+
+    def test_segmented_stream(self):
+        stream, frames = self.get_session_stream("yumizen_h500.txt")
+
+        expected = None
+        rand = random.Random(42)
+        for i in range(10):
+            queue = asyncio.Queue()
+            protocol = ASTMProtocol(queue=queue)
+            transport = self.get_mock_transport()
+            protocol.connection_made(transport)
+
+            # receive the session in randomly sized segments
+            pos = 0
+            while pos < len(stream):
+                size = rand.randint(1, 100)
+                protocol.data_received(stream[pos:pos + size])
+                pos += size
+
+            responses = [c.args[0] for c in transport.write.call_args_list]
+            self.assertEqual(responses, [ACK] * (len(frames) + 1))
+            self.assertEqual(queue.qsize(), 1)
+
+            # the resulting message does not depend on the segmentation
+            message = queue.get_nowait()
+            if expected is None:
+                expected = message
+            self.assertEqual(message, expected)
+
+    async def test_convert_in_executor(self):
+        queue = asyncio.Queue()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            protocol = ASTMProtocol(queue=queue, executor=executor)
+            transport = self.get_mock_transport()
+            protocol.connection_made(transport)
+
+            stream, frames = self.get_session_stream("sysmex_xn550.txt")
+            protocol.data_received(stream)
+
+            # the session is done, but the message is converted in the pool
+            self.assertFalse(protocol.in_transfer_state)
+            message = await asyncio.wait_for(queue.get(), 5)
+
+        expected = convert_messages([f + CRLF for f in frames], "json")
+        self.assertEqual(message, expected)
+
+    def test_raw_payload(self):
+        for filename in ("sysmex_xn550.txt", "yumizen_h500.txt"):
+            queue = asyncio.Queue()
+            protocol = ASTMProtocol(queue=queue, message_format="astm")
+            protocol.connection_made(self.get_mock_transport())
+            stream, frames = self.get_session_stream(filename)
+            protocol.data_received(stream)
+            # the frames are kept as sent, including their terminators
+            expected = b"\n".join(f + CRLF for f in frames).decode(ENCODING)
+            self.assertEqual(queue.get_nowait(), expected)
+
+    def test_incremental_decoding(self):
+        for path in self.instrument_files:
+            filename = os.path.basename(path)
+            stream, frames = self.get_session_stream(filename)
+            for message_format in ("json", "astm", "lis2a"):
+                queue = asyncio.Queue()
+                protocol = ASTMProtocol(
+                    queue=queue, message_format=message_format,
+                    incremental=True)
+                protocol.connection_made(self.get_mock_transport())
+
+                # the records are decoded before the transfer ended
+                protocol.data_received(stream[:-1])
+                # chunked frames are joined to a single message
+                messages = protocol.messages
+                self.assertEqual(protocol.wrapper.messages, messages)
+                self.assertTrue(protocol.wrapper.records)
+
+                protocol.data_received(EOT)
+                self.assertIsNone(protocol.wrapper)
+                self.assertEqual(queue.get_nowait(),
+                                 convert_messages(messages, message_format))
+
+
+class MultiMessageSessionTest(ASTMTestBase):
+    """Test sessions with several messages between ENQ and EOT
+    """
+
+    files = ("sysmex_xn550.txt", "yumizen_h500.txt", "cobas_c311.txt")
+
+    def get_frames(self, filename):
+        path = self.get_instrument_file_path(filename)
+        lines = self.read_file_lines(path)
+        return [line.strip(CRLF) + CRLF for line in lines]
+
+    async def receive(self, stream, count, **kw):
+        """Receive the stream and return the `count` queued messages
+        """
+        queue = asyncio.Queue()
+        protocol = ASTMProtocol(queue=queue, **kw)
+        transport = MagicMock()
+        transport.get_extra_info = Mock(return_value=("127.0.0.1", 1))
+        protocol.connection_made(transport)
+        protocol.data_received(stream)
+        protocol.cancel_timer()
+        messages = []
+        for i in range(count):
+            messages.append(await asyncio.wait_for(queue.get(), 5))
+        self.assertTrue(queue.empty())
+        return messages
+
+    def get_raw(self, messages):
+        """Returns the raw ASTM messages of the JSON messages
+        """
+        return [json.loads(message)["metadata"]["astm"]
+                for message in messages]
+
+    async def test_split_session(self):
+        sessions = [self.get_frames(filename) for filename in self.files]
+        stream = ENQ + b"".join(b"".join(s) for s in sessions) + EOT
+        expected = []
+        for frames in sessions:
+            expected.extend(self.get_raw(
+                await self.receive(ENQ + b"".join(frames) + EOT, 1)))
+
+        # every message of the session is dispatched on its own, the
+        # payloads differ in the generated timestamps
+        messages = await self.receive(stream, 3)
+        self.assertEqual(self.get_raw(messages), expected)
+        messages = await self.receive(stream, 3, incremental=True)
+        self.assertEqual(self.get_raw(messages), expected)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            messages = await self.receive(stream, 3, executor=executor)
+        # the messages are converted concurrently in any order
+        self.assertEqual(sorted(self.get_raw(messages)), sorted(expected))
+
+    async def test_incremental_executor(self):
+        sessions = [self.get_frames(filename) for filename in self.files]
+        stream = ENQ + b"".join(b"".join(s) for s in sessions) + EOT
+        expected = await self.receive(stream, 3)
+        # the decoded messages are serialized in the worker pool
+        for executor in (ThreadPoolExecutor(max_workers=1),
+                         ProcessPoolExecutor(max_workers=1)):
+            with executor:
+                messages = await self.receive(
+                    stream, 3, incremental=True, executor=executor)
+            self.assertEqual(sorted(self.get_raw(messages)),
+                             sorted(self.get_raw(expected)))
+
+    async def test_incremental_error(self):
+        frames = self.get_frames(self.files[0])
+        valid = await self.receive(ENQ + b"".join(frames) + EOT, 1)
+        # a record that can not be wrapped fails the first message only
+        invalid = codec.encode_message(1, [["H", "x"], ["P", "1", "x" * 3]])
+        stream = ENQ + invalid + b"".join(frames) + EOT
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for kw in ({}, {"executor": executor}):
+                with self.assertLogs("senaite.astm", "ERROR") as logs:
+                    messages = await self.receive(
+                        stream, 1, incremental=True, **kw)
+                    # the failed conversion might finish last
+                    await asyncio.sleep(0.1)
+                self.assertEqual(self.get_raw(messages),
+                                 self.get_raw(valid))
+                self.assertIn("Could not convert message", logs.output[-1])
+
+    async def test_spool(self):
+        frames = self.get_frames(self.files[0])
+        stream = ENQ + b"".join(frames) * 2 + EOT
+        tempdir = tempfile.mkdtemp()
+        spool = Spool(os.path.join(tempdir, "spool.db"))
+        try:
+            for kw in ({}, {"incremental": True}):
+                messages = await self.receive(stream, 2, spool=spool, **kw)
+                # the converted messages replaced the raw messages
+                self.assertEqual([e[2] for e in spool.pending()], messages)
+                self.assertEqual(spool.raw(), [])
+                spool.ack(*[e[0] for e in spool.pending()])
+
+            # the raw message is persisted when the instrument ends the
+            # transfer, before it is converted
+            spool.convert = Mock()
+            protocol = ASTMProtocol(spool=spool)
+            await protocol.spool_messages([frames])
+            self.assertEqual(unpack_frames(spool.raw()[0][1]), frames)
+        finally:
+            spool.close()
+            shutil.rmtree(tempdir)
+
+    async def test_spool_conversion_error(self):
+        tempdir = tempfile.mkdtemp()
+        spool = Spool(os.path.join(tempdir, "spool.db"))
+        protocol = ASTMProtocol(spool=spool)
+        try:
+            with self.assertLogs("senaite.astm", "ERROR"):
+                await protocol.spool_messages([[b"invalid"]])
+            # the message is kept for inspection, but never pushed
+            self.assertEqual(spool.count(PARKED), 1)
+            self.assertEqual(len(spool), 0)
+        finally:
+            spool.close()
+            shutil.rmtree(tempdir)
+
+
+class ASTMSenderTest(ASTMTestBase):
+    """Test the sending role of the protocol
+    """
+
+    async def asyncSetUp(self):
+        self.protocol = ASTMProtocol(enq_delay=0)
+        self.transport = MagicMock()
+        self.transport.get_extra_info = Mock(return_value=("127.0.0.1", 1))
+        self.transport.is_closing = Mock(return_value=False)
+        self.protocol.connection_made(self.transport)
+        self.records = [["H", [[None], [None, "&"]]], ["O", "1", "A" * 300],
+                        ["L", "1", "N"]]
+        self.frames = list(codec.iter_encode(self.records, size=247))
+
+    def tearDown(self):
+        self.protocol.cancel_timer()
+
+    def written(self):
+        return [call.args[0] for call in self.transport.write.call_args_list]
+
+    async def test_send_records(self):
+        future = self.protocol.send_records(self.records)
+        self.assertEqual(self.written(), [ENQ])
+        for i in range(len(self.frames)):
+            self.protocol.data_received(ACK)
+        self.assertFalse(future.done())
+        self.protocol.data_received(ACK)
+        self.assertEqual(self.written(), [ENQ] + self.frames + [EOT])
+        self.assertEqual(await future, 4)
+        self.assertEqual(self.protocol.send_state, "idle")
+        # the frames are numbered continuously
+        self.assertEqual([frame[1:2] for frame in self.frames],
+                         [b"1", b"2", b"3", b"4"])
+
+    async def test_retransmit(self):
+        future = self.protocol.send_records(self.records)
+        self.protocol.data_received(ACK)
+        self.protocol.data_received(NAK)
+        self.protocol.data_received(NAK)
+        self.assertEqual(self.written(), [ENQ] + [self.frames[0]] * 3)
+        self.protocol.data_received(ACK)
+        self.assertEqual(self.written()[-1], self.frames[1])
+        # too many NAKs abort the transfer
+        for i in range(6):
+            self.protocol.data_received(NAK)
+        self.assertEqual(self.written()[-1], EOT)
+        with self.assertRaises(NotAccepted):
+            await future
+
+    async def test_busy_receiver(self):
+        future = self.protocol.send_records(self.records)
+        self.protocol.data_received(NAK)
+        self.assertEqual(self.protocol.send_state, "idle")
+        # the ENQ is sent again after the delay
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.written(), [ENQ, ENQ])
+        self.protocol.data_received(ACK)
+        self.assertEqual(self.written()[-1], self.frames[0])
+        future.cancel()
+
+    async def test_contention(self):
+        future = self.protocol.send_records(self.records)
+        # the instrument wants to send at the same time and has priority
+        self.protocol.data_received(ENQ)
+        self.assertEqual(self.written(), [ENQ, ACK])
+        self.assertTrue(self.protocol.in_transfer_state)
+        msg = codec.encode_message(1, [["H"]])
+        self.protocol.data_received(msg)
+        self.protocol.data_received(EOT)
+        # the transfer is sent after the EOT of the instrument
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.written(), [ENQ, ACK, ACK, ENQ])
+        for i in range(len(self.frames) + 1):
+            self.protocol.data_received(ACK)
+        self.assertEqual(await future, 4)
+
+    async def test_queued_transfers(self):
+        first = self.protocol.send_records(self.records)
+        second = self.protocol.send_frames(self.frames[:1])
+        for i in range(len(self.frames) + 1):
+            self.protocol.data_received(ACK)
+        self.assertEqual(await first, 4)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.written()[-1], ENQ)
+        self.protocol.data_received(ACK)
+        self.protocol.data_received(ACK)
+        self.assertEqual(await second, 1)
+
+    async def test_timeout(self):
+        self.protocol.timeout = 0.05
+        first = self.protocol.send_records(self.records)
+        second = self.protocol.send_frames(self.frames[:1])
+        # the instrument does not answer the ENQ
+        with self.assertRaises(TimeoutError):
+            await asyncio.wait_for(first, 1)
+        self.transport.close.assert_not_called()
+        # the line is free for the next transfer
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.written(), [ENQ, EOT, ENQ])
+        self.protocol.data_received(ACK)
+        self.protocol.data_received(ACK)
+        self.assertEqual(await second, 1)
+
+    async def test_connection_lost(self):
+        future = self.protocol.send_records(self.records)
+        self.protocol.connection_lost(None)
+        with self.assertRaises(ConnectionError):
+            await future
+
+    def test_unexpected_ack(self):
+        self.assertRaises(NotAccepted, self.protocol.data_received, ACK)
+
+
+class ASTMTimeoutTest(ASTMTestBase):
+    """Test the connection timeout of the protocol
+    """
+
+    async def asyncSetUp(self):
+        self.protocol = ASTMProtocol(timeout=0.05)
+        self.transport = MagicMock()
+        self.transport.get_extra_info = Mock(return_value=("127.0.0.1", 1))
+        self.protocol.connection_made(self.transport)
+
+    def tearDown(self):
+        self.protocol.cancel_timer()
+
+    async def test_single_timer(self):
+        self.protocol.data_received(ENQ)
+        timer = self.protocol.timer
+        msg = codec.encode_message(1, [["H"]])
+        for i in range(10):
+            self.protocol.data_received(msg)
+        # the received data only moves the deadline
+        self.assertIs(self.protocol.timer, timer)
+        self.assertGreaterEqual(self.protocol.deadline, timer.when())
+
+    async def test_deadline(self):
+        self.protocol.data_received(ENQ)
+        await asyncio.sleep(0.03)
+        self.protocol.data_received(codec.encode_message(1, [["H"]]))
+        # the timer fired before the new deadline and was rescheduled
+        await asyncio.sleep(0.03)
+        self.transport.close.assert_not_called()
+        self.assertIsNotNone(self.protocol.timer)
+        await asyncio.sleep(0.05)
+        self.transport.close.assert_called_once_with()
+        self.assertIsNone(self.protocol.timer)
+
+    async def test_cancel(self):
+        self.protocol.data_received(ENQ)
+        self.protocol.data_received(EOT)
+        self.assertIsNone(self.protocol.timer)
+        await asyncio.sleep(0.06)
+        self.transport.close.assert_not_called()
+
+
+class FrameBufferTest(ASTMTestBase):
+    """Test the incremental framing of received data
+    """
+
+    def test_control_characters(self):
+        buf = FrameBuffer()
+        self.assertEqual(list(buf.feed(ENQ + ENQ + EOT)), [ENQ, ENQ, EOT])
+        self.assertEqual(len(buf), 0)
+
+    def test_split_frame(self):
+        buf = FrameBuffer()
+        frame = b"\x021H|\\^&\r\x03B3"
+        self.assertEqual(list(buf.feed(frame[:4])), [])
+        self.assertEqual(list(buf.feed(frame[4:-1])), [])
+        self.assertEqual(list(buf.feed(frame[-1:] + CRLF + EOT)), [frame, EOT])
+
+    def test_line_endings(self):
+        buf = FrameBuffer()
+        frame = b"\x021H|\\^&\r\x03B3"
+        # line endings are not part of the frame
+        self.assertEqual(list(buf.feed(frame + CRLF)), [frame])
+        self.assertEqual(list(buf.feed(frame)), [frame])
+        self.assertEqual(list(buf.feed(CRLF + ENQ)), [ENQ])
+
+    def test_interrupted_frame(self):
+        buf = FrameBuffer()
+        tokens = list(buf.feed(b"\x021H|\\^&" + EOT))
+        self.assertEqual(tokens, [b"\x021H|\\^&", EOT])
+
+    def test_unknown_data(self):
+        buf = FrameBuffer()
+        tokens = list(buf.feed(b"garbage" + ENQ))
+        self.assertEqual(tokens, [b"garbage", ENQ])
+
+    def test_overflow(self):
+        buf = FrameBuffer(max_size=10)
+        frame = b"\x021H|\\^&\r\x03B3"
+        self.assertEqual(list(buf.feed(b"\x021R|1|")), [])
+        # the frame is cut at the limit and the rest of it is skipped
+        self.assertEqual(list(buf.feed(b"abcdefgh")), [b"\x021R|1|abcd"])
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(list(buf.feed(b"ijk\r\x03C8")), [])
+        self.assertEqual(list(buf.feed(CRLF + frame + EOT)), [frame, EOT])
+
+    def test_overflow_nak(self):
+        protocol = ASTMProtocol()
+        protocol.buffer = FrameBuffer(max_size=10)
+        transport = MagicMock()
+        transport.get_extra_info = Mock(return_value=("127.0.0.1", 1))
+        protocol.connection_made(transport)
+        protocol.data_received(ENQ)
+        with self.assertLogs("senaite.astm", "ERROR"):
+            protocol.data_received(b"\x021R|1|" + b"x" * 100)
+        # the malformed frame is rejected and the instrument can resend it
+        transport.write.assert_called_with(NAK)
+        frame = b"\x021H|\\^&\r\x03E5"
+        protocol.data_received(b"\r\x03C8" + CRLF + frame)
+        transport.write.assert_called_with(ACK)
+        protocol.cancel_timer()
@@ -2,12 +2,18 @@
 
 import asyncio
 import os
+import time
 
+from senaite.astm import codec
 from senaite.astm import logger
 from senaite.astm.constants import ACK
 from senaite.astm.constants import ENQ
+from senaite.astm.constants import MAX_FRAME_SIZE
 from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.simulator import receive_message
 from senaite.astm.tests.base import ASTMTestBase
+from senaite.astm.utils import is_chunked_message
+from senaite.astm.utils import join
 
 
 class ASTMServerTest(ASTMTestBase):
@@ -18,10 +24,15 @@ class ASTMServerTest(ASTMTestBase):
         self.timeout = 15
 
         self.loop = asyncio.get_event_loop()
+        self.protocols = []
         # start the server
         self.server = await self.loop.create_server(
-            lambda: ASTMProtocol(timeout=self.timeout),
-            host=self.HOST, port=self.PORT)
+            self.create_protocol, host=self.HOST, port=self.PORT)
+
+    def create_protocol(self):
+        protocol = ASTMProtocol(timeout=self.timeout)
+        self.protocols.append(protocol)
+        return protocol
 
     async def test_connection_timeout(self):
         """Test connection_timeout
@@ -85,6 +96,50 @@ class ASTMServerTest(ASTMTestBase):
                 self.HOST, self.PORT)
             await self.communicate(data, reader=reader, writer=writer)
 
+    async def test_send_worklist(self):
+        """Download a worklist to a simulated instrument
+        """
+        logger.info("\n------------> TEST: send_worklist")
+        records = [["H", [[None], [None, "&"]], None, None, "LIS"]]
+        for i in range(1, 501):
+            records.append(["P", str(i)])
+            records.append(["O", str(i), "SAMPLE-%04d" % i, None,
+                            [[None, None, None, code]
+                             for code in ("NA", "K", "CL", "GLU", "UREA")],
+                            "R", "20250514121638", "X" * 200])
+        records.append(["L", "1", "N"])
+
+        reader, writer = await asyncio.open_connection(self.HOST, self.PORT)
+        writer.write(ENQ)
+        writer.write(b"\x04")
+        await writer.drain()
+        self.assertEqual(await reader.read(100), ACK)
+        protocol = self.protocols[-1]
+
+        start = time.perf_counter()
+        receiver = asyncio.ensure_future(
+            receive_message(reader, writer, nak=[3]))
+        sent = await protocol.send_records(records)
+        frames = await receiver
+        elapsed = time.perf_counter() - start
+        logger.info("Sent {} frames in {:.3f}s ({:,.0f} frames/s)"
+                    .format(sent, elapsed, sent / elapsed))
+
+        self.assertEqual(len(frames), sent)
+        for frame in frames:
+            self.assertLessEqual(len(frame), MAX_FRAME_SIZE)
+        # join the chunked records and compare them with the worklist
+        received = []
+        chunks = []
+        for frame in frames:
+            chunks.append(frame)
+            if not is_chunked_message(frame):
+                received.extend(codec.decode(join(chunks)))
+                chunks = []
+        self.assertEqual(received, records)
+        writer.close()
+        await writer.wait_closed()
+
     async def asyncTearDown(self):
         logger.info("\n------------> asyncTearDown")
         self.server.close()
@@ -3,17 +3,25 @@
 # Credits to Alexander Shorin:
 # https://github.com/kxepal/python-astm/blob/master/astm/tests/test_codecs.py
 
+import io
 
 from senaite.astm import codec
 from senaite.astm.constants import CR
 from senaite.astm.constants import CRLF
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
 from senaite.astm.constants import ETB
 from senaite.astm.constants import ETX
 from senaite.astm.constants import LF
+from senaite.astm.constants import MAX_FRAME_SIZE
 from senaite.astm.constants import STX
 from senaite.astm.tests.base import ASTMTestBase
 from senaite.astm.utils import is_chunked_message
 from senaite.astm.utils import join
+from senaite.astm.utils import make_chunks
+from senaite.astm.utils import split
+from senaite.astm.utils import split_messages
+from senaite.astm.utils import validate_checksum
 
 
 def u(s):
@@ -185,6 +193,14 @@ class EncodeTestCase(ASTMTestBase):
         res = b"foo||0"
         self.assertEqual(res, codec.encode_record(msg))
 
+    def test_encode_record_with_bytes(self):
+        # pre-encoded values are kept as they are, even if not decodable
+        msg = [b"\xe4", [b"\xff", u"\xe4"], u"\xe4"]
+        self.assertEqual(b"\xe4|\xff^\xc3\xa4|\xc3\xa4",
+                         codec.encode_record(msg, "utf-8"))
+        self.assertRaises(UnicodeEncodeError, codec.encode_record,
+                          [u"\u20ac"], "latin-1")
+
     def test_encode_component(self):
         msg = ["foo", None, 0]
         res = b"foo^^0"
@@ -243,6 +259,48 @@ class ChunkedEncodingTestCase(ASTMTestBase):
         self.assertEqual(res[3], f("{STX}43|boo{CR}{ETX}33{CRLF}"))
         self.assertLessEqual(len(res[3]), 14)
 
+    def test_split_frame_size(self):
+        # the last chunk of the text is full
+        msg = codec.encode_message(1, [["foo", "bar"]], "ascii")
+        chunks = list(split(msg, 14))
+        self.assertEqual(chunks, [f("{STX}1foo|bar{ETB}3D{CRLF}"),
+                                  f("{STX}2{CR}{ETX}42{CRLF}")])
+        self.assertEqual(join(chunks), msg)
+
+    def test_split_frame_numbers(self):
+        msg = codec.encode_message(6, [["A" * 40]], "ascii")
+        chunks = list(split(msg, 17))
+        self.assertEqual([chunk[1:2] for chunk in chunks],
+                         [b"6", b"7", b"0", b"1", b"2"])
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 17)
+            self.assertTrue(validate_checksum(chunk))
+        # a message that fits keeps its sequence number
+        self.assertEqual(list(split(msg, 100)), [msg])
+
+    def test_make_chunks(self):
+        self.assertEqual(make_chunks(b"abcdefg", 3), [b"abc", b"def", b"g"])
+        self.assertEqual(make_chunks(b"abcdef", 3), [b"abc", b"def"])
+        self.assertEqual(make_chunks(b"", 3), [])
+
+    def test_iter_encode_chunks(self):
+        recs = [["R", "1", "A" * 300], ["R", "2", "B"], ["L", "1"]]
+        frames = list(codec.iter_encode(recs, size=MAX_FRAME_SIZE))
+        self.assertEqual(len(frames), 4)
+        self.assertEqual([frame[1:2] for frame in frames],
+                         [b"1", b"2", b"3", b"4"])
+        for frame in frames:
+            self.assertLessEqual(len(frame), MAX_FRAME_SIZE)
+            self.assertTrue(validate_checksum(frame))
+        self.assertTrue(is_chunked_message(frames[0]))
+        self.assertEqual(codec.decode(join(frames[:2])), [recs[0]])
+        self.assertEqual(codec.decode(frames[2]), [recs[1]])
+
+    def test_iter_encode_generator(self):
+        recs = (["R", str(i), "A" * i] for i in range(1, 100))
+        frames = codec.iter_encode(recs, size=64)
+        self.assertEqual(next(frames)[:8], f("{STX}1R|1|A{CR}"))
+
     def test_decode_chunks(self):
         recs = [["foo", 1], ["bar", 24], ["baz", [1, 2, 3], "boo"]]
         res = codec.encode(recs, size=14)
@@ -265,3 +323,178 @@ class ChunkedEncodingTestCase(ASTMTestBase):
 
         msg = f("{STX}2A|0{CR}{ETX}2F{CRLF}")
         self.assertFalse(is_chunked_message(msg))
+
+
+class SplitMessagesTestCase(ASTMTestBase):
+    """Test the splitting of a session into messages
+    """
+
+    def test_split_messages(self):
+        h1 = b"\x021H|\\^&\r\x03XX"
+        r1 = b"\x022R|1\r\x03XX"
+        l1 = b"\x023L|1\r\x03XX"
+        h2 = b"\x024H|\\^&\r\x03XX"
+        l2 = b"\x025L|1\r\x03XX"
+        self.assertEqual(split_messages([]), [])
+        self.assertEqual(split_messages([h1, r1, l1]), [[h1, r1, l1]])
+        self.assertEqual(split_messages([h1, r1, l1, h2, l2]),
+                         [[h1, r1, l1], [h2, l2]])
+        # frames before the first header belong to the first message
+        self.assertEqual(split_messages([r1, h2, l2]), [[r1, h2, l2]])
+
+
+class IncrementalDecoderTestCase(ASTMTestBase):
+    """Test the decoding of a stream of frames record by record
+    """
+    def setUp(self):
+        self.recs = [["foo", "1"], ["bar", "24"], ["baz", ["1", "2", "3"], "boo"]]
+        self.chunks = codec.encode(self.recs, size=14)
+
+    def test_feed_bytes(self):
+        decoder = codec.IncrementalDecoder()
+        data = ENQ + b"".join(self.chunks) + EOT
+        records = []
+        for i in range(len(data)):
+            records.extend(decoder.feed(data[i:i + 1]))
+        self.assertEqual(records, self.recs)
+        self.assertEqual(decoder.pending, b"")
+
+    def test_yield_complete_records(self):
+        decoder = codec.IncrementalDecoder()
+        # the records are yielded before the last frame of the message
+        self.assertEqual(list(decoder.feed(self.chunks[0])), [self.recs[0]])
+        self.assertEqual(list(decoder.feed(self.chunks[1])), [self.recs[1]])
+        self.assertEqual(list(decoder.feed(self.chunks[2])), [])
+        self.assertEqual(decoder.pending, b"baz|1^2^")
+        self.assertEqual(list(decoder.feed(self.chunks[3])), [self.recs[2]])
+
+    def test_eot_discards_pending_record(self):
+        decoder = codec.IncrementalDecoder()
+        list(decoder.feed(self.chunks[0] + EOT))
+        self.assertEqual(decoder.pending, b"")
+        msg = f("{STX}1A|0{CR}{ETX}2E{CRLF}")
+        self.assertEqual(list(decoder.feed(msg)), [["A", "0"]])
+
+    def test_wrong_checksum(self):
+        decoder = codec.IncrementalDecoder()
+        msg = f("{STX}1A|0{CR}{ETX}00{CRLF}")
+        self.assertRaises(ValueError, list, decoder.feed(msg))
+        # the decoding continues with the next frame
+        msg = f("{STX}2A|0{CR}{ETX}2F{CRLF}")
+        self.assertEqual(list(decoder.feed(msg)), [["A", "0"]])
+
+    def test_malformed_frame(self):
+        decoder = codec.IncrementalDecoder()
+        msg = f("{STX}A|0{CR}{ETX}FE{CRLF}")
+        self.assertRaises(ValueError, list, decoder.feed(msg))
+
+    def test_decode_stream(self):
+        for path in self.instrument_files:
+            expected = []
+            chunks = []
+            for frame in filter(None, self.read_file_lines(path)):
+                chunks.append(frame)
+                if not is_chunked_message(frame):
+                    expected.extend(codec.decode(join(chunks)))
+                    chunks = []
+            with open(path, "rb") as stream:
+                records = list(codec.decode_stream(stream, size=7))
+            self.assertEqual(records, expected, path)
+
+    def test_decode_stream_chunks(self):
+        stream = io.BytesIO(b"".join(self.chunks))
+        self.assertEqual(list(codec.decode_stream(stream, size=1)), self.recs)
+
+
+class DelimitersTestCase(ASTMTestBase):
+    """Test the delimiters declared by the header record
+    """
+    def test_get_delimiters(self):
+        delimiters = codec.get_delimiters(b"H|@^\\|URM-8lT4abZA-06||")
+        self.assertEqual(delimiters.to_bytes(), b"|@^\\")
+        self.assertEqual(delimiters.repeat, b"@")
+        self.assertEqual(delimiters.escape, b"\\")
+        # frames and messages
+        self.assertEqual(codec.get_delimiters(b"\x021H|@^\\|"), delimiters)
+        self.assertEqual(codec.get_delimiters(b"1H|@^\\|"), delimiters)
+
+    def test_default_delimiters(self):
+        default = codec.DEFAULT_DELIMITERS
+        self.assertIs(codec.get_delimiters(b"H|\\^&|||"), default)
+        self.assertIs(codec.get_delimiters(b"P|1||"), default)
+        self.assertIs(codec.get_delimiters(b"H|\\\\^&"), default)
+        self.assertIs(codec.get_delimiters(b"H|ab^"), default)
+        self.assertIs(codec.get_delimiters(b"H"), default)
+
+    def test_decode_with_header_delimiters(self):
+        frame = b"1H|@^\\|12X\rR|1|^A\\B@C^D\r\x03"
+        msg = STX + frame + codec.make_checksum(frame) + CRLF
+        records = codec.decode(msg)
+        self.assertEqual(records[0], ["H", [[None], [None, "\\"]], "12X"])
+        self.assertEqual(records[1], ["R", "1", [[None, "A\\B"], ["C", "D"]]])
+
+    def test_decode_with_delimiters(self):
+        delimiters = codec.get_delimiters(b"H|@^\\|")
+        record = b"R|1|^A\\B^|x@y"
+        self.assertEqual(codec.decode(record, delimiters=delimiters),
+                         [["R", "1", [None, "A\\B", None], [["x"], ["y"]]]])
+        self.assertEqual(codec.decode(record),
+                         [["R", "1", [[None, "A"], ["B", None]], "x@y"]])
+
+    def test_incremental_decoder(self):
+        decoder = codec.IncrementalDecoder()
+        data = b""
+        for frame in (b"1H|@^\\|12X\r\x03", b"2R|1|^A\\B@C\r\x03"):
+            data += STX + frame + codec.make_checksum(frame) + CRLF
+        records = list(decoder.feed(data))
+        self.assertEqual(records[1], ["R", "1", [[None, "A\\B"], ["C"]]])
+        # the standard delimiters are used after the end of the transfer
+        list(decoder.feed(EOT))
+        self.assertEqual(decoder.delimiters, codec.DEFAULT_DELIMITERS)
+
+
+class LazyDecodeTestCase(ASTMTestBase):
+    """Test the lazy record views
+    """
+    def test_decode_lazy(self):
+        msg = f("{STX}1A|B^C||D\\E^F{CR}G|1{CR}{ETX}2D{CRLF}")
+        msg = msg[:-4] + codec.make_checksum(msg[1:-4]) + CRLF
+        records = codec.decode_lazy(msg)
+        self.assertEqual(records, codec.decode(msg))
+        record = records[0]
+        self.assertIsInstance(record, codec.RecordView)
+        self.assertEqual(len(record), 4)
+        self.assertEqual(record[0], "A")
+        self.assertEqual(record[1], ["B", "C"])
+        self.assertEqual(record[2], None)
+        self.assertEqual(record[-1], [["D"], ["E", "F"]])
+        self.assertEqual(record[1:3], [["B", "C"], None])
+        self.assertRaises(IndexError, record.__getitem__, 4)
+        self.assertEqual(records[1].tolist(), ["G", "1"])
+
+    def test_decode_lazy_frames_and_records(self):
+        for data in (b"A|B^C|D\\E^F", b"1A|0\r\x17", b"1A|0\rB\r\x03"):
+            self.assertEqual(codec.decode_lazy(data), codec.decode(data))
+
+    def test_decode_lazy_shares_data(self):
+        msg = codec.encode_message(1, [["A", "0"], ["B", "1"]], "ascii")
+        first, second = codec.decode_lazy(msg)
+        self.assertIs(first.data, msg)
+        self.assertIs(first.view, second.view)
+
+    def test_decode_lazy_errors(self):
+        self.assertRaises(AssertionError, codec.decode_lazy,
+                          f("{STX}1A|0{CR}{ETX}00{CRLF}"))
+        self.assertRaises(ValueError, codec.decode_lazy, b"1A|0")
+        self.assertRaises(TypeError, codec.decode_lazy, u"A|0")
+
+    def test_decode_lazy_instrument_files(self):
+        for path in self.instrument_files:
+            messages = list(filter(None, self.read_file_lines(path)))
+            delimiters = codec.get_delimiters(messages[0])
+            for message in messages:
+                if is_chunked_message(message):
+                    continue
+                records = codec.decode_lazy(message, delimiters=delimiters)
+                self.assertEqual(
+                    records, codec.decode(message, delimiters=delimiters))
@@ -3,9 +3,13 @@
 # Credits to Alexander Shorin:
 # https://github.com/kxepal/python-astm
 
+import base64
 import datetime
 import decimal
+import json
+import struct
 import warnings
+import zlib
 
 from senaite.astm import fields
 from senaite.astm.compat import u
@@ -151,7 +155,7 @@ class TextFieldTestCase(ASTMTestBase):
     def test_raw_value(self):
         obj = self.Dummy()
         obj.field = u("привет")
-        self.assertEqual(obj._data["field"], u("привет"))
+        self.assertEqual(obj._f_field, u("привет"))
 
 
 class DateFieldTestCase(ASTMTestBase):
@@ -185,7 +189,7 @@ class DateFieldTestCase(ASTMTestBase):
     def test_raw_value(self):
         obj = self.Dummy()
         obj.field = self.datetime
-        self.assertEqual(obj._data["field"],
+        self.assertEqual(obj._f_field,
                          self.date.strftime(obj._fields[0][1].format))
 
     def test_set_string_value(self):
@@ -193,6 +197,13 @@ class DateFieldTestCase(ASTMTestBase):
         obj.field = "20090213"
         self.assertRaises(ValueError, setattr, obj, "field", "1234567")
 
+    def test_memo(self):
+        obj = self.Dummy(field="20230324")
+        self.assertIn("20230324", fields.DateField.memo)
+        self.assertEqual(obj._f_field, "20230324")
+        self.assertRaises(ValueError, setattr, obj, "field", "20230230")
+        self.assertNotIn("20230230", fields.DateField.memo)
+
 
 class TimeFieldTestCase(ASTMTestBase):
     """Test time field
@@ -225,7 +236,7 @@ class TimeFieldTestCase(ASTMTestBase):
     def test_raw_value(self):
         obj = self.Dummy()
         obj.field = self.datetime
-        self.assertEqual(obj._data["field"],
+        self.assertEqual(obj._f_field,
                          self.time.strftime(obj._fields[0][1].format))
 
     def test_set_string_value(self):
@@ -233,6 +244,10 @@ class TimeFieldTestCase(ASTMTestBase):
         obj.field = "111213"
         self.assertRaises(ValueError, setattr, obj, "field", "314159")
 
+    def test_strip_microseconds(self):
+        obj = self.Dummy(field="111213.456")
+        self.assertEqual(obj._f_field, "111213")
+
 
 class DatetimeFieldTestCase(ASTMTestBase):
     """Test datetime field
@@ -265,7 +280,7 @@ class DatetimeFieldTestCase(ASTMTestBase):
     def test_raw_value(self):
         obj = self.Dummy()
         obj.field = self.datetime
-        self.assertEqual(obj._data["field"],
+        self.assertEqual(obj._f_field,
                          self.datetime.strftime(obj._fields[0][1].format))
 
     def test_set_string_value(self):
@@ -273,6 +288,23 @@ class DatetimeFieldTestCase(ASTMTestBase):
         obj.field = "20090213233130"
         self.assertRaises(ValueError, setattr, obj, "field", "12345678901234")
 
+    def test_memo(self):
+        obj = self.Dummy(field="20230324135102")
+        self.assertIn("20230324135102", fields.DateTimeField.memo)
+        obj.field = "20230324135102"
+        self.assertEqual(obj._f_field, "20230324135102")
+        self.assertRaises(ValueError, setattr, obj, "field", "20230324135160")
+
+    def test_custom_format(self):
+        class MinuteField(fields.DateTimeField):
+            format = "%Y%m%d%H%M"
+
+        class Dummy(Mapping):
+            field = MinuteField()
+        obj = Dummy(field="202303241351")
+        self.assertEqual(obj._f_field, "202303241351")
+        self.assertRaises(ValueError, setattr, obj, "field", "20230324135102")
+
 
 class ConstantFieldTestCase(ASTMTestBase):
     """Test constant field
@@ -311,14 +343,14 @@ class ConstantFieldTestCase(ASTMTestBase):
             field = fields.ConstantField(default="foo")
         obj = Dummy()
         obj.field = "foo"
-        self.assertEqual(obj._data["field"], "foo")
+        self.assertEqual(obj._f_field, "foo")
 
     def test_raw_value_should_be_string(self):
         class Dummy(Mapping):
             field = fields.ConstantField(default=42)
         obj = Dummy()
         obj.field = 42
-        self.assertEqual(obj._data["field"], "42")
+        self.assertEqual(obj._f_field, "42")
 
     def test_always_required(self):
         field = fields.ConstantField(default="test")
@@ -365,16 +397,16 @@ class SetFieldTestCase(ASTMTestBase):
                                     field=fields.IntegerField())
         obj = Dummy()
         obj.field = 1
-        self.assertEqual(obj._data["field"], "1")
+        self.assertEqual(obj._f_field, "1")
         obj.field = 2
-        self.assertEqual(obj._data["field"], "2")
+        self.assertEqual(obj._f_field, "2")
         obj.field = 3
-        self.assertEqual(obj._data["field"], "3")
+        self.assertEqual(obj._f_field, "3")
 
     def test_raw_value(self):
         obj = self.Dummy()
         obj.field = "foo"
-        self.assertEqual(obj._data["field"], "foo")
+        self.assertEqual(obj._f_field, "foo")
 
 
 class ComponentFieldTestCase(ASTMTestBase):
@@ -409,7 +441,7 @@ class ComponentFieldTestCase(ASTMTestBase):
     def test_raw_value(self):
         obj = self.Dummy()
         obj.field = ["foo", 14, "42"]
-        self.assertEqual(obj._data["field"], ["foo", 14, "42"])
+        self.assertEqual(obj._f_field, ["foo", 14, "42"])
 
     def test_set_string_value(self):
         obj = self.Dummy()
@@ -661,3 +693,74 @@ class RepeatedComponentFieldTestCase(ASTMTestBase):
         obj = self.Thing(numbers=[[1], [2], [3]])
         obj.numbers *= 0
         self.assertEqual(obj.numbers, [])
+
+
+class NestedListFieldTestCase(ASTMTestBase):
+    """Test the field for repeated components
+    """
+    def setUp(self):
+        class Dummy(Mapping):
+            field = fields.NestedListField()
+        self.Dummy = Dummy
+
+    def test_set_value(self):
+        obj = self.Dummy(field=[["A", 1], [None, "B"]])
+        self.assertEqual(obj.field, [["A", "1"], [None, "B"]])
+        self.assertEqual(obj.to_dict()["field"], [["A", "1"], [None, "B"]])
+        obj.field = "text"
+        self.assertEqual(obj.field, "text")
+
+
+class FloatArrayFieldTestCase(ASTMTestBase):
+    """Test binary encoded float array field
+    """
+    def setUp(self):
+        class Dummy(Mapping):
+            field = fields.FloatArrayField()
+            summary = fields.FloatArrayField(size=2)
+        self.Dummy = Dummy
+
+    def encode(self, values):
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        raw = struct.pack("<%df" % len(values), *values)
+        data = compressor.compress(raw) + compressor.flush()
+        return [fields.FLOATLE_DEFLATE_BASE64,
+                base64.b64encode(data).decode("ascii")]
+
+    def test_set_value(self):
+        obj = self.Dummy(field=self.encode([0.5, 1.0, -2.25]))
+        self.assertEqual(obj.field, [0.5, 1.0, -2.25])
+        self.assertEqual(obj.to_dict()["field"], [0.5, 1.0, -2.25])
+
+    def test_downsample(self):
+        obj = self.Dummy(summary=self.encode([1, 2, 3, 4, 5]))
+        self.assertEqual(obj.summary, [1.5, 4.0])
+
+    def test_float32_values(self):
+        obj = self.Dummy(field=self.encode([0.1, 1 / 3.0, 123456.789]))
+        # no double precision noise of the single precision values
+        self.assertEqual(obj.field, [0.1, 0.3333333, 123456.8])
+        obj = self.Dummy(summary=self.encode([0.1, 0.2, 0.3, 0.4]))
+        self.assertEqual(obj.summary, [0.15, 0.35])
+
+    def test_non_finite_values(self):
+        nan, inf = float("nan"), float("inf")
+        obj = self.Dummy(field=self.encode([nan, inf, -inf, 1.0]))
+        self.assertEqual(obj.field, [None, None, None, 1.0])
+        self.assertEqual(json.loads(json.dumps(obj.to_dict()))["field"],
+                         [None, None, None, 1.0])
+
+    def test_empty_data(self):
+        obj = self.Dummy(field=[fields.FLOATLE_DEFLATE_BASE64, ""])
+        self.assertEqual(obj.field, [])
+
+    def test_other_values_are_kept(self):
+        obj = self.Dummy(field="foo")
+        self.assertEqual(obj.field, "foo")
+        obj.field = ["OTHER-stream", "bar"]
+        self.assertEqual(obj.field, ["OTHER-stream", "bar"])
+
+    def test_invalid_data(self):
+        obj = self.Dummy()
+        with self.assertRaises(ValueError):
+            obj.field = [fields.FLOATLE_DEFLATE_BASE64, "Zm9vYmFy"]
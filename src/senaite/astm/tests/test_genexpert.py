@@ -85,6 +85,9 @@ class GeneXpert(ASTMTestBase):
         self.assertEqual(record["receiver"], "HNH-SENAITE")
         self.assertEqual(record["version"], "1394-97")
         self.assertEqual(record["processing_id"], "P")
+        # decoded with the declared delimiters |@^\
+        self.assertEqual(record["delimeter"], [
+            {"_": "", "__": None}, {"_": "", "__": "\\"}])
 
     def test_genexpert_order_record(self):
         """Test the Order Record wrapper
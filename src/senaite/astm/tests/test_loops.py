@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest import TestCase
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from senaite.astm import loops
+
+
+class EventLoopPolicyTest(TestCase):
+    """Test the selection of the event loop implementation
+    """
+
+    def setUp(self):
+        self.policy = asyncio.get_event_loop_policy()
+
+    def tearDown(self):
+        asyncio.set_event_loop_policy(self.policy)
+
+    def test_default(self):
+        name, policy = loops.get_event_loop_policy()
+        self.assertEqual(name, "asyncio")
+        self.assertIsInstance(policy, asyncio.DefaultEventLoopPolicy)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, loops.get_event_loop_policy, "tokio")
+
+    def test_uvloop(self):
+        uvloop = Mock()
+        with patch.object(loops, "uvloop", uvloop):
+            name, policy = loops.get_event_loop_policy("uvloop")
+        self.assertEqual(name, "uvloop")
+        self.assertIs(policy, uvloop.EventLoopPolicy.return_value)
+
+    def test_uvloop_fallback(self):
+        with patch.object(loops, "uvloop", None):
+            name, policy = loops.get_event_loop_policy("uvloop")
+        self.assertEqual(name, "asyncio")
+        self.assertIsInstance(policy, asyncio.DefaultEventLoopPolicy)
+
+    def test_install(self):
+        with patch.object(loops, "uvloop", None):
+            self.assertEqual(loops.install_event_loop_policy("uvloop"),
+                             "asyncio")
+        policy = asyncio.get_event_loop_policy()
+        self.assertIsNot(policy, self.policy)
+        self.assertIsInstance(policy, asyncio.DefaultEventLoopPolicy)
@@ -3,9 +3,13 @@
 # Credits to Alexander Shorin:
 # https://github.com/kxepal/python-astm
 
+import warnings
+
 from senaite.astm import fields
 from senaite.astm.mapping import Component
 from senaite.astm.mapping import Mapping
+from senaite.astm.mapping import Record
+from senaite.astm.mapping import get_trusted
 from senaite.astm.tests.base import ASTMTestBase
 
 
@@ -84,3 +88,174 @@ class MappingTestCase(ASTMTestBase):
         obj.field = None
         obj.field = "-" * 10
         self.assertRaises(ValueError, setattr, obj, "field", "-" * 11)
+
+
+class CompiledMappingTestCase(ASTMTestBase):
+
+    def setUp(self):
+        self.Dummy = Record.build(
+            fields.ConstantField(name="type", default="D"),
+            fields.IntegerField(name="seq", default=1),
+            fields.Field(name="foo", default=lambda: "bar"),
+            fields.ComponentField(name="bar", mapping=Component.build(
+                fields.IntegerField(name="a"),
+                fields.IntegerField(name="b"),
+            )),
+            fields.Field(name="baz", required=True),
+            compiled=True,
+        )
+        self.Generic = Record.build(*[f for n, f in self.Dummy._fields])
+
+    def test_compiled(self):
+        self.assertEqual(self.Dummy.__init__.__code__.co_filename,
+                         "<GenericRecord.__init__>")
+        self.assertIs(self.Generic.__init__, Mapping.__init__)
+
+    def test_slots(self):
+        obj = self.Dummy()
+        self.assertFalse(hasattr(obj, "__dict__"))
+        self.assertRaises(AttributeError, setattr, obj, "unknown", 1)
+        self.assertEqual(obj._f_seq, "1")
+        self.assertTrue(hasattr(self.Generic(), "__dict__"))
+
+    def test_same_values(self):
+        args = ("D", 2, "foo", [1, 2], "x")
+        self.assertEqual(self.Dummy(*args), self.Generic(*args))
+        self.assertEqual(self.Dummy(), self.Generic())
+        self.assertEqual(self.Dummy(*args).to_dict(),
+                         self.Generic(*args).to_dict())
+
+    def test_keyword_arguments(self):
+        obj = self.Dummy("D", 2, foo="spam", baz="x")
+        self.assertEqual(obj.seq, 2)
+        self.assertEqual(obj.foo, "spam")
+        self.assertEqual(obj.baz, "x")
+
+    def test_defaults(self):
+        obj = self.Dummy()
+        self.assertEqual(obj.type, "D")
+        self.assertEqual(obj.seq, 1)
+        self.assertEqual(obj.foo, "bar")
+        self.assertRaises(ValueError, obj.to_astm)
+
+    def test_validation(self):
+        self.assertRaises(ValueError, self.Dummy, "X")
+        self.assertRaises(TypeError, self.Dummy, "D", "one")
+
+    def test_unexpected_arguments(self):
+        args = ("D", 1, "foo", None, "x", "y")
+        self.assertRaises(ValueError, self.Dummy, *args)
+        self.assertRaises(ValueError, self.Dummy, spam="eggs")
+
+    def test_subclass_is_compiled(self):
+        class Thing(self.Dummy):
+            baz = fields.IntegerField()
+            extra = fields.Field()
+        obj = Thing("D", 1, "foo", None, "42", "extra")
+        self.assertIn("__init__", Thing.__dict__)
+        self.assertEqual(obj.baz, 42)
+        self.assertEqual(obj.extra, "extra")
+
+
+class SerializerTestCase(ASTMTestBase):
+
+    def setUp(self):
+        class Dummy(Mapping):
+            foo = fields.Field()
+            bar = fields.ComponentField(mapping=Component.build(
+                fields.IntegerField(name="a"),
+                fields.IntegerField(name="b", required=True),
+            ))
+            numbers = fields.RepeatedComponentField(Component.build(
+                fields.IntegerField(name="a"),
+            ))
+            raw = fields.FloatArrayField()
+        self.Dummy = Dummy
+
+    def test_to_dict(self):
+        obj = self.Dummy("foo", [1, 2], [[3], [4]], [0.5, 1.5])
+        self.assertEqual(obj.to_dict(), {
+            "foo": "foo",
+            "bar": {"a": "1", "b": "2"},
+            "numbers": [{"a": "3"}, {"a": "4"}],
+            "raw": [0.5, 1.5],
+        })
+
+    def test_to_astm(self):
+        obj = self.Dummy("foo", [1, 2], [[3], [4]], "raw")
+        self.assertEqual(obj.to_astm(),
+                         ["foo", ["1", "2"], [["3"], ["4"]], "raw"])
+
+    def test_serializer_is_cached(self):
+        obj = self.Dummy("foo", [1, 2])
+        obj.to_dict()
+        serializer = self.Dummy.__dict__["_to_dict"]
+        obj.to_dict()
+        self.assertTrue(self.Dummy.__dict__["_to_dict"] is serializer)
+
+    def test_subclass_serializer(self):
+        obj = self.Dummy("foo", [1, 2])
+        obj.to_dict()
+
+        class Thing(self.Dummy):
+            extra = fields.Field(required=True)
+        obj = Thing("foo", [1, 2], extra="extra")
+        self.assertEqual(obj.to_dict()["extra"], "extra")
+        obj.extra = None
+        self.assertRaises(ValueError, obj.to_dict)
+
+    def test_required_component_field(self):
+        obj = self.Dummy("foo", [1])
+        self.assertRaises(ValueError, obj.to_dict)
+        self.assertRaises(ValueError, obj.to_astm)
+
+
+class TrustedMappingTestCase(ASTMTestBase):
+
+    def setUp(self):
+        self.Dummy = Record.build(
+            fields.ConstantField(name="type", default="D"),
+            fields.NotUsedField(name="unused"),
+            fields.SetField(name="flag", values=("H", "L")),
+            fields.SetField(name="number", values=(1, 2),
+                            field=fields.IntegerField()),
+            fields.ComponentField(name="bar", mapping=Component.build(
+                fields.NotUsedField(name="a"),
+                fields.SetField(name="b", values=("X",)),
+            )),
+            fields.RepeatedComponentField(name="items", field=Component.build(
+                fields.SetField(name="c", values=("Y",)),
+            )),
+            compiled=True,
+        )
+        self.Trusted = get_trusted(self.Dummy)
+
+    def test_trusted_variant(self):
+        self.assertTrue(issubclass(self.Trusted, self.Dummy))
+        self.assertTrue(get_trusted(self.Dummy) is self.Trusted)
+        self.assertTrue(get_trusted(self.Trusted) is self.Trusted)
+        self.assertEqual(self.Trusted.__name__, self.Dummy.__name__)
+
+    def test_same_values(self):
+        args = ("D", None, "H", "2", ["", "X"], [["Y"], ["Y"]])
+        self.assertEqual(self.Trusted(*args).to_dict(),
+                         self.Dummy(*args).to_dict())
+        self.assertEqual(self.Trusted().to_dict(), self.Dummy().to_dict())
+
+    def test_no_warnings(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            obj = self.Trusted("D", "unused", "H", None, ["a", "X"])
+        self.assertIsNone(obj.unused)
+        self.assertIsNone(obj.bar.a)
+
+    def test_sets_are_not_checked(self):
+        obj = self.Trusted("D", None, "N", None, ["", "Z"], [["Z"]])
+        self.assertEqual(obj.flag, "N")
+        self.assertEqual(obj.bar.b, "Z")
+        self.assertEqual(obj.items[0].c, "Z")
+        self.assertRaises(ValueError, self.Dummy, "D", None, "N")
+
+    def test_other_fields_are_checked(self):
+        self.assertRaises(ValueError, self.Trusted, "X")
+        self.assertRaises(ValueError, self.Trusted, "D", None, "H", "3")
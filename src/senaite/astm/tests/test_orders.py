@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import Mock
+
+from senaite.astm import codec
+from senaite.astm.constants import ACK
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
+from senaite.astm.orders import OrderCache
+from senaite.astm.orders import QueryResponder
+from senaite.astm.orders import get_sample_ids
+from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.tests.base import ASTMTestBase
+
+ORDERS = {
+    "WB-0001": ["NA", "K", "CL"],
+    "WB-0002": ["GLU"],
+}
+
+
+class OrderCacheTest(TestCase):
+    """Test the local cache of the open orders
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "orders.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_lookup(self):
+        cache = OrderCache()
+        self.assertIsNone(cache.get("WB-0001"))
+        cache.update(ORDERS)
+        self.assertEqual(len(cache), 2)
+        self.assertIn("WB-0001", cache)
+        self.assertEqual(cache.get("WB-0001"), ["NA", "K", "CL"])
+        self.assertIsNone(cache.get("WB-0003"))
+
+    def test_update_replaces_orders(self):
+        cache = OrderCache()
+        cache.update(ORDERS)
+        cache.update({"WB-0003": ["HGB"], "WB-0004": []})
+        # orders without tests are dropped
+        self.assertEqual(cache.orders, {"WB-0003": ["HGB"]})
+
+    def test_refresh(self):
+        cache = OrderCache()
+        self.assertTrue(cache.refresh(lambda: ORDERS))
+        self.assertEqual(len(cache), 2)
+        # the orders are kept if SENAITE is not reachable
+        self.assertFalse(cache.refresh(lambda: None))
+        self.assertEqual(cache.orders, ORDERS)
+
+    def test_persistence(self):
+        cache = OrderCache(self.path)
+        cache.update(ORDERS)
+        cache.close()
+        cache = OrderCache(self.path)
+        self.assertEqual(cache.orders, ORDERS)
+        cache.update({})
+        cache.close()
+        self.assertEqual(len(OrderCache(self.path)), 0)
+
+    def test_reload(self):
+        cache = OrderCache(self.path)
+        reader = OrderCache(self.path)
+        self.assertFalse(reader.reload())
+        cache.update(ORDERS)
+        # the orders of another connection are loaded once
+        self.assertTrue(reader.reload())
+        self.assertEqual(reader.orders, ORDERS)
+        self.assertFalse(reader.reload())
+        cache.close()
+        reader.close()
+
+
+class QueryResponderTest(TestCase):
+    """Test the answers to the host queries
+    """
+
+    def setUp(self):
+        cache = OrderCache()
+        cache.update(ORDERS)
+        self.responder = QueryResponder(cache)
+
+    def decode(self, record):
+        return codec.decode_record(record)
+
+    def test_sample_ids(self):
+        # LIS2-A2: specimen ID as second component
+        self.assertEqual(
+            get_sample_ids(self.decode(b"Q|1|^WB-0001||^^^ALL")),
+            ["WB-0001"])
+        # cobas: sample ID as third component
+        self.assertEqual(
+            get_sample_ids(self.decode(
+                b"Q|1|^^WB-0001^0^50001^001^^S1^SC||ALL||||||||O")),
+            ["WB-0001"])
+        # plain sample ID
+        self.assertEqual(
+            get_sample_ids(self.decode(b"Q|1|WB-0001")), ["WB-0001"])
+        # repeated sample IDs
+        self.assertEqual(
+            get_sample_ids(self.decode(b"Q|1|^WB-0001\\^WB-0002")),
+            ["WB-0001", "WB-0002"])
+        # all samples are not supported
+        self.assertEqual(get_sample_ids(self.decode(b"Q|1|ALL")), [])
+        self.assertEqual(get_sample_ids(self.decode(b"Q|1")), [])
+
+    def test_is_query(self):
+        header = b"\x021H|\\^&\r"
+        self.assertFalse(self.responder.is_query(header + b"L|1\r\x03"))
+        self.assertTrue(self.responder.is_query(header + b"Q|1\r\x03"))
+        self.assertTrue(self.responder.is_query(b"\x022Q|1\r\x03"))
+
+    def test_respond(self):
+        queries = [self.decode(b"Q|1|^WB-0001\\^WB-0003"),
+                   self.decode(b"Q|2|^WB-0002")]
+        records = self.responder.respond(queries)
+        self.assertEqual([record[0] for record in records],
+                         ["H", "P", "O", "P", "O", "L"])
+        order = records[2]
+        self.assertEqual(order[2], "WB-0001")
+        self.assertEqual(order[4], [[None, None, None, "NA"],
+                                    [None, None, None, "K"],
+                                    [None, None, None, "CL"]])
+        self.assertEqual(order[11], "N")
+        self.assertEqual(order[25], "O")
+        self.assertEqual(records[4][2], "WB-0002")
+        self.assertEqual(records[-1], ["L", "1", "N"])
+        # the answer can be encoded
+        self.assertTrue(codec.iter_encode(records, size=247))
+
+    def test_respond_unknown(self):
+        records = self.responder.respond([self.decode(b"Q|1|^WB-0003")])
+        self.assertEqual([record[0] for record in records], ["H", "L"])
+        self.assertEqual(records[-1], ["L", "1", "I"])
+
+
+class QueryProtocolTest(ASTMTestBase):
+    """Test the answers to the host queries of a connected instrument
+    """
+
+    async def asyncSetUp(self):
+        cache = OrderCache()
+        cache.update(ORDERS)
+        self.queue = asyncio.Queue()
+        self.protocol = ASTMProtocol(
+            queue=self.queue, responder=QueryResponder(cache))
+        self.transport = MagicMock()
+        self.transport.get_extra_info = Mock(return_value=("127.0.0.1", 1))
+        self.transport.is_closing = Mock(return_value=False)
+        self.protocol.connection_made(self.transport)
+
+    def tearDown(self):
+        self.protocol.cancel_timer()
+
+    def written(self):
+        return [call.args[0] for call in self.transport.write.call_args_list]
+
+    def send_message(self, records):
+        self.protocol.data_received(ENQ)
+        self.protocol.data_received(codec.encode_message(1, records))
+        self.protocol.data_received(EOT)
+
+    async def test_answer_query(self):
+        self.send_message([["H", [[None], [None, "&"]]],
+                           ["Q", "1", [None, "WB-0001"]],
+                           ["L", "1"]])
+        # the answer is established right after the EOT
+        self.assertEqual(self.written(), [ACK, ACK, ENQ])
+        records = []
+        while self.protocol.send_state != "idle":
+            self.protocol.data_received(ACK)
+            frame = self.written()[-1]
+            if frame != EOT:
+                records.extend(codec.decode(frame))
+        self.assertEqual([record[0] for record in records],
+                         ["H", "P", "O", "L"])
+        self.assertEqual(records[2][2], "WB-0001")
+        self.assertEqual(self.written()[-1], EOT)
+        # the query is forwarded to SENAITE as well
+        self.assertEqual(self.queue.qsize(), 1)
+
+    async def test_no_query(self):
+        self.send_message([["H", [[None], [None, "&"]]], ["L", "1"]])
+        self.assertEqual(self.written(), [ACK, ACK])
+        self.assertEqual(self.protocol.send_state, "idle")
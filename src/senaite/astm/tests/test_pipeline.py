@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest.mock import MagicMock
+from unittest.mock import Mock
+
+from senaite.astm.constants import ACK
+from senaite.astm.constants import CRLF
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
+from senaite.astm.constants import NAK
+from senaite.astm.pipeline import Pipeline
+from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.tests.base import ASTMTestBase
+
+
+class PipelineTest(ASTMTestBase):
+    """Test the bounded pipeline and the ACK backpressure
+    """
+
+    def get_mock_transport(self, ip="127.0.0.1", port=12345):
+        transport = MagicMock()
+        transport.get_extra_info = Mock(return_value=(ip, port))
+        transport.is_closing = Mock(return_value=False)
+        return transport
+
+    def get_responses(self, transport):
+        return [c.args[0] for c in transport.write.call_args_list]
+
+    def get_session(self, filename):
+        path = self.get_instrument_file_path(filename)
+        frames = [line.strip(CRLF) for line in self.read_file_lines(path)]
+        return ENQ + b"".join(f + CRLF for f in frames) + EOT, frames
+
+    async def test_saturation(self):
+        pipeline = Pipeline(queue_size=1, max_tasks=1)
+        self.assertFalse(pipeline.is_saturated())
+        pipeline.put(b"1")
+        self.assertTrue(pipeline.is_saturated())
+        self.assertEqual(pipeline.queue.get_nowait(), b"1")
+        self.assertFalse(pipeline.is_saturated())
+
+        future = asyncio.get_running_loop().create_future()
+        pipeline.track(future)
+        self.assertTrue(pipeline.is_saturated())
+        self.assertEqual(pipeline.gauges["tasks"], 1)
+        future.set_result(None)
+        await asyncio.sleep(0)
+        self.assertEqual(pipeline.gauges["tasks"], 0)
+        self.assertFalse(pipeline.is_saturated())
+
+    async def test_put_into_full_queue(self):
+        pipeline = Pipeline(queue_size=1)
+        pipeline.put(b"1")
+        pipeline.put(b"2")
+        await asyncio.sleep(0)
+        self.assertEqual(pipeline.gauges["queue_depth"], 1)
+        self.assertEqual(await pipeline.queue.get(), b"1")
+        self.assertEqual(await pipeline.queue.get(), b"2")
+
+    async def test_delayed_ack(self):
+        pipeline = Pipeline(queue_size=1)
+        pipeline.put(b"message")
+
+        protocol = ASTMProtocol(pipeline=pipeline)
+        transport = self.get_mock_transport()
+        protocol.connection_made(transport)
+        stream, frames = self.get_session("sysmex_xn550.txt")
+        protocol.data_received(stream)
+
+        # the pipeline is saturated, the ACK of the ENQ is delayed
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.get_responses(transport), [])
+        transport.pause_reading.assert_called_once()
+        self.assertEqual(pipeline.gauges["delayed_acks"], 1)
+
+        # the session continues when the pipeline has capacity again
+        pipeline.queue.get_nowait()
+        await asyncio.sleep(0.1)
+        transport.resume_reading.assert_called_once()
+        self.assertEqual(self.get_responses(transport),
+                         [ACK] * (len(frames) + 1))
+        self.assertEqual(pipeline.gauges["delayed_acks"], 0)
+        self.assertEqual(pipeline.gauges["total_delayed_acks"], 1)
+        self.assertEqual(pipeline.queue.qsize(), 1)
+        protocol.close_connection()
+
+    async def test_wait(self):
+        pipeline = Pipeline(queue_size=1)
+        pipeline.put(b"message")
+        waiter = asyncio.ensure_future(pipeline.wait(10))
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+        # the waiter is woken up when the consumer takes the message
+        await pipeline.queue.get()
+        self.assertTrue(await asyncio.wait_for(waiter, 0.1))
+        pipeline.put(b"message")
+        self.assertFalse(await pipeline.wait(0.01))
+
+    async def test_delayed_ack_timeout(self):
+        pipeline = Pipeline(queue_size=1)
+        pipeline.put(b"message")
+
+        protocol = ASTMProtocol(pipeline=pipeline, ack_delay=0.05)
+        transport = self.get_mock_transport()
+        protocol.connection_made(transport)
+        protocol.data_received(ENQ)
+
+        # a new transfer is rejected within the time budget of the
+        # instrument, so that it retries it later
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.get_responses(transport), [NAK])
+        self.assertFalse(protocol.in_transfer_state)
+        transport.resume_reading.assert_called_once()
+
+        # the frames of a running transfer are acknowledged
+        pipeline.queue.get_nowait()
+        stream, frames = self.get_session("sysmex_xn550.txt")
+        protocol.data_received(ENQ)
+        pipeline.put(b"message")
+        protocol.data_received(frames[0] + CRLF)
+        self.assertEqual(self.get_responses(transport), [NAK, ACK])
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.get_responses(transport), [NAK, ACK, ACK])
+        protocol.close_connection()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import IsolatedAsyncioTestCase
+from unittest import TestCase
+
+from senaite.astm.pusher import CircuitBreaker
+from senaite.astm.pusher import Pusher
+from senaite.astm.pusher import get_backoff
+from senaite.astm.spool import Spool
+
+
+class Clock(object):
+    """Manually advanced clock
+    """
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(TestCase):
+    """Test the circuit breaker and the backoff
+    """
+
+    def test_backoff(self):
+        self.assertEqual(get_backoff(1, 5, rand=lambda: 1), 5)
+        self.assertEqual(get_backoff(3, 5, rand=lambda: 1), 20)
+        self.assertEqual(get_backoff(10, 5, 60, rand=lambda: 1), 60)
+        self.assertEqual(get_backoff(3, 5, rand=lambda: 0.5), 10)
+        for i in range(100):
+            self.assertTrue(0 <= get_backoff(2, 1) <= 2)
+
+    def test_circuit_breaker(self):
+        clock = Clock()
+        breaker = CircuitBreaker(threshold=2, timeout=10, clock=clock)
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        # the circuit is open after two consecutive failures
+        self.assertTrue(breaker.is_open)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.remaining(), 10)
+
+        # a single probe is let through after the timeout
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        # a failed probe opens the circuit again
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        clock.now = 20
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertFalse(breaker.is_open)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+
+class PusherTest(IsolatedAsyncioTestCase):
+    """Test the asyncio pusher
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.spool = Spool(os.path.join(self.tempdir, "spool.db"))
+        self.pushed = []
+        self.failures = 0
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.tempdir)
+
+    def push(self, messages):
+        if self.failures:
+            self.failures -= 1
+            return False
+        self.pushed.append(messages)
+        return True
+
+    async def run_pusher(self, pusher, count, task=None, timeout=2):
+        """Run the pusher until `count` messages were pushed
+        """
+        if task is None:
+            task = asyncio.create_task(pusher.run())
+        deadline = time.monotonic() + timeout
+        while sum(map(len, self.pushed)) < count:
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.01)
+        # let the pusher process the result of the last push
+        await asyncio.sleep(0.05)
+        task.cancel()
+        pusher.close()
+
+    async def test_push(self):
+        pusher = Pusher(self.spool, self.push, delay=0.01)
+        # fail the first delivery
+        self.failures = 1
+        self.spool.put(b"1")
+        pusher.notify()
+        self.spool.put(b"2")
+        pusher.notify()
+        await self.run_pusher(pusher, 2)
+        self.assertEqual(sum(self.pushed, []), [b"1", b"2"])
+        self.assertEqual(len(self.spool), 0)
+
+    async def test_batch_window(self):
+        pusher = Pusher(self.spool, self.push, batch_size=10,
+                        batch_window=0.2)
+        threads = set()
+        count = self.spool.count
+
+        def counting(*args):
+            threads.add(threading.current_thread())
+            return count(*args)
+
+        self.spool.count = counting
+        task = asyncio.create_task(pusher.run())
+        for i in range(5):
+            self.spool.put(i)
+            pusher.notify()
+            await asyncio.sleep(0.01)
+        await self.run_pusher(pusher, 5, task=task)
+        # all messages were coalesced within the window
+        self.assertEqual(self.pushed, [[0, 1, 2, 3, 4]])
+        # the pending entries were never counted on the event loop
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    async def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, timeout=0.1)
+        pusher = Pusher(self.spool, self.push, delay=0.01, breaker=breaker)
+        self.failures = 2
+        self.spool.put(b"1")
+        task = asyncio.create_task(pusher.run())
+        await asyncio.sleep(0.05)
+        # the circuit opened after the second failure
+        self.assertTrue(breaker.is_open)
+        self.assertEqual(self.pushed, [])
+        await self.run_pusher(pusher, 1, task=task)
+        self.assertEqual(self.pushed, [[b"1"]])
+        self.assertFalse(breaker.is_open)
+
+    async def test_push_error(self):
+        errors = [ValueError("Expecting value: line 1 column 1")]
+
+        def push(messages):
+            if errors:
+                raise errors.pop()
+            return self.push(messages)
+
+        breaker = CircuitBreaker(threshold=2, timeout=0.1)
+        pusher = Pusher(self.spool, push, delay=0.01, breaker=breaker)
+        self.spool.put(b"1")
+        # the pusher survives the error and delivers the message later
+        await self.run_pusher(pusher, 1)
+        self.assertEqual(self.pushed, [[b"1"]])
+        self.assertEqual(len(self.spool), 0)
+
+    async def test_rejected_by_circuit(self):
+        breaker = CircuitBreaker(threshold=1, timeout=10)
+        breaker.failure()
+        pusher = Pusher(self.spool, self.push, breaker=breaker)
+        self.spool.put(b"1")
+        # a rejected batch is no failed delivery
+        self.assertIsNone(await pusher.deliver())
+        self.assertEqual(breaker.failures, 1)
+        self.assertEqual(self.spool.pending()[0][0], 1)
+        pusher.close()
+
+    async def test_concurrency(self):
+        threads = set()
+        lock = threading.Lock()
+
+        def push(messages):
+            with lock:
+                threads.add(threading.current_thread().name)
+            time.sleep(0.05)
+            return self.push(messages)
+
+        pusher = Pusher(self.spool, push, concurrency=4)
+        for i in range(8):
+            self.spool.put(i)
+        start = time.monotonic()
+        await self.run_pusher(pusher, 8)
+        # the pushes ran in parallel in the dedicated executor
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertEqual(sorted(sum(self.pushed, [])), list(range(8)))
+        self.assertEqual(len(threads), 4)
+        self.assertTrue(all(t.startswith("senaite-push") for t in threads))
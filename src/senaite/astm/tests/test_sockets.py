@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import socket
+from unittest import TestCase
+from unittest import skipUnless
+from unittest.mock import MagicMock
+from unittest.mock import Mock
+
+from senaite.astm.constants import ENQ
+from senaite.astm.protocol import ASTMProtocol
+from senaite.astm.sockets import SocketOptions
+from senaite.astm.tests.base import ASTMTestBase
+
+
+class SocketOptionsTest(TestCase):
+    """Test the TCP options of the instrument connections
+    """
+
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    def tearDown(self):
+        self.sock.close()
+
+    def getsockopt(self, level, option):
+        return self.sock.getsockopt(level, option)
+
+    def test_defaults(self):
+        SocketOptions().apply(self.sock)
+        self.assertTrue(
+            self.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertFalse(
+            self.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+
+    def test_nagle(self):
+        SocketOptions(nodelay=False).apply(self.sock)
+        self.assertFalse(
+            self.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+
+    def test_buffers(self):
+        default = self.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        SocketOptions(rcvbuf=default * 2, sndbuf=default * 2).apply(self.sock)
+        self.assertGreater(
+            self.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), default)
+        self.assertGreater(
+            self.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF), 0)
+
+    def test_keepalive(self):
+        SocketOptions(keepalive=30).apply(self.sock)
+        self.assertTrue(
+            self.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            self.assertEqual(
+                self.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 30)
+
+    @skipUnless(hasattr(socket, "TCP_QUICKACK"), "Linux only")
+    def test_quickack(self):
+        options = SocketOptions(quickack=True)
+        self.assertIn((socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1),
+                      options.get_options())
+        sock = Mock()
+        options.rearm(sock)
+        sock.setsockopt.assert_called_once_with(
+            socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        # not set again if disabled
+        sock = Mock()
+        SocketOptions().rearm(sock)
+        sock.setsockopt.assert_not_called()
+
+    def test_unsupported(self):
+        # options of unsupported sockets are skipped
+        sock = Mock()
+        sock.setsockopt.side_effect = OSError("not supported")
+        SocketOptions(keepalive=30).apply(sock)
+        SocketOptions().apply(None)
+
+
+class ProtocolSocketOptionsTest(ASTMTestBase):
+    """Test the TCP options of the protocol
+    """
+
+    async def test_connection_made(self):
+        options = MagicMock()
+        sock = Mock()
+        transport = MagicMock()
+        transport.get_extra_info = Mock(
+            side_effect=lambda name: {"peername": ("127.0.0.1", 1),
+                                      "socket": sock}[name])
+        protocol = ASTMProtocol(socket_options=options)
+        protocol.connection_made(transport)
+        options.apply.assert_called_once_with(sock)
+        protocol.data_received(ENQ)
+        options.rearm.assert_called_once_with(sock)
+        protocol.cancel_timer()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+from senaite.astm.spool import PARKED
+from senaite.astm.spool import PENDING
+from senaite.astm.spool import RAW
+from senaite.astm.spool import SUSPECT_ATTEMPTS
+from senaite.astm.spool import Metrics
+from senaite.astm.spool import Spool
+from senaite.astm.spool import deliver
+from senaite.astm.spool import iter_batches
+from senaite.astm.spool import pack_frames
+from senaite.astm.spool import unpack_frames
+
+
+class SpoolTest(TestCase):
+    """Test the durable outbound spool
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "spool.db")
+        self.spool = Spool(self.path)
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_put_and_ack(self):
+        first = self.spool.put(b"1")
+        second = self.spool.put("2")
+        self.assertEqual(len(self.spool), 2)
+        pending = self.spool.pending()
+        self.assertEqual([(e[0], e[2]) for e in pending],
+                         [(first, b"1"), (second, "2")])
+        self.spool.ack(first)
+        self.assertEqual([e[0] for e in self.spool.pending()], [second])
+
+    def test_replay_after_restart(self):
+        for i in range(3):
+            self.spool.put(b"message")
+        self.spool.close()
+        self.spool = Spool(self.path)
+        self.assertEqual(len(self.spool), 3)
+
+    def test_raw_messages(self):
+        frames = [b"1H|\\^&\r\x03AB\r\n", b"2L|1\xff\r\x03CD\r\n"]
+        self.assertEqual(unpack_frames(pack_frames(frames)), frames)
+        first, second = self.spool.put_many(
+            [pack_frames(frames), pack_frames(frames[:1])], RAW)
+        # raw messages are not pushed before they are converted
+        self.assertEqual(len(self.spool), 0)
+        self.assertEqual(self.spool.pending(), [])
+        self.assertEqual([e[0] for e in self.spool.raw()], [first, second])
+        self.spool.convert(first, "converted")
+        self.spool.park(second)
+        self.assertEqual([e[2] for e in self.spool.pending()], ["converted"])
+        self.assertEqual(self.spool.raw(), [])
+        self.assertEqual(self.spool.count(PARKED), 1)
+
+    def test_migrate(self):
+        self.spool.close()
+        os.remove(self.path)
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "message BLOB NOT NULL)")
+        connection.execute(
+            "INSERT INTO messages (created, message) VALUES (0, 'old')")
+        connection.commit()
+        connection.close()
+        # messages spooled by older versions are still pushed
+        self.spool = Spool(self.path)
+        self.assertEqual([e[2] for e in self.spool.pending()], ["old"])
+        self.assertIn("messages_state", self.get_indexes())
+
+    def test_state_index(self):
+        cursor = self.spool.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM messages "
+            "WHERE state = ?", (PENDING, ))
+        self.assertIn("messages_state", cursor.fetchone()[-1])
+
+    def get_indexes(self):
+        cursor = self.spool.connection.execute("PRAGMA index_list(messages)")
+        return [row[1] for row in cursor.fetchall()]
+
+    def test_attempts(self):
+        self.spool.put(b"1")
+        for i in range(SUSPECT_ATTEMPTS):
+            with self.assertLogs("senaite.astm", "WARNING") as logs:
+                deliver(self.spool, lambda messages: False)
+        self.assertEqual(self.spool.pending()[0][3], SUSPECT_ATTEMPTS)
+        # the suspect message is reported once
+        self.assertIn("failed {} times".format(SUSPECT_ATTEMPTS),
+                      logs.output[-1])
+
+    def test_deliver(self):
+        pushed = []
+
+        def push(messages):
+            pushed.append(messages)
+            return True
+
+        for i in range(5):
+            self.spool.put(i)
+        # entries are fetched in limited chunks
+        self.assertEqual(deliver(self.spool, push, limit=2), 2)
+        self.assertEqual(len(self.spool), 3)
+        self.assertEqual(pushed, [[0], [1]])
+
+    def test_deliver_in_order(self):
+        pushed = []
+
+        def push(messages):
+            pushed.extend(messages)
+            return 3 not in messages
+
+        for i in range(5):
+            self.spool.put(i)
+        self.assertEqual(deliver(self.spool, push), -1)
+        self.assertEqual(pushed, [0, 1, 2, 3])
+        # the failed message and all following messages are kept
+        self.assertEqual([e[2] for e in self.spool.pending()], [3, 4])
+
+    def test_deliver_batches(self):
+        pushed = []
+        metrics = Metrics()
+
+        def push(messages):
+            pushed.append(messages)
+            return True
+
+        for i in range(7):
+            self.spool.put(b"x" * 10)
+        self.assertEqual(
+            deliver(self.spool, push, batch_size=3, metrics=metrics), 7)
+        self.assertEqual([len(batch) for batch in pushed], [3, 3, 1])
+        self.assertEqual(metrics.batches, 3)
+        self.assertEqual(metrics.messages, 7)
+        self.assertEqual(metrics.size, 70)
+
+    def test_batch_bytes(self):
+        entries = [(i, 0, b"x" * size) for i, size in enumerate(
+            [4, 4, 4, 20, 1])]
+        batches = list(iter_batches(entries, batch_size=10, batch_bytes=10))
+        self.assertEqual([[e[0] for e in b] for b in batches],
+                         [[0, 1], [2], [3], [4]])
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import pkgutil
+import re
+
+from senaite.astm import instruments
+from senaite.astm.tests.base import ASTMTestBase
+from senaite.astm.wrapper import DEFAULT_MAPPING
+from senaite.astm.wrapper import InstrumentRegistry
+from senaite.astm.wrapper import Wrapper
+from senaite.astm.wrapper import get_sender
+from senaite.astm.wrapper import registry
+
+
+def walk_instruments(header):
+    """Detect the instrument module by matching each module one by one
+    """
+    for importer, modname, ispkg in pkgutil.iter_modules(
+            instruments.__path__, instruments.__name__ + "."):
+        module = __import__(modname, fromlist="dummy")
+        regex = getattr(module, "HEADER_RX", None)
+        if regex and re.match(regex, header.decode()):
+            return module
+    return None
+
+
+class InstrumentRegistryTest(ASTMTestBase):
+    """Test the instrument detection
+    """
+
+    def setUp(self):
+        self.registry = InstrumentRegistry(instruments)
+
+    def test_get_sender(self):
+        header = b"\x021H|\\^&|||H500^910YOXH02826^2.2.2.2b|||||||Q|LIS2-A2|"
+        self.assertEqual(get_sender(header), b"H500^910YOXH02826^2.2.2.2b")
+
+        # GeneXpert uses a different repeat delimiter
+        header = b"\x021H|@^\\|URM-8lT4abZA-06||Hospital^GeneXpert^4.8|||||"
+        self.assertEqual(get_sender(header), b"Hospital^GeneXpert^4.8")
+
+        # the whole record is returned if there is no sender
+        self.assertEqual(get_sender(b"\x021H|\\^&"), b"\x021H|\\^&")
+        header = b"\x021H|\\^&||||||||||P|1"
+        self.assertEqual(get_sender(header), header)
+
+    def test_detect_instrument_files(self):
+        for path in self.instrument_files:
+            header = self.read_file_lines(path)[0]
+            module = self.registry.get_module(header)
+            self.assertIsNotNone(module, path)
+            self.assertEqual(module, walk_instruments(header))
+
+    def test_unknown_instrument(self):
+        header = b"\x021H|\\^&|||Unknown^1.0|||||||P|1|20230324135102"
+        self.assertIsNone(self.registry.get_module(header))
+        self.assertEqual(Wrapper([header]).mapping, DEFAULT_MAPPING)
+
+    def test_cache(self):
+        header = b"\x021H|\\^&|||H500^910YOXH02826^2.2.2.2b|||||||P|1|"
+        module = self.registry.get_module(header)
+        self.assertIn(b"H500^910YOXH02826^2.2.2.2b", self.registry.cache)
+
+        # the cached module is returned for the same sender
+        self.registry.regex = None
+        self.assertEqual(self.registry.get_module(header), module)
+
+        # the cache size is limited
+        self.registry.cache_size = 1
+        self.registry.load()
+        for sender in (b"H500^1", b"H500^2"):
+            self.registry.get_module(header.replace(b"H500^9", sender))
+        self.assertEqual(len(self.registry.cache), 1)
+
+    def test_cache_empty_sender(self):
+        # headers without a sender do not share a cache entry
+        self.registry.regex = re.compile(
+            "(?P<module0>.*\\|A$)|(?P<module1>.*\\|B$)")
+        self.registry.modules = {"module0": "A", "module1": "B"}
+        for module in ("A", "B"):
+            header = "\x021H|\\^&||||||||||P|1|{}".format(module)
+            self.assertEqual(
+                self.registry.get_module(header.encode()), module)
+
+    def test_wrapper_module(self):
+        path = self.get_instrument_file_path("cobas_c111.txt")
+        wrapper = Wrapper(self.read_file_lines(path))
+        self.assertEqual(wrapper.instrument, instruments.roche_cobas_c111)
+        # the payload is not changed by the detection
+        metadata = wrapper.to_dict()["metadata"]
+        self.assertEqual(sorted(metadata), ["astm", "lis2a"])
+
+    def test_trusted_instruments(self):
+        self.assertIn("genexpert", self.registry.get_names())
+        module = instruments.genexpert
+        self.assertFalse(self.registry.is_trusted(module))
+        self.assertFalse(self.registry.is_trusted(None))
+        self.registry.trusted.add("genexpert")
+        self.assertTrue(self.registry.is_trusted(module))
+
+    def test_trusted_mapping(self):
+        path = self.get_instrument_file_path("genexpert.txt")
+        messages = self.read_file_lines(path)
+        strict = Wrapper(messages)
+        registry.trusted.add("genexpert")
+        try:
+            trusted = Wrapper(messages)
+        finally:
+            registry.trusted.discard("genexpert")
+        self.assertTrue(trusted.mapping["R"]._trusted)
+        self.assertFalse(getattr(strict.mapping["R"], "_trusted", False))
+        self.assertEqual(trusted.to_dict(), strict.to_dict())
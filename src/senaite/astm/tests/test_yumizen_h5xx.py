@@ -215,3 +215,48 @@ class ASTMProtocolTest(ASTMTestBase):
         data = wrapper.to_dict()
         results = data.get("R")
         result = results[0]
+
+    def test_histograms_are_not_decoded_by_default(self):
+        self.test_communication()
+
+        wrapper = Wrapper(self.protocol.messages)
+        records = wrapper.to_dict().get("M")
+        self.assertEqual(len(records), 4)
+        self.assertNotIn("data", records[0])
+        self.assertEqual(records[0]["starting_range"], None)
+
+    def test_decode_histograms(self):
+        self.test_communication()
+
+        horiba_yumizen_h5xx.DECODE_HISTOGRAMS = True
+        try:
+            wrapper = Wrapper(self.protocol.messages)
+            data = wrapper.to_dict()
+        finally:
+            horiba_yumizen_h5xx.DECODE_HISTOGRAMS = False
+
+        rbc, plt, lmne, reagent = data.get("M")
+        self.assertEqual(rbc["kind"], "HISTOGRAM")
+        self.assertEqual(rbc["group"], "RBC/PLT")
+        self.assertEqual(rbc["name"], "RbcAlongRes")
+        self.assertEqual(rbc["parameters"], [0.0, 278.0, 0.0, 788.0, 2.0, 0.0])
+        self.assertEqual(len(rbc["data"]), 256)
+        self.assertEqual(plt["name"], "PltAlongRes")
+        self.assertEqual(len(plt["parameters"]), 12)
+        self.assertEqual(len(plt["data"]), 256)
+        self.assertEqual(lmne["kind"], "MATRIX")
+        self.assertEqual(len(lmne["data"]), 256)
+        self.assertTrue(all(isinstance(v, float) for v in lmne["data"]))
+        # reagent records carry no arrays
+        self.assertEqual(reagent["kind"], "REAGENT")
+        self.assertEqual(reagent["data"], None)
+        # the repeated reagent names and lots keep their structure
+        self.assertEqual(reagent["group"],
+                         [["CLEANER"], ["DILUENT"], ["LYSE"]])
+        self.assertEqual(reagent["name"], [
+            ["221114I1*", "20230307000000", "20230607"],
+            ["221031H1*", "20230307000000", "20230907"],
+            ["221026M11", "20230307000000", "20230507"],
+        ])
+        # the arrays are serialized as JSON lists
+        self.assertTrue(wrapper.to_json())
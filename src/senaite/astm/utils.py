@@ -1,22 +1,38 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import time
 from datetime import datetime
 from pathlib import Path
 
 from senaite.astm import logger
+from senaite.astm.constants import ACK
 from senaite.astm.constants import CR
 from senaite.astm.constants import CRLF
+from senaite.astm.constants import ENQ
+from senaite.astm.constants import EOT
 from senaite.astm.constants import ETB
 from senaite.astm.constants import ETX
 from senaite.astm.constants import LF
+from senaite.astm.constants import MAX_FRAME_SIZE
+from senaite.astm.constants import NAK
 from senaite.astm.constants import STX
 
-try:
-    from itertools import izip_longest
-except ImportError:  # Python 3
-    from itertools import zip_longest as izip_longest
+#: Single byte tokens that are passed as they are
+CONTROL_BYTES = frozenset(ENQ + ACK + NAK + EOT)
+#: Line endings that might follow the checksum of a frame
+EOL_BYTES = frozenset(CRLF)
+#: Characters that terminate or interrupt a frame
+FRAME_END_RX = re.compile(b"[" + re.escape(STX + ETX + ETB + ENQ + EOT) + b"]")
+#: Characters that start a new token
+TOKEN_START_RX = re.compile(
+    b"[" + re.escape(STX + ENQ + ACK + NAK + EOT) + b"]")
+#: Encoded frame numbers by their value modulo 8
+FRAME_NUMBERS = tuple(str(i).encode() for i in range(8))
+#: Maximum bytes of a pending frame. Some instruments exceed the frame size
+#: of the standard by far, e.g. the Yumizen H500 sends 26kB histogram frames
+MAX_PENDING_FRAME = 256 * MAX_FRAME_SIZE
 
 
 def u(s):
@@ -43,23 +59,33 @@ def write_message(message, path, dateformat="%Y-%m-%d_%H:%M:%S", ext=".txt"):
         path.mkdir(parents=True, exist_ok=True)
     now = datetime.now()
     timestamp = now.strftime(dateformat)
-    filename = "{}{}".format(timestamp, ext)
     # ensure we have a bytes type message
     if isinstance(message, str):
         message = bytes(message, "utf-8")
-    with open(os.path.join(path, filename), "wb") as f:
-        f.write(message)
+    # never overwrite messages written in the same second, e.g. by another
+    # server process
+    counter = 0
+    while True:
+        suffix = "_{}".format(counter) if counter else ""
+        filename = "{}{}{}".format(timestamp, suffix, ext)
+        try:
+            with open(os.path.join(path, filename), "xb") as f:
+                f.write(message)
+            break
+        except FileExistsError:
+            counter += 1
 
 
 def is_chunked_message(message):
     """Checks plain message for chunked byte.
     """
+    message = message.rstrip(CRLF)
     length = len(message)
-    if len(message) < 5:
+    if length < 3:
         return False
     if ETB not in message:
         return False
-    if message.index(ETB) != length - 5:
+    if message.index(ETB) != length - 3:
         return False
     return True
 
@@ -75,7 +101,7 @@ def make_checksum(message):
     """
     if not isinstance(message[0], int):
         message = map(ord, message)
-    return hex(sum(message) & 0xFF)[2:].upper().zfill(2).encode()
+    return b"%02X" % (sum(message) & 0xFF)
 
 
 def validate_checksum(message):
@@ -128,10 +154,36 @@ def join(chunks):
     :param chunks: List of chunks as `bytes`.
     :type chunks: iterable
     """
-    msg = b"1" + b"".join(c[2:-5] for c in chunks) + ETX
+    msg = b"1" + b"".join(c.rstrip(CRLF)[2:-3] for c in chunks) + ETX
     return b"".join([STX, msg, make_checksum(msg), CRLF])
 
 
+def is_header(message):
+    """Checks if the message starts with a header record (H)
+    """
+    return message[:1] == STX and message[2:3] == b"H"
+
+
+def split_messages(messages):
+    """Split the frames of one transfer into the messages H...L
+
+    Some instruments send several messages in one session between ENQ and
+    EOT. Every header record starts a new message, frames before the first
+    header belong to the first message.
+
+    :param messages: List of complete frames
+    :returns: List of frame lists, one per message
+    """
+    groups = []
+    header = False
+    for message in messages:
+        if not groups or (header and is_header(message)):
+            groups.append([])
+        header = header or is_header(message)
+        groups[-1].append(message)
+    return groups
+
+
 def split(msg, size):
     """Split `msg` into chunks with specified `size`.
 
@@ -147,26 +199,50 @@ def split(msg, size):
 
     :yield: `bytes`
     """
-    stx, frame, msg, tail = msg[:1], msg[1:2], msg[2:-6], msg[-6:]
+    stx, frame, tail = msg[:1], msg[1:2], msg[-6:]
     assert stx == STX
     assert frame.isdigit()
     assert tail.endswith(CRLF)
     assert size is not None and size >= 7
-    frame = int(frame)
-    chunks = make_chunks(msg, size - 7)
-    chunks, last = chunks[:-1], chunks[-1]
-    idx = 0
+    # the records of the message including the trailing CR
+    text = memoryview(msg)[2:-5]
+    for chunk in iter_frames(text, int(frame), size):
+        yield chunk
+
+
+def iter_frames(text, seq=1, size=None):
+    """Yields the frames of the text of a message
+
+    The text is sliced into frames of at most `size` bytes, all of them
+    terminated by ETB except the last one, which is terminated by ETX.
+
+    :param text: Records of the message, each terminated by CR
+    :type text: bytes or memoryview
+
+    :param seq: Sequence number of the first frame
+    :type seq: int
+
+    :param size: Maximum frame size in bytes or `None` for a single frame
+    :type size: int
+
+    :yield: `bytes`
+    """
+    if size is None or len(text) + 7 <= size:
+        chunks = [text]
+    else:
+        assert size > 7
+        chunks = make_chunks(text, size - 7)
+    last = len(chunks) - 1
     for idx, chunk in enumerate(chunks):
-        item = b"".join([str((idx + frame) % 8).encode(), chunk, ETB])
+        item = b"".join([FRAME_NUMBERS[(seq + idx) % 8], chunk,
+                         ETX if idx == last else ETB])
         yield b"".join([STX, item, make_checksum(item), CRLF])
-    item = b"".join([str((idx + frame + 1) % 8).encode(), last, CR, ETX])
-    yield b"".join([STX, item, make_checksum(item), CRLF])
 
 
 def make_chunks(s, n):
-    iter_bytes = (s[i:i + 1] for i in range(len(s)))
-    return [b''.join(item)
-            for item in izip_longest(*[iter_bytes] * n, fillvalue=b'')]
+    """Returns the slices of `s` with at most `n` bytes
+    """
+    return [s[i:i + n] for i in range(0, len(s), n)]
 
 
 class CleanupDict(dict):
@@ -199,3 +275,112 @@ class CleanupDict(dict):
             if timestamp < okay:
                 del self._last_access[key]
                 super(CleanupDict, self).__delitem__(key)
+
+
+class FrameBuffer(object):
+    """Incremental framer for a received ASTM byte stream.
+
+    The transport does not preserve the boundaries of what the instrument
+    sent, i.e. a single read might contain multiple frames and control
+    characters or only a part of a frame. The buffer collects the received
+    chunks and splits them into single control characters (ENQ, ACK, NAK,
+    EOT) and complete frames (STX...ETX/ETB + checksum).
+
+    Frames are emitted without the trailing line ending, because not all
+    instruments send one and it is not part of the checksum.
+
+    A pending frame that grows beyond `max_size` bytes, e.g. because its end
+    was lost, is emitted as malformed frame, so that it is rejected, and its
+    remaining data is skipped up to the next frame or control character.
+    """
+
+    def __init__(self, max_size=MAX_PENDING_FRAME):
+        self.buffer = bytearray()
+        self.max_size = max_size
+        # position where the search for the end of a pending frame continues
+        self.offset = 1
+        # skip the data of an overflowed frame
+        self.skip = False
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def clear(self):
+        """Discard all pending data
+        """
+        del self.buffer[:]
+        self.offset = 1
+        self.skip = False
+
+    def feed(self, data):
+        """Append the data to the buffer and return the complete tokens
+
+        :param data: Received chunk of data
+        :type data: bytes
+        :returns: generator of complete frames and control characters
+        """
+        self.buffer.extend(data)
+        return self.tokens()
+
+    def tokens(self):
+        """Yield all complete tokens of the buffer
+        """
+        buf = self.buffer
+        while buf:
+            head = buf[0]
+            if head == STX[0]:
+                self.skip = False
+                end = self.find_frame_end()
+                if end < 0 and len(buf) > self.max_size:
+                    logger.error("Frame exceeds {} bytes, discarding it"
+                                 .format(self.max_size))
+                    self.skip = True
+                    end = self.max_size
+                elif end < 0:
+                    # frame not yet complete
+                    return
+            elif head in CONTROL_BYTES:
+                self.skip = False
+                end = 1
+            elif head in EOL_BYTES:
+                # skip the line endings after the frames
+                del buf[:1]
+                continue
+            else:
+                # unknown data up to the next token
+                match = TOKEN_START_RX.search(buf, 1)
+                end = match.start() if match else len(buf)
+                if self.skip:
+                    # remaining data of an overflowed frame
+                    del buf[:end]
+                    continue
+            yield self.pop(end)
+
+    def pop(self, end):
+        """Remove the first `end` bytes from the buffer and return them
+        """
+        with memoryview(self.buffer) as view:
+            token = bytes(view[:end])
+        del self.buffer[:end]
+        self.offset = 1
+        return token
+
+    def find_frame_end(self):
+        """Returns the end position of the leading frame or -1 if incomplete
+        """
+        buf = self.buffer
+        match = FRAME_END_RX.search(buf, self.offset)
+        if match is None:
+            # remember the position to not scan the same data again
+            self.offset = len(buf)
+            return -1
+        pos = match.start()
+        if buf[pos] not in (ETX[0], ETB[0]):
+            # frame interrupted by a new frame or control character
+            return pos
+        # the frame is complete with the two checksum characters
+        end = pos + 3
+        if len(buf) < end:
+            self.offset = pos
+            return -1
+        return end
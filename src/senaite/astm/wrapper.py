@@ -3,12 +3,16 @@
 import json
 import pkgutil
 import re
+import threading
+from collections import OrderedDict
 from collections import defaultdict
 
 from senaite.astm import codec
 from senaite.astm import instruments
 from senaite.astm import records
 from senaite.astm.constants import ENCODING
+from senaite.astm.constants import RECORD_SEP
+from senaite.astm.mapping import get_trusted
 from senaite.astm.utils import split_message
 
 DEFAULT_MAPPING = {
@@ -23,34 +27,163 @@ DEFAULT_MAPPING = {
 }
 
 
+def get_sender(header):
+    """Returns the sender field of the header frame
+
+    Falls back to the whole header record if the sender can not be located
+    or is empty.
+
+    :param header: The first frame of the message
+    :type header: bytes
+    """
+    record = header.split(RECORD_SEP, 1)[0]
+    pos = record.find(b"H")
+    if pos < 0:
+        return record
+    # the character after the record type defines the field delimiter
+    sep = record[pos + 1:pos + 2]
+    fields = record[pos:].split(sep, 5) if sep else []
+    if len(fields) < 6 or not fields[4]:
+        return record
+    return fields[4]
+
+
+class InstrumentRegistry(object):
+    """Registry of the instrument modules
+
+    The `HEADER_RX` patterns of all instrument modules are compiled once into
+    a single regular expression with one named group per module, so that the
+    instrument of a message is detected in a single pass. The detected module
+    is cached by the sender of the header, because the same analyzers send
+    their messages over and over again.
+
+    The records of trusted instruments are wrapped without validation. An
+    instrument is trusted if its module sets `TRUSTED` or if its module name
+    is in `trusted`.
+    """
+
+    def __init__(self, package, cache_size=128, trusted=()):
+        self.package = package
+        self.cache_size = cache_size
+        self.trusted = set(trusted)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.modules = None
+        self.regex = None
+
+    def load(self):
+        """Import the instrument modules and compile the header patterns
+        """
+        modules = {}
+        patterns = []
+        for importer, modname, ispkg in pkgutil.iter_modules(
+                self.package.__path__, self.package.__name__ + "."):
+            module = __import__(modname, fromlist="dummy")
+            # get the regular expression to match the header message
+            regex = getattr(module, "HEADER_RX", None)
+            if not regex:
+                continue
+            group = "module{}".format(len(modules))
+            modules[group] = module
+            patterns.append("(?P<{}>{})".format(group, regex))
+        self.regex = re.compile("|".join(patterns))
+        self.modules = modules
+        self.clear()
+
+    def get_names(self):
+        """Returns the names of the instrument modules
+        """
+        if self.modules is None:
+            self.load()
+        return sorted(module.__name__.rsplit(".", 1)[-1]
+                      for module in self.modules.values())
+
+    def is_trusted(self, module):
+        """Checks if the records of the instrument module are trusted
+        """
+        if module is None:
+            return False
+        if getattr(module, "TRUSTED", False):
+            return True
+        return module.__name__.rsplit(".", 1)[-1] in self.trusted
+
+    def clear(self):
+        """Flush the cache of detected instruments
+        """
+        with self.lock:
+            self.cache.clear()
+
+    def detect(self, header):
+        """Returns the first instrument module that matches the header
+        """
+        if self.modules is None:
+            self.load()
+        match = self.regex.match(header.decode(ENCODING))
+        if match is None:
+            return None
+        return self.modules[match.lastgroup]
+
+    def get_module(self, header):
+        """Returns the (cached) instrument module for the header frame
+
+        :param header: The first frame of the message
+        :type header: bytes
+        :returns: Instrument module or None
+        """
+        key = get_sender(header)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        module = self.detect(header)
+        with self.lock:
+            self.cache[key] = module
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return module
+
+
+#: Global registry of the known instruments
+registry = InstrumentRegistry(instruments)
+
+
 class Wrapper(object):
     """Message wrapper
     """
     def __init__(self, messages):
         self.messages = messages
+        self.instrument = self.get_module(messages)
         self.mapping = self.get_mapping(messages)
+        self.delimiters = self.get_delimiters(messages)
         self.module = None
 
-    def get_mapping(self, messages):
-        """Returns the record mapping for the message
+    def get_module(self, messages):
+        """Returns the instrument module for the message
         """
         if not messages:
-            return DEFAULT_MAPPING
-        header = messages[0]
+            return None
+        return registry.get_module(messages[0])
 
-        for importer, modname, ispkg in pkgutil.iter_modules(
-                instruments.__path__, instruments.__name__ + "."):
-            module = __import__(modname, fromlist="dummy")
-            # get the regular expression to match the header message
-            regex = getattr(module, "HEADER_RX", None)
-            if regex and re.match(regex, header.decode()):
-                mapping = getattr(module, "get_mapping", None)
-                if callable(mapping):
-                    return mapping()
-                # remember the matching module
-                self.module = module
+    def get_delimiters(self, messages):
+        """Returns the delimiters declared by the header of the message
+        """
+        if not messages:
+            return codec.DEFAULT_DELIMITERS
+        return codec.get_delimiters(messages[0])
 
-        return DEFAULT_MAPPING
+    def get_mapping(self, messages):
+        """Returns the record mapping for the message
+        """
+        module = self.get_module(messages)
+        mapping = getattr(module, "get_mapping", None)
+        if callable(mapping):
+            mapping = mapping()
+        else:
+            mapping = DEFAULT_MAPPING
+        if registry.is_trusted(module):
+            return {rtype: get_trusted(record)
+                    for rtype, record in mapping.items()}
+        return mapping
 
     def to_lis2a(self, encoding=ENCODING):
         out = b""
@@ -76,8 +209,6 @@ class Wrapper(object):
             }
         """
 
-        # get the record mapping if provided
-        mapping = self.get_mapping(self.messages)
         # Prepare some metadata
         metadata = {
             "astm": self.to_astm(),
@@ -92,23 +223,88 @@ class Wrapper(object):
         out = defaultdict(list)
         out["metadata"] = metadata
 
+        for rtype, data in self.get_records():
+            out[rtype].append(data)
+
+        return out
+
+    def get_records(self):
+        """Returns a list of (record type, value dictionary) tuples
+        """
+        records = []
         for message in self.messages:
-            records = codec.decode(message)
-
-            for record in records:
-                rtype = record[0]
-                if rtype not in mapping:
-                    continue
-                try:
-                    wrapper = mapping[rtype](*record)
-                except ValueError as exc:
-                    raise ValueError("Could not wrap '%s' record! (%s)"
-                                     % (rtype, str(exc)))
-                out[rtype].append(wrapper.to_dict())
+            records.extend(self.map_message(message))
+        return records
+
+    def map_message(self, message):
+        """Decode the message and wrap its records with the record mapping
 
+        :returns: list of (record type, value dictionary) tuples
+        """
+        mapping = self.mapping
+        out = []
+        for record in codec.decode(message, delimiters=self.delimiters):
+            rtype = record[0]
+            if rtype not in mapping:
+                continue
+            try:
+                wrapper = mapping[rtype](*record)
+            except ValueError as exc:
+                raise ValueError("Could not wrap '%s' record! (%s)"
+                                 % (rtype, str(exc)))
+            out.append((rtype, wrapper.to_dict()))
         return out
 
     def to_json(self):
         data = json.dumps(self.to_dict())
         # Return the JSON encoded to bytes.
         return data.encode()
+
+
+class IncrementalWrapper(Wrapper):
+    """Message wrapper that decodes the messages while they are received
+
+    The instrument and the record mapping are fixed by the first message,
+    i.e. the header, and every further message is decoded and mapped when it
+    is fed, so that only the serialization is left at the end of the
+    transfer.
+    """
+    def __init__(self, messages=None):
+        self.messages = []
+        self.instrument = None
+        self.module = None
+        self.mapping = None
+        self.delimiters = None
+        self.records = []
+        self.error = None
+        for message in messages or []:
+            self.feed(message)
+
+    def feed(self, message):
+        """Decode and map the records of the next message
+        """
+        if not self.messages:
+            self.instrument = self.get_module([message])
+            self.mapping = self.get_mapping([message])
+            self.delimiters = self.get_delimiters([message])
+        self.messages.append(message)
+        # report decoding errors when the message is serialized
+        if self.error is not None:
+            return
+        try:
+            self.records.extend(self.map_message(message))
+        except Exception as exc:
+            self.error = exc
+
+    def __getstate__(self):
+        # the records are already mapped when the wrapper is serialized in
+        # a process pool, the modules and mapping classes are not needed
+        state = self.__dict__.copy()
+        state["instrument"] = None
+        state["mapping"] = None
+        return state
+
+    def get_records(self):
+        if self.error is not None:
+            raise self.error
+        return self.records